@@ -1,23 +1,31 @@
 """This is a module which builds Innosetup .iss files from a Jinja2 template."""
 
+# Only cheap modules are imported here: the module is imported by many short
+# lived tooling processes, so jinja2, subprocess, tempfile and platform are
+# imported by the functions which need them.
+import functools
+import json
+import os
 import pathlib
-import platform
-import subprocess
+import re
 import sys
-import tempfile
-from typing import Any, Dict, Generator, List, Optional, Union
-try:
-    import winreg
-except ImportError:
-    pass
+import time
+from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Optional, Tuple, Union
 
 if sys.version_info >= (3, 11):
     from enum import StrEnum
 else:
-    from backports.strenum import StrEnum
+    from enum import Enum
+
+    class StrEnum(str, Enum):
+        """Minimal stand-in for enum.StrEnum on Python < 3.11."""
+
+        def __str__(self) -> str:
+            return str(self.value)
 
 
-import jinja2
 from attr import Factory, define, field
 
 
@@ -94,6 +102,41 @@ class FileFlags(StrEnum):
     SKIP_IF_SOURCE_DOESNT_EXIST = "skipifsourcedoesntexist"
 
 
+# section -> (header, loop variable, row) for the sections made of one row per entry.
+# innosetup_template is assembled from these, and script fragments render them on
+# their own over a subset of the entries.
+SECTION_ROWS = {
+    'types': ('Types', 'type',
+              """Name: "{{ type.name }}"; Description: "{{ type.description }}"{% if type.flags %}; Flags: {{ type.flags }}{% endif %}"""),
+    'components': ('Components', 'component',
+              """Name: "{{ component.name }}"; Description: "{{ component.description }}"{% if component.types %}; Types: {{ component.types }}{% endif %}{% if component.extra_disk_space_required %}; ExtraDiskSpaceRequired: {{ component.extra_disk_space_required }}{% endif %}{% if component.flags %}; Flags: {{ component.flags }}{% endif %}"""),
+    'files': ('Files', 'file',
+              """Source: "{{ file.source }}"; DestDir: "{app}{% if file.destination %}\\{{ file.destination }}{% endif %}"{% if file.dest_name %}; DestName: "{{ file.dest_name }}"{% endif %}{% if file.excludes %}; Excludes: "{{ file.excludes }}"{% endif %}{% if file.external_size %}; ExternalSize: {{ file.external_size }}{% endif %}{% if file.attribs %}; Attribs: {{ file.attribs }}{% endif %}{% if file.permissions %}; Permissions: {{ file.permissions }}{% endif %}{% if file.font_install %}; FontInstall: "{{ file.font_install }}"{% endif %}{% if file.strong_assembly_name %}; StrongAssemblyName: "{{ file.strong_assembly_name }}"{% endif %}{% if file.flags_string %}; Flags: {{ file.flags_string }}{% endif %}{% if file.components %}; Components: {{ file.components }}{% endif %}"""),
+    'dirs': ('Dirs', 'dir',
+              """Name: "{{ dir.name }}"{% if dir.permissions %}; Permissions: {{ dir.permissions }}{% endif %}{% if dir.attribs %}; Attribs: {{ dir.attribs }}{% endif %}{% if dir.flags %}; Flags: {{ dir.flags }}{% endif %}{% if dir.components %}; Components: {{ dir.components }}{% endif %}"""),
+    'registry': ('Registry', 'entry',
+              """Root: {{ entry.root }}; Subkey: "{{ entry.subkey }}"{% if entry.value_type != "none" %}; ValueType: {{ entry.value_type }}{% endif %}{% if entry.value_name %}; ValueName: "{{ entry.value_name }}"{% endif %}{% if entry.value_data %}; ValueData: "{{ entry.value_data }}"{% endif %}{% if entry.permissions %}; Permissions: {{ entry.permissions }}{% endif %}{% if entry.flags %}; Flags: {{ entry.flags }}{% endif %}{% if entry.components %}; Components: {{ entry.components }}{% endif %}"""),
+    'run': ('Run', 'entry',
+              """Filename: "{{ entry.filename }}"{% if entry.description %}; Description: "{{ entry.description }}"{% endif %}{% if entry.parameters %}; Parameters: "{{ entry.parameters }}"{% endif %}{% if entry.working_dir %}; WorkingDir: "{{ entry.working_dir }}"{% endif %}{% if entry.status_msg %}; StatusMsg: "{{ entry.status_msg }}"{% endif %}{% if entry.verb %}; Verb: "{{ entry.verb }}"{% endif %}{% if entry.flags %}; Flags: {{ entry.flags }}{% endif %}{% if entry.components %}; Components: {{ entry.components }}{% endif %}"""),
+    'uninstallrun': ('UninstallRun', 'entry',
+              """Filename: "{{ entry.filename }}"{% if entry.parameters %}; Parameters: "{{ entry.parameters }}"{% endif %}{% if entry.working_dir %}; WorkingDir: "{{ entry.working_dir }}"{% endif %}{% if entry.runonce_id %}; RunOnceId: "{{ entry.runonce_id }}"{% endif %}{% if entry.verb %}; Verb: "{{ entry.verb }}"{% endif %}{% if entry.flags %}; Flags: {{ entry.flags }}{% endif %}{% if entry.components %}; Components: {{ entry.components }}{% endif %}"""),
+}
+
+
+def _section_template(section: str, entries: str) -> str:
+    """The template of one section whose rows come from the ``entries`` expression."""
+    header, variable, row = SECTION_ROWS[section]
+    return ("{% if " + entries + " %}\n[" + header + "]\n{% for " + variable + " in " + entries + " %}\n"
+            + row + "\n{% endfor %}\n{% endif %}\n")
+
+
+def _section_block(section: str, entries: str, setup: str = "") -> str:
+    """A section of innosetup_template, which ``section_text`` can replace, for
+    instance by #include lines when it was sharded into fragments."""
+    return ("{% if section_text is defined and section_text." + section + " is defined %}{{ section_text." + section
+            + " }}{% else %}" + setup + _section_template(section, entries) + "{% endif %}")
+
+
 innosetup_template = """\
 [Setup]
 AppName={{ installer.app_name }}
@@ -104,52 +147,23 @@ DefaultGroupName={{ installer.app_name }}
 AppVersion  ={{ installer.app_version }}
 Compression=lzma2/ultra
 VersionInfoProductName={{ installer.app_name }}
-{%- if installer.license_file -%}
+{%- if installer.license_file %}
 LicenseFile={{ installer.license_file }}
 {%- endif -%}
 {% if installer.output_base_filename %}
 OutputBaseFilename={{ installer.output_base_filename }}
 {% endif %}
 
-{% if installer.component_types %}
-[Types]
-{% for type in installer.component_types %}
-Name: "{{ type.name }}"; Description: "{{ type.description }}"{% if type.flags %}; Flags: {{ type.flags }}{% endif %}
-{% endfor %}
-{% endif %}
-
-{% if installer.components %}
-[Components]
-{% for component in installer.components %}
-Name: "{{ component.name }}"; Description: "{{ component.description }}"{% if component.types %}; Types: {{ component.types }}{% endif %}{% if component.extra_disk_space_required %}; ExtraDiskSpaceRequired: {{ component.extra_disk_space_required }}{% endif %}{% if component.flags %}; Flags: {{ component.flags }}{% endif %}
-{% endfor %}
-{% endif %}
-
-{% if installer.files %}
-[Files]
-{% for file in installer.files %}
-Source: "{{ file.source }}"; DestDir: "{app}{% if file.destination %}\\{{ file.destination }}{% endif %}"{% if file.dest_name %}; DestName: "{{ file.dest_name }}"{% endif %}{% if file.excludes %}; Excludes: "{{ file.excludes }}"{% endif %}{% if file.external_size %}; ExternalSize: {{ file.external_size }}{% endif %}{% if file.attribs %}; Attribs: {{ file.attribs }}{% endif %}{% if file.permissions %}; Permissions: {{ file.permissions }}{% endif %}{% if file.font_install %}; FontInstall: "{{ file.font_install }}"{% endif %}{% if file.strong_assembly_name %}; StrongAssemblyName: "{{ file.strong_assembly_name }}"{% endif %}{% if file.flags_string %}; Flags: {{ file.flags_string }}{% endif %}{% if file.components %}; Components: {{ file.components }}{% endif %}
-{% endfor %}
-{% endif %}
-
-{% if installer.dirs %}
-[Dirs]
-{% for dir in installer.dirs %}
-Name: "{{ dir.name }}"{% if dir.permissions %}; Permissions: {{ dir.permissions }}{% endif %}{% if dir.attribs %}; Attribs: {{ dir.attribs }}{% endif %}{% if dir.flags %}; Flags: {{ dir.flags }}{% endif %}{% if dir.components %}; Components: {{ dir.components }}{% endif %}
-{% endfor %}
-{% endif %}
-
-{% if installer.registry_entries %}
-[Registry]
-{% for entry in installer.registry_entries %}
-Root: {{ entry.root }}; Subkey: "{{ entry.subkey }}"{% if entry.value_type != "none" %}; ValueType: {{ entry.value_type }}{% endif %}{% if entry.value_name %}; ValueName: "{{ entry.value_name }}"{% endif %}{% if entry.value_data %}; ValueData: "{{ entry.value_data }}"{% endif %}{% if entry.permissions %}; Permissions: {{ entry.permissions }}{% endif %}{% if entry.flags %}; Flags: {{ entry.flags }}{% endif %}{% if entry.components %}; Components: {{ entry.components }}{% endif %}
-{% endfor %}
-{% endif %}
-
+""" + _section_block('types', "installer.component_types") + """
+""" + _section_block('components', "installer.components") + """
+""" + _section_block('files', "installer.files") + """
+""" + _section_block('dirs', "installer.dirs") + """
+""" + _section_block('registry', "registry_entries",
+                  "{% set registry_entries = installer.all_registry_entries() %}") + """
 {% if installer.multilingual %}
 [Languages]
 MessagesFile: "compiler:Default.isl"; Name: "Default"
-{% for language in innosetup.available_languages() %}
+{% for language in installer.selected_languages(innosetup) %}
 MessagesFile: "{{ language.messages_file }}"; Name: "{{ language.name }}"
 {% endfor %}
 {% endif %}
@@ -174,21 +188,9 @@ Tasks: "startup"; ValueType: "string"; ValueData: "{app}\\{{ installer.main_exec
 {% endif %}
 {% endif %}
 
-{% if installer.run_entries %}
-[Run]
-{% for entry in installer.run_entries %}
-Filename: "{{ entry.filename }}"{% if entry.description %}; Description: "{{ entry.description }}"{% endif %}{% if entry.parameters %}; Parameters: "{{ entry.parameters }}"{% endif %}{% if entry.working_dir %}; WorkingDir: "{{ entry.working_dir }}"{% endif %}{% if entry.status_msg %}; StatusMsg: "{{ entry.status_msg }}"{% endif %}{% if entry.verb %}; Verb: "{{ entry.verb }}"{% endif %}{% if entry.flags %}; Flags: {{ entry.flags }}{% endif %}{% if entry.components %}; Components: {{ entry.components }}{% endif %}
-{% endfor %}
-{% endif %}
-
-{% if installer.uninstall_run_entries %}
-[UninstallRun]
-{% for entry in installer.uninstall_run_entries %}
-Filename: "{{ entry.filename }}"{% if entry.parameters %}; Parameters: "{{ entry.parameters }}"{% endif %}{% if entry.working_dir %}; WorkingDir: "{{ entry.working_dir }}"{% endif %}{% if entry.runonce_id %}; RunOnceId: "{{ entry.runonce_id }}"{% endif %}{% if entry.verb %}; Verb: "{{ entry.verb }}"{% endif %}{% if entry.flags %}; Flags: {{ entry.flags }}{% endif %}{% if entry.components %}; Components: {{ entry.components }}{% endif %}
-{% endfor %}
-{% endif %}
-
-{{ innosetup.extra_iss }}
+""" + _section_block('run', "installer.run_entries") + """
+""" + _section_block('uninstallrun', "installer.uninstall_run_entries") + """
+{{ installer.extra_iss }}
 """
 
 
@@ -285,6 +287,552 @@ class Component:
     flags: str = field(default="")
 
 
+class FrozenEntry:
+    """Base of the frozen entry variants: immutable, hashable entries which render their row once.
+
+    Build them with freeze() or directly, e.g. FrozenFileEntry(source=..., destination=...),
+    and replace an entry with attr.evolve to change it. Sections holding them are
+    rendered by joining the cached rows, so re-rendering an installer in which a
+    few entries changed only renders those.
+    """
+    _section = ""
+
+    @property
+    def line(self) -> str:
+        """The entry's row in its section, rendered on first use."""
+        try:
+            return self.__dict__['_line']
+        except KeyError:
+            return _remember_line(self, _frozen_lines.get(self) or get_row_template(self._section).render(entry=self))
+
+
+@define(frozen=True, slots=False, cache_hash=True)
+class FrozenFileEntry(FrozenEntry, FileEntry):
+    """A frozen FileEntry; list flags are kept in their string form."""
+    _section = 'files'
+
+    def __attrs_post_init__(self) -> None:
+        if type(self.flags) is not str:
+            object.__setattr__(self, 'flags', self.flags_string)
+
+
+@define(frozen=True, slots=False, cache_hash=True)
+class FrozenRegistryEntry(FrozenEntry, RegistryEntry):
+    """A frozen RegistryEntry."""
+    _section = 'registry'
+
+
+@define(frozen=True, slots=False, cache_hash=True)
+class FrozenRunEntry(FrozenEntry, RunEntry):
+    """A frozen RunEntry."""
+    _section = 'run'
+
+
+@define(frozen=True, slots=False, cache_hash=True)
+class FrozenUninstallRunEntry(FrozenEntry, UninstallRunEntry):
+    """A frozen UninstallRunEntry."""
+    _section = 'uninstallrun'
+
+
+@define(frozen=True, slots=False, cache_hash=True)
+class FrozenDirEntry(FrozenEntry, DirEntry):
+    """A frozen DirEntry."""
+    _section = 'dirs'
+
+
+@define(frozen=True, slots=False, cache_hash=True)
+class FrozenComponentType(FrozenEntry, ComponentType):
+    """A frozen ComponentType."""
+    _section = 'types'
+
+
+@define(frozen=True, slots=False, cache_hash=True)
+class FrozenComponent(FrozenEntry, Component):
+    """A frozen Component."""
+    _section = 'components'
+
+
+# entry class -> its frozen variant
+FROZEN_ENTRIES: Dict[type, type] = {
+    FileEntry: FrozenFileEntry, RegistryEntry: FrozenRegistryEntry, RunEntry: FrozenRunEntry,
+    UninstallRunEntry: FrozenUninstallRunEntry, DirEntry: FrozenDirEntry, ComponentType: FrozenComponentType,
+    Component: FrozenComponent,
+}
+
+
+def freeze(entry: Any) -> Any:
+    """Return the frozen variant of an entry, or the entry itself when it is frozen already."""
+    if isinstance(entry, FrozenEntry):
+        return entry
+    frozen = next(FROZEN_ENTRIES[cls] for cls in type(entry).__mro__ if cls in FROZEN_ENTRIES)
+    return frozen(**{name: getattr(entry, name) for name in _field_names(frozen)})
+
+
+REG_ROOTS = {
+    'HKEY_LOCAL_MACHINE': 'HKLM',
+    'HKEY_CURRENT_USER': 'HKCU',
+    'HKEY_CLASSES_ROOT': 'HKCR',
+    'HKEY_USERS': 'HKU',
+    'HKEY_CURRENT_CONFIG': 'HKCC',
+}
+
+# order in which RegistryTree emits its roots
+REGISTRY_ROOT_ORDER = ['HKA', 'HKLM', 'HKCU', 'HKCR', 'HKU', 'HKCC']
+
+
+class RegistryConflictError(ValueError):
+    """Raised when a registry value is given two different definitions."""
+
+
+@define
+class RegistryValue:
+    """An explicitly typed value for RegistryTree mappings."""
+    value_type: str = field(default="string")
+    value_data: str = field(default="")
+    flags: str = field(default="")
+    components: str = field(default="")
+
+
+@define
+class RegistryKey:
+    """A node of RegistryTree: one registry key with its values and subkeys."""
+    name: str = field(default="")
+    flags: str = field(default="")
+    components: str = field(default="")
+    explicit: bool = field(default=False)  # added as a key in its own right, not only as a parent
+    values: Dict[str, RegistryEntry] = field(default=Factory(dict))  # lower case value name -> entry
+    children: Dict[str, 'RegistryKey'] = field(default=Factory(dict))  # lower case name -> key
+
+
+def _registry_value(value: Any) -> RegistryValue:
+    """Convert a plain Python value from a mapping to a typed registry value."""
+    if isinstance(value, RegistryValue):
+        return value
+    if isinstance(value, str):
+        return RegistryValue(value_type="string", value_data=value)
+    if isinstance(value, bool):
+        return RegistryValue(value_type="dword", value_data=str(int(value)))
+    if isinstance(value, int):
+        return RegistryValue(value_type="dword" if 0 <= value < 2 ** 32 else "qword", value_data=str(value))
+    if isinstance(value, (bytes, bytearray)):
+        return RegistryValue(value_type="binary", value_data=" ".join("{:02x}".format(byte) for byte in value))
+    if isinstance(value, (list, tuple)):
+        return RegistryValue(value_type="multisz", value_data="{break}".join(value))
+    raise TypeError("Cannot store {!r} in the registry".format(value))
+
+
+def _merge_flags(existing: str, extra: str) -> str:
+    words = existing.split()
+    words.extend(word for word in extra.split() if word not in words)
+    return " ".join(words)
+
+
+@define
+class RegistryTree:
+    """Registry keys and values held in a trie, one node per key.
+
+    Keys are matched case-insensitively as Windows does, so adding the same key
+    twice merges it and adding the same value twice is a no-op. Giving a value two
+    different definitions raises RegistryConflictError as soon as it is added.
+    ``entries()`` emits the rows sorted and grouped by root and key.
+    """
+    roots: Dict[str, RegistryKey] = field(default=Factory(dict))
+
+    def __bool__(self) -> bool:
+        return bool(self.roots)
+
+    def _root(self, root: str) -> Tuple[str, RegistryKey]:
+        root = REG_ROOTS.get(root.upper(), root.upper())
+        node = self.roots.get(root)
+        if node is None:
+            node = self.roots[root] = RegistryKey(name=root)
+        return root, node
+
+    @staticmethod
+    def _child(node: RegistryKey, name: str) -> RegistryKey:
+        child = node.children.get(name.lower())
+        if child is None:
+            child = node.children[name.lower()] = RegistryKey(name=name)
+        return child
+
+    def _key(self, root: str, subkey: str) -> Tuple[str, RegistryKey]:
+        root, node = self._root(root)
+        for part in subkey.split("\\"):
+            if part:
+                node = self._child(node, part)
+        return root, node
+
+    def add_key(self, root: str, subkey: str, flags: str = "", components: str = "") -> RegistryKey:
+        """Add a key, merging its flags with any earlier definition."""
+        root, node = self._key(root, subkey)
+        self._mark_key(node, root, subkey, flags, components)
+        return node
+
+    @staticmethod
+    def _mark_key(node: RegistryKey, root: str, subkey: str, flags: str, components: str) -> None:
+        node.explicit = True
+        node.flags = _merge_flags(node.flags, flags)
+        if components and node.components and components != node.components:
+            raise RegistryConflictError("{}\\{} belongs to components {!r} and {!r}".format(
+                root, subkey, node.components, components))
+        node.components = node.components or components
+
+    def add_value(self, root: str, subkey: str, value_name: str, value: Any) -> None:
+        """Add a value; ``value`` is a RegistryValue or a plain str, int, bytes or list."""
+        root, node = self._key(root, subkey)
+        self._set_value(node, root, subkey, value_name, value)
+
+    @staticmethod
+    def _set_value(node: RegistryKey, root: str, subkey: str, value_name: str, value: Any) -> None:
+        value = _registry_value(value)
+        existing = node.values.get(value_name.lower())
+        if existing is None:
+            node.values[value_name.lower()] = RegistryEntry(
+                root=root, subkey=subkey, value_type=value.value_type, value_name=value_name,
+                value_data=value.value_data, flags=value.flags, components=value.components)
+        elif (existing.value_type, existing.value_data, existing.flags, existing.components) != \
+                (value.value_type, value.value_data, value.flags, value.components):
+            raise RegistryConflictError("{}\\{} value {!r} is both {} {!r} and {} {!r}".format(
+                root, subkey, value_name or "(Default)", existing.value_type, existing.value_data,
+                value.value_type, value.value_data))
+
+    def add_entry(self, entry: RegistryEntry) -> None:
+        """Add an existing RegistryEntry row."""
+        if entry.value_type == "none" and not entry.value_name:
+            self.add_key(entry.root, entry.subkey, flags=entry.flags, components=entry.components)
+        else:
+            self.add_value(entry.root, entry.subkey, entry.value_name,
+                           RegistryValue(value_type=entry.value_type, value_data=entry.value_data,
+                                         flags=entry.flags, components=entry.components))
+
+    def update(self, mapping: Dict[str, Any], root: Optional[str] = None, subkey: str = "") -> None:
+        """Merge a nested mapping: mappings are keys, anything else is a value.
+
+        Without ``root`` the top level of ``mapping`` names the roots. The value
+        name ``"@"`` sets the key's default value and an empty mapping adds the key
+        on its own.
+        """
+        if root is None:
+            for name, value in mapping.items():
+                self.update(value, root=name, subkey=subkey)
+            return
+        root, node = self._key(root, subkey)
+        self._update(node, root, subkey, mapping)
+
+    def _update(self, node: RegistryKey, root: str, subkey: str, mapping: Dict[str, Any]) -> None:
+        # descend the trie along with the mapping instead of looking every key up from its root
+        for name, value in mapping.items():
+            if isinstance(value, dict):
+                child_subkey = subkey + "\\" + name if subkey else name
+                child = self._child(node, name)
+                if not value:
+                    self._mark_key(child, root, child_subkey, "", "")
+                self._update(child, root, child_subkey, value)
+            else:
+                self._set_value(node, root, subkey, "" if name == "@" else name, value)
+
+    def entries(self) -> List[RegistryEntry]:
+        """Return the rows sorted by root, then depth first by key, key rows before their values.
+
+        The rows are copies, so changing one leaves the tree as it was.
+        """
+        import attr
+        rows: List[RegistryEntry] = []
+
+        def walk(root: str, node: RegistryKey, path: str) -> None:
+            if node.explicit and (node.flags or node.components or not node.values):
+                rows.append(RegistryEntry(root=root, subkey=path, flags=node.flags, components=node.components))
+            for _, value in sorted(node.values.items()):
+                # spell the subkey the way the key was first added
+                rows.append(attr.evolve(value, subkey=path))
+            for _, child in sorted(node.children.items()):
+                walk(root, child, path + "\\" + child.name if path else child.name)
+
+        order = {root: index for index, root in enumerate(REGISTRY_ROOT_ORDER)}
+        for root in sorted(self.roots, key=lambda root: (order.get(root, len(order)), root)):
+            walk(root, self.roots[root], "")
+        return rows
+
+
+def stable_sort_key(name: str) -> Tuple[str, str]:
+    """A sort key for file and language names which does not depend on the locale:
+    case-folded names first, code points to break ties."""
+    return name.casefold(), name
+
+
+def _inno_path(path: Optional[str]) -> Optional[str]:
+    """A path below {app} with the backslashes Inno Setup uses; "." is {app} itself."""
+    if path is None:
+        return None
+    path = path.replace('/', '\\')
+    return "" if path == "." else path
+
+
+def _destination_parts(destination: str) -> List[str]:
+    """The directories of a destination below {app}; all_files() produces "." and forward slashes on POSIX."""
+    return [part for part in _inno_path(destination).split('\\') if part and part != '.']
+
+
+def _normalised_newlines(text: str) -> str:
+    if "\r" not in text:
+        return text
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _deterministic_entry(entry: Any) -> Any:
+    """An entry with its destination path in Windows form, or the entry itself when it has one already.
+
+    Sources are left alone, as they must stay valid on the machine which compiles.
+    """
+    import attr
+    if isinstance(entry, FileEntry) and _inno_path(entry.destination) != entry.destination:
+        return attr.evolve(entry, destination=_inno_path(entry.destination))
+    if isinstance(entry, DirEntry) and '/' in entry.name:
+        return attr.evolve(entry, name=entry.name.replace('/', '\\'))
+    return entry
+
+
+def _deterministic_entries(entries: Union[List[Any], 'FileSource']) -> Union[List[Any], 'FileSource']:
+    """_deterministic_entry over ``entries``; ``entries`` itself when none needs a change.
+
+    A FileSource is converted lazily, as its entries are produced.
+    """
+    if isinstance(entries, FileSource):
+        return FileSource(lambda: map(_deterministic_entry, entries), passes="rescan")
+    changed = None
+    for index, entry in enumerate(entries):
+        normalised = _deterministic_entry(entry)
+        if normalised is entry:
+            continue
+        if changed is None:
+            changed = list(entries)
+        changed[index] = normalised
+    return entries if changed is None else changed
+
+
+def _normalised_chunks(chunks: Iterable[str]) -> Iterator[str]:
+    """_normalised_newlines over text arriving in pieces, where a \\r\\n may be split."""
+    carry = ""
+    for chunk in chunks:
+        chunk = carry + chunk
+        carry = "\r" if chunk.endswith("\r") else ""
+        yield _normalised_newlines(chunk[:-1] if carry else chunk)
+    if carry:
+        yield "\n"
+
+
+def _write_script(path: pathlib.Path, text: Union[str, Iterable[str]], deterministic: bool = False) -> None:
+    """Write a script, or the pieces of one, as UTF-8 with a byte order mark in deterministic
+    mode instead of the locale's encoding."""
+    chunks = [text] if isinstance(text, str) else text
+    if deterministic:
+        with open(str(path), 'w', encoding='utf-8-sig', newline='') as handle:
+            handle.writelines(chunks)
+    else:
+        with open(str(path), 'w') as handle:
+            handle.writelines(chunks)
+
+
+# what a FileSource does when its files are needed once more
+FILE_SOURCE_PASSES = ("error", "rescan", "cache")
+
+
+class FileSourceConsumedError(RuntimeError):
+    """Raised when the files of a FileSource with passes="error" are needed a second time."""
+
+
+class FileSource:
+    """Files for Installer.files which are produced while the script is written, instead of held in a list.
+
+    ``entries`` is an iterable of FileEntry, such as a generator, or a callable
+    which returns one. Rendering takes one pass over them; ``passes`` decides
+    what happens when the files are needed again, for instance by validation,
+    signing or an artifact store: "error" raises
+    FileSourceConsumedError, "rescan" calls ``entries`` again and "cache" keeps
+    the entries of the first pass to replay them. Only "cache" holds every
+    entry in memory.
+    """
+
+    def __init__(self, entries: Union[Iterable[FileEntry], Callable[[], Iterable[FileEntry]]],
+                 passes: str = "error") -> None:
+        if passes not in FILE_SOURCE_PASSES:
+            raise ValueError("passes must be one of {}, not {!r}".format(", ".join(FILE_SOURCE_PASSES), passes))
+        if passes == "rescan" and not callable(entries):
+            raise ValueError("passes='rescan' needs a callable which produces the entries again")
+        self.entries = entries
+        self.passes = passes
+        self.scans = 0  # how many times the entries were produced
+        self._cached: Optional[List[FileEntry]] = None
+        self._pending: Optional[Tuple[bool, Iterator[FileEntry]]] = None  # a pass started by __bool__
+
+    @classmethod
+    def scan(cls, *paths: Union[str, pathlib.Path], where: Optional[Callable[[FileEntry], bool]] = None,
+             passes: str = "rescan", **kwargs: Any) -> 'FileSource':
+        """A source which runs all_files over each of ``paths`` in turn, keeping the entries ``where`` accepts.
+
+        ``kwargs`` are passed on to all_files.
+        """
+        def entries() -> Iterator[FileEntry]:
+            for path in paths:
+                for entry in all_files(path, **kwargs):
+                    if where is None or where(entry):
+                        yield entry
+        return cls(entries, passes=passes)
+
+    def _start(self) -> Iterator[FileEntry]:
+        if self.scans and self.passes != "rescan":
+            if self.passes == "error":
+                raise FileSourceConsumedError("the files were already consumed; use passes='rescan' or 'cache' "
+                                              "to go over them more than once")
+            if not callable(self.entries):
+                raise FileSourceConsumedError("the first pass over the files did not finish, so they were not cached")
+        self.scans += 1
+        entries = iter(self.entries() if callable(self.entries) else self.entries)
+        return self._recording(entries) if self.passes == "cache" else entries
+
+    def _recording(self, entries: Iterator[FileEntry]) -> Iterator[FileEntry]:
+        recorded = []
+        for entry in entries:
+            recorded.append(entry)
+            yield entry
+        self._cached = recorded
+
+    def __iter__(self) -> Iterator[FileEntry]:
+        if self._cached is not None:
+            return iter(self._cached)
+        if self._pending is not None:
+            pending, self._pending = self._pending[1], None
+            return pending
+        return self._start()
+
+    def __bool__(self) -> bool:
+        """Whether there is any file; this starts a pass, which the next iteration continues."""
+        if self._cached is not None:
+            return bool(self._cached)
+        if self._pending is None:
+            import itertools
+            entries = self._start()
+            first = next(entries, None)
+            self._pending = (first is not None, iter(()) if first is None else itertools.chain([first], entries))
+        return self._pending[0]
+
+    def __repr__(self) -> str:
+        return "FileSource({!r}, passes={!r})".format(self.entries, self.passes)
+
+
+def _file_source(files: Iterable[FileEntry]) -> Union[List[FileEntry], FileSource]:
+    """The converter of Installer.files: lists and sources are kept, other iterables are read once."""
+    if isinstance(files, (list, FileSource)):
+        return files
+    if isinstance(files, tuple):
+        return list(files)
+    return FileSource(files)
+
+
+def _file_list(files: Union[List[FileEntry], FileSource]) -> List[FileEntry]:
+    """``files`` as a list, taking one pass over a FileSource."""
+    return files if isinstance(files, list) else list(files)
+
+
+
+class _PayloadTally:
+    """Counts the files and source bytes of the first pass over a FileSource while it is consumed.
+
+    InnosetupCompiler.build streams a FileSource through ``source()``, so the
+    metrics and the cost estimate of a build need no pass of their own.
+    ``scan_seconds`` is the time spent producing the entries.
+    """
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.source_bytes = 0
+        self.scan_seconds = 0.0
+        self.done = False
+
+    def source(self, files: FileSource) -> FileSource:
+        """A source going over ``files``, which keep their own ``passes``."""
+        return FileSource(lambda: self._counting(files), passes="rescan")
+
+    def _counting(self, files: FileSource) -> Iterator[FileEntry]:
+        if self.done:
+            yield from files
+            return
+        count = size = 0
+        seconds = 0.0
+        started = time.perf_counter()
+        entries = iter(files)
+        for entry in entries:
+            seconds += time.perf_counter() - started
+            count += 1
+            try:
+                size += os.stat(entry.source).st_size
+            except (OSError, TypeError, ValueError):
+                pass
+            yield entry
+            started = time.perf_counter()
+        seconds += time.perf_counter() - started
+        self.files, self.source_bytes, self.scan_seconds, self.done = count, size, seconds, True
+
+# bump when the inputs of Installer.fingerprint change
+INSTALLER_FINGERPRINT_VERSION = "2"
+
+
+@functools.lru_cache(maxsize=None)
+def _template_digest() -> bytes:
+    import hashlib
+    return hashlib.sha256(innosetup_template.encode('utf-8')).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def _field_names(cls: type) -> Tuple[str, ...]:
+    import attr
+    return tuple(attribute.name for attribute in attr.fields(cls))
+
+
+@functools.lru_cache(maxsize=None)
+def _field_getter(cls: type) -> Any:
+    import operator
+    return operator.attrgetter(*_field_names(cls))
+
+
+def _fingerprint_value(value: Any) -> str:
+    if value is None:
+        return "\0"
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
+def _fingerprint_row(entry: Any) -> str:
+    """The values of an entry joined by unit separators; FileEntry flags as they are rendered.
+
+    Frozen entries compute theirs once.
+    """
+    if isinstance(entry, FrozenEntry):
+        try:
+            return entry.__dict__['_fingerprint_row']
+        except KeyError:
+            row = entry.__dict__['_fingerprint_row'] = _fingerprint_fields(entry)
+            return row
+    return _fingerprint_fields(entry)
+
+
+def _fingerprint_fields(entry: Any) -> str:
+    values = _field_getter(type(entry))(entry)
+    if isinstance(entry, FileEntry) and isinstance(entry.flags, list):
+        index = _field_names(FileEntry).index('flags')
+        try:
+            # FileFlags are str, so this is flags_string without a str() call per flag
+            flags = " ".join(entry.flags)
+        except TypeError:
+            flags = entry.flags_string
+        values = values[:index] + (flags,) + values[index + 1:]
+    try:
+        return "\x1f".join(values)
+    except TypeError:
+        return "\x1f".join(map(_fingerprint_value, values))
+
+
 @define
 class Installer:
     """This class represents an installer."""
@@ -298,7 +846,8 @@ class Installer:
     run_at_startup: bool = field(default=False)
     multilingual: bool = field(default=True)
     main_executable: str = field(default="")
-    files: List[FileEntry] = field(default=Factory(list))
+    # a list, or a FileSource or generator whose entries are produced while the script is written
+    files: Union[List[FileEntry], FileSource] = field(default=Factory(list), converter=_file_source)
     registry_entries: List[RegistryEntry] = field(default=Factory(list))
     run_entries: List[RunEntry] = field(default=Factory(list))
     uninstall_run_entries: List[UninstallRunEntry] = field(default=Factory(list))
@@ -308,122 +857,3282 @@ class Installer:
     license_file: Optional[str] = field(default=None)
     output_base_filename: str = field(default="")
     extra_iss: str = field(default="")
+    languages: Optional[List[str]] = field(default=None)  # None bundles every available language
+    registry: RegistryTree = field(default=Factory(RegistryTree))
+    # render the same bytes on every machine: see normalised() and selected_languages()
+    deterministic: bool = field(default=False)
+
+    def all_registry_entries(self) -> List[RegistryEntry]:
+        """The registry_entries rows followed by the rows of the registry tree."""
+        if not self.registry:
+            return self.registry_entries
+        return list(self.registry_entries) + self.registry.entries()
+
+    def selected_languages(self, innosetup_installation: 'InnosetupCompiler') -> List[Dict[str, Any]]:
+        """Return the available languages this installer bundles besides Default.
+
+        Raises ValueError when ``languages`` names a language the compiler does not have.
+        In deterministic mode every available language is sorted by stable_sort_key
+        and the messages files use backslashes.
+        """
+        available = list(innosetup_installation.available_languages())
+        if self.deterministic:
+            available = sorted(({**language, 'messages_file': language['messages_file'].replace('/', '\\')}
+                                for language in available), key=lambda language: stable_sort_key(language['name']))
+        if self.languages is None:
+            return available
+        by_name = {language['name'].lower(): language for language in available}
+        if available:
+            unknown = [name for name in self.languages if name.lower() not in by_name and name != "Default"]
+            if unknown:
+                raise ValueError("Unknown languages: {}".format(", ".join(unknown)))
+        return [by_name[name.lower()] for name in self.languages if name.lower() in by_name]
+
+    def frozen(self) -> 'Installer':
+        """This method returns a copy of the installer whose entries are frozen; see freeze.
+
+        The entries of a FileSource are frozen as they are produced.
+        """
+        import attr
+        frozen = {attribute: [freeze(entry) for entry in getattr(self, attribute)]
+                  for attribute in SECTION_ATTRIBUTES.values() if attribute != 'files'}
+        if isinstance(self.files, FileSource):
+            files = self.files
+            frozen['files'] = FileSource(lambda: map(freeze, files), passes="rescan")
+        else:
+            frozen['files'] = [freeze(entry) for entry in self.files]
+        return attr.evolve(self, **frozen)
+
+    def normalised(self) -> 'Installer':
+        """This method returns the installer as it is rendered.
+
+        That is the installer itself, unless it is deterministic: then file
+        destinations and [Dirs] names use backslashes and the line endings
+        of extra_iss are normalised. The order of the entries is kept, as it
+        is meaningful to Inno Setup; sort them when they are collected, as
+        all_files(deterministic=True) does.
+        """
+        if not self.deterministic:
+            return self
+        import attr
+        files = _deterministic_entries(self.files)
+        dirs = _deterministic_entries(self.dirs)
+        extra_iss = _normalised_newlines(self.extra_iss)
+        if files is self.files and dirs is self.dirs and extra_iss is self.extra_iss:
+            return self
+        return attr.evolve(self, files=files, dirs=dirs, extra_iss=extra_iss)
+
+    def _template_context(self, innosetup_installation: 'InnosetupCompiler') -> Dict[str, Any]:
+        installer = self.normalised()
+        context = {'installer': installer, 'innosetup': innosetup_installation}
+        section_text = _frozen_section_text(installer)
+        if section_text:
+            context['section_text'] = section_text
+        return context
 
     def render(self, innosetup_installation: 'InnosetupCompiler') -> str:
         """This method renders the installer."""
-        env = jinja2.Environment()
-        # load the template from the string
-        template = env.from_string(innosetup_template)
-        # render the template
-        return template.render(installer=self, innosetup=innosetup_installation)
+        text = get_template().render(**self._template_context(innosetup_installation))
+        return _normalised_newlines(text) if self.deterministic else text
 
+    def render_to(self, innosetup_installation: 'InnosetupCompiler', path: Union[str, pathlib.Path]) -> None:
+        """This method renders the installer straight into the file at ``path``, a piece at a time.
 
-def get_path_from_registry() -> Optional[str]:
-    """This function gets the path to the innosetup installation from the registry"""
-    if platform.system() != "Windows":
-        return None
-    try:
-        try:
-            key = winreg.OpenKey(
-                winreg.HKEY_LOCAL_MACHINE, "SOFTWARE\\Microsoft\\Windows\\CurrentVersion   \\Uninstall\\Inno Setup 6_is1")
-        except FileNotFoundError:
-            # WOW64
-            key = winreg.OpenKey(
-                winreg.HKEY_LOCAL_MACHINE, "SOFTWARE\\Wow6432Node\\Microsoft\\Windows\\CurrentVersion\\Uninstall\\Inno Setup 6_is1")
-    except FileNotFoundError:
-        raise FileNotFoundError("Inno Setup 6 is not installed")
-    path = winreg.QueryValueEx(key, "InstallLocation")[0]
-    winreg.CloseKey(key)
-    return path
+        Files from a FileSource are produced, written and dropped one by one,
+        so the script of any number of files is written in constant memory.
+        """
+        chunks = get_template().generate(**self._template_context(innosetup_installation))
+        _write_script(pathlib.Path(path), _normalised_chunks(chunks) if self.deterministic else chunks,
+                      self.deterministic)
 
+    def fingerprint(self, innosetup_installation: Optional['InnosetupCompiler'] = None) -> str:
+        """This method returns a SHA-256 of everything the rendered script depends on, without rendering it.
 
-def get_default_flags_for_file(file_path: pathlib.Path, main_executable: Optional[str] = None) -> List[FileFlags]:
-    """Determine appropriate default flags for a file based on its type and purpose."""
-    flags = []
-    
-    # Get file extension
-    suffix = file_path.suffix.lower()
-    filename = file_path.name
-    
-    # Add default overwrite flags for all files
-    flags.append(FileFlags.IGNORE_VERSION)
-    flags.append(FileFlags.OVERWRITE_READONLY)
-    
-    # Check if this is the main executable
-    if main_executable and filename == main_executable:
-        # Main executable already has the default overwrite flags
-        pass
-    
-    # Executable files (not main executable)
-    elif suffix in {'.exe', '.com', '.bat', '.cmd'}:
-        # Executables already have the default overwrite flags
-        pass
-    
-    # Dynamic libraries and components (including .pyd files)
-    elif suffix in {'.dll', '.pyd'}:
-        flags.append(FileFlags.SHARED_FILE)
-    elif suffix in {'.ocx', '.bpl', '.dpl'}:
-        flags.append(FileFlags.SHARED_FILE)
-        flags.append(FileFlags.REG_SERVER)
-    
-    # Configuration files - still overwrite by default now
-    elif suffix in {'.ini', '.cfg', '.config', '.json', '.xml', '.yaml', '.yml'} or filename.lower() in {'settings.txt', 'config.txt'}:
-        # Configuration files now overwrite by default too
-        pass
-    
-    # README files
-    elif filename.lower() in {'readme.txt', 'readme.md', 'read me.txt'} or 'readme' in filename.lower():
-        flags.append(FileFlags.IS_README)
-    
-    # Font files - still overwrite by default now
-    elif suffix in {'.ttf', '.otf', '.fon'}:
-        flags.append(FileFlags.UNINS_NEVER_UNINSTALL)
-    
-    # Help files
-    elif suffix in {'.chm', '.hlp'}:
-        # Help files already have the default overwrite flags
-        pass
-    
-    # Type libraries
-    elif suffix in {'.tlb'}:
-        flags.append(FileFlags.REG_TYPELIB)
-        flags.append(FileFlags.SHARED_FILE)
-    
-    # Compressed files - don't compress again
-    elif suffix in {'.zip', '.7z', '.rar', '.gz', '.jpg', '.jpeg', '.png', '.gif', '.mp3', '.mp4', '.avi'}:
-        flags.append(FileFlags.NO_COMPRESSION)
-    
-    return flags
+        The hash is fed field by field and entry by entry, so it costs a small
+        fraction of a render. Deterministic installers which render the same
+        script have the same fingerprint on every machine. The compiler's
+        languages and version are only part of it when ``innosetup_installation``
+        is given; the contents of the sources never are, see build_fingerprint.
+        """
+        import hashlib
+        import itertools
+        installer = self.normalised()
+        digest = hashlib.sha256(INSTALLER_FINGERPRINT_VERSION.encode('ascii') + b"\0" + _template_digest())
+        skipped = set(SECTION_ATTRIBUTES.values()) | {'registry'}
+        for name in _field_names(Installer):
+            if name not in skipped:
+                digest.update("{}={}\0".format(name, _fingerprint_value(getattr(installer, name))).encode('utf-8'))
+        for section, entries in _section_entries(installer).items():
+            # a FileSource is hashed as it is produced, so the count comes last
+            digest.update("[{}]\0".format(section).encode('utf-8'))
+            count = 0
+            entries = iter(entries)
+            while True:
+                rows = [_fingerprint_row(entry) for entry in itertools.islice(entries, 1024)]
+                if not rows:
+                    break
+                count += len(rows)
+                digest.update("\x1e".join(rows).encode('utf-8', 'surrogatepass') + b"\x1e")
+            digest.update("{}\0".format(count).encode('ascii'))
+        if innosetup_installation is not None:
+            languages = installer.selected_languages(innosetup_installation) if installer.multilingual else []
+            digest.update(json.dumps([innosetup_installation.version,
+                                      [(language['name'], language['messages_file']) for language in languages]]
+                                     ).encode('utf-8'))
+        return digest.hexdigest()
 
+    def render_fragments(self, innosetup_installation: 'InnosetupCompiler', directory: Union[str, pathlib.Path],
+                         shard_by: str = "section", script_name: str = "installer.iss",
+                         max_workers: Optional[int] = None) -> 'ScriptFragments':
+        """This method renders the installer as a main script and #include fragments; see render_fragments."""
+        return render_fragments(self, innosetup_installation, directory, shard_by=shard_by, script_name=script_name,
+                                max_workers=max_workers)
 
-def all_files(path: Union[str, pathlib.Path], main_executable: Optional[str] = None, auto_flags: bool = True) -> Generator[FileEntry, None, None]:
-    """A generator which produces all files as FileEntry objects relative to a directory recursively
-    
-    Args:
-        path: Directory to scan for files
-        main_executable: Name of the main executable to give special treatment
-        auto_flags: Whether to automatically assign appropriate flags based on file type
-    """
-    path = pathlib.Path(path)
 
-    def _all_files(_path: pathlib.Path) -> Generator[FileEntry, None, None]:
-        for entry in _path.iterdir():
-            if entry.is_dir():
-                yield from _all_files(entry)
-            else:
-                flags = get_default_flags_for_file(entry, main_executable) if auto_flags else []
-                yield FileEntry(
-                    source=str(entry.absolute()), 
-                    destination=str(entry.relative_to(path).parent),
-                    flags=flags
-                )
-    yield from _all_files(path)
+@functools.lru_cache(maxsize=None)
+def get_template() -> Any:
+    """Return the compiled innosetup template, importing jinja2 on first use."""
+    import jinja2
+    env = jinja2.Environment()
+    return env.from_string(innosetup_template)
+
+
+@functools.lru_cache(maxsize=None)
+def get_section_template(section: str) -> Any:
+    """Return the compiled template of one section, rendered over ``entries``."""
+    import jinja2
+    # a fragment must end with its last newline, as the section does in innosetup_template
+    env = jinja2.Environment(keep_trailing_newline=True)
+    return env.from_string(_section_template(section, "entries"))
+
+
+# section -> Installer/Variant attribute holding its entries
+SECTION_ATTRIBUTES = {'types': 'component_types', 'components': 'components', 'files': 'files', 'dirs': 'dirs',
+                      'registry': 'registry_entries', 'run': 'run_entries', 'uninstallrun': 'uninstall_run_entries'}
+
+
+def _section_entries(installer: 'Installer') -> Dict[str, List[Any]]:
+    """The entries of each section of SECTION_ROWS, the registry tree's rows included."""
+    sections = {section: getattr(installer, attribute) for section, attribute in SECTION_ATTRIBUTES.items()}
+    sections['registry'] = installer.all_registry_entries()
+    return sections
+
+
+# keeps the hashes of the fragments written to a directory, so unchanged ones are not rewritten
+FRAGMENT_MANIFEST = ".fragments.json"
+
+# sections split per Components expression by render_fragments(shard_by="component");
+# [Run] and [UninstallRun] keep their own fragments since their order matters
+COMPONENT_SECTIONS = ('files', 'dirs', 'registry')
+
+
+@define
+class ScriptFragments:
+    """The main script and #include fragments written by Installer.render_fragments."""
+    script_path: pathlib.Path
+    written: List[str] = field(default=Factory(list))
+    unchanged: List[str] = field(default=Factory(list))
+    removed: List[str] = field(default=Factory(list))
+
+
+def _component_fragment_name(expression: str, taken: Dict[str, str]) -> str:
+    slug = re.sub(r'[^0-9A-Za-z]+', '-', expression).strip('-').lower() or "common"
+    name = "component-{}.iss".format(slug)
+    if taken.setdefault(name, expression) != expression:
+        import hashlib
+        name = "component-{}-{}.iss".format(slug, hashlib.sha256(expression.encode('utf-8')).hexdigest()[:8])
+    return name
+
+
+def render_fragments(installer: 'Installer', innosetup_installation: 'InnosetupCompiler',
+                     directory: Union[str, pathlib.Path], shard_by: str = "section",
+                     script_name: str = "installer.iss", max_workers: Optional[int] = None) -> ScriptFragments:
+    """Render an installer as a main script which #includes one fragment per section or component.
+
+    With ``shard_by="section"`` every section made of entry rows goes to its own
+    fragment, such as files.iss. With ``shard_by="component"`` the [Files],
+    [Dirs] and [Registry] rows are grouped by their Components parameter instead,
+    one fragment per expression. Fragments are rendered on a thread pool, and a
+    file is only rewritten when the SHA-256 of its text differs from the one
+    recorded in the directory's manifest, so unchanged fragments keep their
+    modification times. Fragments left over from an earlier render are removed.
+    """
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    installer = installer.normalised()
+    sections = _section_entries(installer)
+    jobs: List[Tuple[str, List[Tuple[str, List[Any]]]]] = []  # fragment name -> [(section, entries)]
+    fragments: Dict[str, List[str]] = {}
+    if shard_by == "section":
+        for section, entries in sections.items():
+            fragments[section] = [section + ".iss"] if entries else []
+            if entries:
+                jobs.append((section + ".iss", [(section, entries)]))
+    elif shard_by == "component":
+        by_expression: Dict[str, Dict[str, List[Any]]] = {}
+        for section in COMPONENT_SECTIONS:
+            for entry in sections[section]:
+                by_expression.setdefault(entry.components, {}).setdefault(section, []).append(entry)
+        taken: Dict[str, str] = {}
+        for expression, parts in by_expression.items():
+            jobs.append((_component_fragment_name(expression, taken),
+                         [(section, parts[section]) for section in COMPONENT_SECTIONS if section in parts]))
+        fragments.update({'files': [name for name, _ in jobs], 'dirs': [], 'registry': []})
+        for section in ('run', 'uninstallrun'):
+            fragments[section] = [section + ".iss"] if sections[section] else []
+            if sections[section]:
+                jobs.append((section + ".iss", [(section, sections[section])]))
+    else:
+        raise ValueError("shard_by must be 'section' or 'component', not {!r}".format(shard_by))
+
+    manifest_path = directory / FRAGMENT_MANIFEST
+    try:
+        previous = json.loads(manifest_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        previous = {}
+
+    def write(name: str, text: str) -> Tuple[str, str, bool]:
+        if installer.deterministic:
+            text = _normalised_newlines(text)
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        path = directory / name
+        if previous.get(name) == digest and path.exists():
+            return name, digest, False
+        temporary = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+        _write_script(temporary, text, installer.deterministic)
+        os.replace(str(temporary), str(path))
+        return name, digest, True
+
+    def render_job(job: Tuple[str, List[Tuple[str, List[Any]]]]) -> Tuple[str, str, bool]:
+        name, parts = job
+        return write(name, "".join(_section_text(section, entries) for section, entries in parts))
+
+    result = ScriptFragments(script_path=directory / script_name)
+    hashes: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rendered = executor.map(render_job, jobs)
+        section_text = {section: "".join('#include "{}"\n'.format(name) for name in names)
+                        for section, names in fragments.items()}
+        script = get_template().render(installer=installer, innosetup=innosetup_installation, section_text=section_text)
+        for name, digest, written in list(rendered) + [write(script_name, script)]:
+            hashes[name] = digest
+            (result.written if written else result.unchanged).append(name)
+    for name in previous:
+        if name not in hashes and (directory / name).exists():
+            (directory / name).unlink()
+            result.removed.append(name)
+    temporary = manifest_path.with_name("{}.{}.tmp".format(manifest_path.name, os.getpid()))
+    temporary.write_text(json.dumps(hashes, indent=2, sort_keys=True), encoding='utf-8')
+    os.replace(str(temporary), str(manifest_path))
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def get_rows_template(section: str) -> Any:
+    """Return the compiled template of the rows of one section, without its header."""
+    import jinja2
+    header, variable, row = SECTION_ROWS[section]
+    return jinja2.Environment().from_string(
+        "{% for " + variable + " in entries %}" + row + "\n{% endfor %}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_row_template(section: str) -> Any:
+    """Return the compiled template of a single row of one section, rendered over ``entry``."""
+    import jinja2
+    header, variable, row = SECTION_ROWS[section]
+    return jinja2.Environment().from_string("{% set " + variable + " = entry %}" + row)
+
+
+# frozen entry -> its row; equal frozen entries share their row, e.g. when a tree
+# is scanned again for the next build. The cache starts over once it is full.
+_frozen_lines: Dict[Any, str] = {}
+FROZEN_LINES_CACHE_SIZE = 1 << 17
+
+
+def _remember_line(entry: FrozenEntry, line: str) -> str:
+    entry.__dict__['_line'] = line
+    if len(_frozen_lines) >= FROZEN_LINES_CACHE_SIZE:
+        _frozen_lines.clear()
+    _frozen_lines[entry] = line
+    return line
+
+
+def _render_rows(section: str, entries: List[Any]) -> List[str]:
+    """The rows of ``entries``, rendered in one pass of the rows template and split per row.
+
+    Entries are rendered one by one when a value holds a line break, which
+    makes the rendered text impossible to split.
+    """
+    rows = get_rows_template(section).render(entries=entries).split("\n")
+    if len(rows) != len(entries) + 1:
+        template = get_row_template(section)
+        return [template.render(entry=entry) for entry in entries]
+    del rows[-1]
+    return rows
+
+
+def _frozen_rows(section: str, entries: List[Any]) -> Optional[List[str]]:
+    """The rows of ``entries``, the frozen ones from their cache; None when none is frozen.
+
+    The rows which are not cached are rendered together, and those of frozen
+    entries are cached. A FileSource is left to the templates, which render it
+    as it is produced.
+    """
+    if isinstance(entries, FileSource) or not any(isinstance(entry, FrozenEntry) for entry in entries):
+        return None
+    rows: List[Optional[str]] = []
+    pending: List[int] = []
+    for index, entry in enumerate(entries):
+        line = None
+        if isinstance(entry, FrozenEntry):
+            line = entry.__dict__.get('_line') or _frozen_lines.get(entry)
+        if line is None:
+            pending.append(index)
+        rows.append(line)
+    if pending:
+        for index, line in zip(pending, _render_rows(section, [entries[index] for index in pending])):
+            entry = entries[index]
+            rows[index] = _remember_line(entry, line) if isinstance(entry, FrozenEntry) else line
+    return rows  # type: ignore[return-value]
+
+
+def _section_text(section: str, entries: List[Any]) -> str:
+    """One section as innosetup_template renders it, joining the cached rows of frozen entries."""
+    rows = _frozen_rows(section, entries)
+    if rows is None:
+        return get_section_template(section).render(entries=entries)
+    if not rows:
+        return "\n"
+    return "\n[{}]\n\n{}\n\n\n".format(SECTION_ROWS[section][0], "\n\n".join(rows))
+
+
+def _rows_text(section: str, entries: List[Any]) -> str:
+    """The rows of one section without its header, as get_rows_template renders them."""
+    rows = _frozen_rows(section, entries)
+    if rows is None:
+        return get_rows_template(section).render(entries=entries)
+    return "".join(row + "\n" for row in rows)
+
+
+def _frozen_section_text(installer: 'Installer') -> Dict[str, str]:
+    """The text of the sections of ``installer`` which hold frozen entries, for ``section_text``."""
+    section_text = {}
+    for section, attribute in SECTION_ATTRIBUTES.items():
+        entries = getattr(installer, attribute)
+        if not isinstance(entries, FileSource) and any(isinstance(entry, FrozenEntry) for entry in entries):
+            if section == 'registry':
+                entries = installer.all_registry_entries()
+            section_text[section] = _section_text(section, entries)
+    return section_text
+
+
+@define
+class Variant:
+    """One edition or architecture built from a shared script.
+
+    The entries are installed on top of the shared installer's, and ``setup``
+    overrides [Setup] directives, for instance ``{'ArchitecturesAllowed': 'x64'}``.
+    ``defines`` are passed to ISCC as /D options next to the variant's own
+    VARIANT_<NAME> define.
+    """
+    name: str = field(default="")
+    defines: Dict[str, str] = field(default=Factory(dict))
+    setup: Dict[str, str] = field(default=Factory(dict))
+    files: List[FileEntry] = field(default=Factory(list))
+    registry_entries: List[RegistryEntry] = field(default=Factory(list))
+    run_entries: List[RunEntry] = field(default=Factory(list))
+    uninstall_run_entries: List[UninstallRunEntry] = field(default=Factory(list))
+    dirs: List[DirEntry] = field(default=Factory(list))
+    component_types: List[ComponentType] = field(default=Factory(list))
+    components: List[Component] = field(default=Factory(list))
+
+    @property
+    def define(self) -> str:
+        """The ISPP symbol which is defined only when this variant is compiled."""
+        return "VARIANT_" + re.sub(r'[^0-9A-Za-z]+', '_', self.name).upper()
+
+    def iscc_options(self) -> List[str]:
+        """The /D options which select this variant."""
+        return ['/D' + self.define] + ['/D{}={}'.format(name, value) for name, value in self.defines.items()]
+
+
+def _variant_setup(script: str, variants: List[Variant]) -> str:
+    """Replace the [Setup] directives variants override by #if chains."""
+    overridden: Dict[str, str] = {}
+    for variant in variants:
+        for directive in variant.setup:
+            overridden.setdefault(directive.lower(), directive)
+    if not overridden:
+        return script
+    setup, separator, rest = script.partition("\n\n")
+    lines = setup.split("\n")
+    for lowered, directive in overridden.items():
+        chain: List[str] = []
+        for variant in variants:
+            values = {name.lower(): value for name, value in variant.setup.items()}
+            if lowered in values:
+                chain.append("{} defined({})".format("#elif" if chain else "#if", variant.define))
+                chain.append("{}={}".format(directive, values[lowered]))
+        shared = [index for index, line in enumerate(lines) if line.partition('=')[0].strip().lower() == lowered]
+        if shared:
+            index = shared[0]
+            lines[index:index + 1] = chain + ["#else", lines[index], "#endif"]
+        else:
+            lines.extend(chain + ["#endif"])
+    return "\n".join(lines) + separator + rest
+
+
+def render_variants(installer: 'Installer', variants: List[Variant],
+                    innosetup_installation: 'InnosetupCompiler') -> str:
+    """Render one script for an installer and its variants.
+
+    The shared installer is rendered once. Each section is followed by the
+    variants' own rows, wrapped in ``#ifdef VARIANT_<NAME>`` blocks, and
+    overridden [Setup] directives become ``#if defined(...)`` chains, so ISCC
+    picks a variant from the /D options of Variant.iscc_options().
+    """
+    names = [variant.define for variant in variants]
+    if len(set(names)) != len(names):
+        raise ValueError("variant names must be unique: {}".format(", ".join(names)))
+    installer = installer.normalised()
+    shared = _section_entries(installer)
+    section_text = _frozen_section_text(installer)
+    for section, attribute in SECTION_ATTRIBUTES.items():
+        own = [(variant, getattr(variant, attribute)) for variant in variants if getattr(variant, attribute)]
+        if installer.deterministic:
+            own = [(variant, _deterministic_entries(entries)) for variant, entries in own]
+        if not own:
+            continue
+        text = "[{}]\n".format(SECTION_ROWS[section][0]) + _rows_text(section, shared[section])
+        for variant, entries in own:
+            text += "#ifdef {}\n{}#endif\n".format(variant.define, _rows_text(section, entries))
+        section_text[section] = text + "\n"
+    script = get_template().render(installer=installer, innosetup=innosetup_installation, section_text=section_text)
+    if installer.deterministic:
+        script = _normalised_newlines(script)
+    return _variant_setup(script, variants)
+
+
+INNOSETUP_PATH_ENV_VAR = "INNOSETUP_PATH"
+DISCOVERY_CACHE_ENV_VAR = "INNOSETUP_DISCOVERY_CACHE"
+WINE_ENV_VAR = "INNOSETUP_WINE"
+
+# Uninstall keys written by the Inno Setup installers, newest version first.
+INNOSETUP_REGISTRY_KEYS = [
+    "SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Uninstall\\Inno Setup {}_is1",
+    "SOFTWARE\\Wow6432Node\\Microsoft\\Windows\\CurrentVersion\\Uninstall\\Inno Setup {}_is1",
+]
+INNOSETUP_VERSIONS = (6, 5)
+
+
+def _read_registry_installation() -> Optional[Dict[str, str]]:
+    """Return the install location and display version of the newest Inno Setup in the registry."""
+    import winreg
+    for version in INNOSETUP_VERSIONS:
+        for root in (winreg.HKEY_LOCAL_MACHINE, winreg.HKEY_CURRENT_USER):
+            for key_path in INNOSETUP_REGISTRY_KEYS:
+                try:
+                    key = winreg.OpenKey(root, key_path.format(version))
+                except FileNotFoundError:
+                    continue
+                try:
+                    installation = {'base_path': winreg.QueryValueEx(key, "InstallLocation")[0]}
+                    try:
+                        installation['version'] = winreg.QueryValueEx(key, "DisplayVersion")[0]
+                    except FileNotFoundError:
+                        pass
+                finally:
+                    winreg.CloseKey(key)
+                return installation
+    return None
+
+
+def get_path_from_registry() -> Optional[str]:
+    """This function gets the path to the innosetup installation from the registry"""
+    import platform
+    if platform.system() != "Windows":
+        return None
+    installation = _read_registry_installation()
+    if installation is None:
+        raise FileNotFoundError("Inno Setup is not installed")
+    return installation['base_path']
+
+
+def _find_in_wine_prefix() -> Optional[str]:
+    """Look for an Inno Setup installation inside the current Wine prefix."""
+    prefix = pathlib.Path(os.environ.get("WINEPREFIX", pathlib.Path.home() / ".wine"))
+    for program_files in ("Program Files (x86)", "Program Files"):
+        for version in INNOSETUP_VERSIONS:
+            base_path = prefix / "drive_c" / program_files / "Inno Setup {}".format(version)
+            if (base_path / "ISCC.exe").is_file():
+                return str(base_path)
+    return None
+
+
+def _find_on_path() -> Optional[str]:
+    """Look for an ISCC executable (native, stand-in or wrapper script) on PATH."""
+    import shutil
+    for name in ("ISCC", "iscc", "ISCC.exe"):
+        found = shutil.which(name)
+        if found:
+            return str(pathlib.Path(found).parent)
+    return None
+
+
+def _compiler_in(base_path: Union[str, pathlib.Path]) -> pathlib.Path:
+    """Return the compiler executable inside ``base_path``, preferring ISCC.exe."""
+    base_path = pathlib.Path(base_path)
+    for name in ("ISCC.exe", "ISCC", "iscc"):
+        if (base_path / name).is_file():
+            return base_path / name
+    return base_path / "ISCC.exe"
+
+
+def _discovery_cache_path() -> Optional[pathlib.Path]:
+    """Where discovery results are cached on disk, or None when disabled."""
+    configured = os.environ.get(DISCOVERY_CACHE_ENV_VAR)
+    if configured is not None:
+        return pathlib.Path(configured) if configured not in ("", "0") else None
+    if sys.platform == "win32" and os.environ.get("LOCALAPPDATA"):
+        cache_dir = pathlib.Path(os.environ["LOCALAPPDATA"])
+    else:
+        cache_dir = pathlib.Path(os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache"))
+    return cache_dir / "innosetup_builder" / "compiler.json"
+
+
+def _load_discovery_cache() -> Dict[str, Any]:
+    path = _discovery_cache_path()
+    if path is None or not path.is_file():
+        return {}
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_discovery_cache(data: Dict[str, Any]) -> None:
+    path = _discovery_cache_path()
+    if path is None:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".{}.tmp".format(os.getpid()))
+        temporary.write_text(json.dumps(data, indent=2))
+        os.replace(str(temporary), str(path))
+    except OSError:
+        # the cache is an optimisation only
+        pass
+
+
+@define
+class CompilerDiscovery:
+    """The result of looking for an Inno Setup installation."""
+    base_path: Optional[str] = field(default=None)
+    source: str = field(default="")  # environment, cache, registry, wine, path
+    version: Optional[str] = field(default=None)
+
+
+@functools.lru_cache(maxsize=None)
+def discover_compiler() -> CompilerDiscovery:
+    """Find the Inno Setup installation, once per process.
+
+    The ``INNOSETUP_PATH`` environment variable always wins and may name either
+    the installation directory or the compiler itself. Otherwise a result cached
+    on disk by an earlier process is reused while its compiler still exists, and
+    only then are the registry, the Wine prefix and PATH searched. Call
+    ``discover_compiler.cache_clear()`` to search again.
+    """
+    override = os.environ.get(INNOSETUP_PATH_ENV_VAR)
+    if override:
+        override_path = pathlib.Path(override)
+        if override_path.is_file():
+            override_path = override_path.parent
+        return CompilerDiscovery(base_path=str(override_path), source="environment")
+    cache = _load_discovery_cache()
+    cached_path = cache.get('base_path')
+    if cached_path and _compiler_in(cached_path).is_file():
+        return CompilerDiscovery(base_path=cached_path, source="cache", version=cache.get('version'))
+    discovery = CompilerDiscovery()
+    if sys.platform == "win32":
+        installation = _read_registry_installation()
+        if installation is not None:
+            discovery = CompilerDiscovery(base_path=installation['base_path'], source="registry",
+                                          version=installation.get('version'))
+    if discovery.base_path is None:
+        wine_path = _find_in_wine_prefix()
+        if wine_path is not None:
+            discovery = CompilerDiscovery(base_path=wine_path, source="wine")
+    if discovery.base_path is None:
+        path = _find_on_path()
+        if path is not None:
+            discovery = CompilerDiscovery(base_path=path, source="path")
+    if discovery.base_path is not None:
+        _save_discovery_cache({'base_path': discovery.base_path, 'version': discovery.version})
+    return discovery
+
+
+def _discovered_base_path() -> Optional[str]:
+    """Default for InnosetupCompiler.base_path, shared by every instance in this process."""
+    return discover_compiler().base_path
+
+
+def _needs_wine(compiler_path: pathlib.Path) -> bool:
+    """Whether ``compiler_path`` is a Windows executable that has to run under Wine here."""
+    if sys.platform == "win32":
+        return False
+    try:
+        with open(str(compiler_path), 'rb') as compiler:
+            return compiler.read(2) == b"MZ"
+    except OSError:
+        return False
+
+
+def _wine_path(path: Union[str, pathlib.Path]) -> str:
+    """Map a host path to the Z: drive Wine exposes for the root filesystem."""
+    return "Z:" + str(path).replace("/", "\\")
+
+
+@functools.lru_cache(maxsize=None)
+def probe_compiler_version(compiler_path: str) -> Optional[str]:
+    """Run the compiler once to find its version, caching the answer per process and on disk."""
+    import subprocess
+    path = pathlib.Path(compiler_path)
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    cache = _load_discovery_cache()
+    cached = cache.get('versions', {}).get(compiler_path)
+    if cached and cached.get('mtime_ns') == mtime_ns:
+        return cached.get('version')
+    command = ([os.environ.get(WINE_ENV_VAR, "wine")] if _needs_wine(path) else []) + [compiler_path, "/?"]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                timeout=60, universal_newlines=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"Inno Setup (\d+(?:\.\d+)*)", result.stdout)
+    version = match.group(1) if match else None
+    cache.setdefault('versions', {})[compiler_path] = {'mtime_ns': mtime_ns, 'version': version}
+    _save_discovery_cache(cache)
+    return version
+
+
+def get_default_flags_for_file(file_path: pathlib.Path, main_executable: Optional[str] = None) -> List[FileFlags]:
+    """Determine appropriate default flags for a file based on its type and purpose."""
+    flags = []
+    
+    # Get file extension
+    suffix = file_path.suffix.lower()
+    filename = file_path.name
+    
+    # Add default overwrite flags for all files
+    flags.append(FileFlags.IGNORE_VERSION)
+    flags.append(FileFlags.OVERWRITE_READONLY)
+    
+    # Check if this is the main executable
+    if main_executable and filename == main_executable:
+        # Main executable already has the default overwrite flags
+        pass
+    
+    # Executable files (not main executable)
+    elif suffix in {'.exe', '.com', '.bat', '.cmd'}:
+        # Executables already have the default overwrite flags
+        pass
+    
+    # Dynamic libraries and components (including .pyd files)
+    elif suffix in {'.dll', '.pyd'}:
+        flags.append(FileFlags.SHARED_FILE)
+    elif suffix in {'.ocx', '.bpl', '.dpl'}:
+        flags.append(FileFlags.SHARED_FILE)
+        flags.append(FileFlags.REG_SERVER)
+    
+    # Configuration files - still overwrite by default now
+    elif suffix in {'.ini', '.cfg', '.config', '.json', '.xml', '.yaml', '.yml'} or filename.lower() in {'settings.txt', 'config.txt'}:
+        # Configuration files now overwrite by default too
+        pass
+    
+    # README files
+    elif filename.lower() in {'readme.txt', 'readme.md', 'read me.txt'} or 'readme' in filename.lower():
+        flags.append(FileFlags.IS_README)
+    
+    # Font files - still overwrite by default now
+    elif suffix in {'.ttf', '.otf', '.fon'}:
+        flags.append(FileFlags.UNINS_NEVER_UNINSTALL)
+    
+    # Help files
+    elif suffix in {'.chm', '.hlp'}:
+        # Help files already have the default overwrite flags
+        pass
+    
+    # Type libraries
+    elif suffix in {'.tlb'}:
+        flags.append(FileFlags.REG_TYPELIB)
+        flags.append(FileFlags.SHARED_FILE)
+    
+    # Compressed files - don't compress again
+    elif suffix in {'.zip', '.7z', '.rar', '.gz', '.jpg', '.jpeg', '.png', '.gif', '.mp3', '.mp4', '.avi'}:
+        flags.append(FileFlags.NO_COMPRESSION)
+    
+    return flags
+
+
+@define
+class DestinationNode:
+    """A directory under {app} and how many files are installed directly into it."""
+    name: str = field(default="")
+    files: int = field(default=0)
+    children: Dict[str, "DestinationNode"] = field(default=Factory(dict))  # lower case name -> node
+
+    def child(self, name: str) -> "DestinationNode":
+        node = self.children.get(name.lower())
+        if node is None:
+            node = self.children[name.lower()] = DestinationNode(name=name)
+        return node
+
+
+@define
+class DestinationTrie:
+    """The destination directories of an installer, used to generate its [Dirs] section.
+
+    Inno Setup creates the directories files are installed to by itself, so
+    [Dirs] only needs the directories no file creates: empty leaves of the
+    trie. Names are case-insensitive and keep their first spelling.
+    """
+    root: DestinationNode = field(default=Factory(DestinationNode))
+
+    def add(self, destination: str, files: int = 0) -> DestinationNode:
+        """Add a destination relative to {app}, with ``files`` installed into it."""
+        node = self.root
+        for part in _destination_parts(destination):
+            node = node.child(part)
+        node.files += files
+        return node
+
+    @classmethod
+    def from_files(cls, files: Iterable[FileEntry]) -> "DestinationTrie":
+        """Build the trie from file destinations, without touching the filesystem."""
+        counts: Dict[str, int] = {}
+        for entry in files:
+            counts[entry.destination or ''] = counts.get(entry.destination or '', 0) + 1
+        trie = cls()
+        for destination, files_count in counts.items():
+            trie.add(destination, files_count)
+        return trie
+
+    def dir_entries(self, permissions: Optional[Dict[str, str]] = None,
+                    existing: Iterable[DirEntry] = ()) -> List[DirEntry]:
+        """The minimal [Dirs] rows: empty leaf directories, plus every directory in
+        ``permissions`` (destination -> Permissions parameter) whether or not files
+        create it. Directories already named in ``existing`` are left out.
+        """
+        wanted = {}
+        for key, value in (permissions or {}).items():
+            key = key.replace('/', '\\').strip('\\')
+            wanted[key.lower()] = (key, value)
+        skip = {entry.name.lower() for entry in existing}
+        entries: List[DirEntry] = []
+        stack = [(self.root, '')]
+        while stack:
+            node, path = stack.pop()
+            if path:
+                permission = wanted.pop(path.lower(), (path, ""))[1]
+                name = "{app}\\" + path
+                if (permission or (not node.files and not node.children)) and name.lower() not in skip:
+                    entries.append(DirEntry(name=name, permissions=permission))
+            children = sorted(node.children.values(), key=lambda child: child.name.lower(), reverse=True)
+            stack.extend((child, path + '\\' + child.name if path else child.name) for child in children)
+        # directories given permissions which are not in the trie at all
+        for path, permission in wanted.values():
+            if ("{app}\\" + path).lower() not in skip:
+                entries.append(DirEntry(name="{app}\\" + path, permissions=permission))
+        return entries
+
+
+def all_files(path: Union[str, pathlib.Path], main_executable: Optional[str] = None, auto_flags: bool = True,
+              trie: Optional[DestinationTrie] = None, deterministic: bool = False) -> Generator[FileEntry, None, None]:
+    """A generator which produces all files as FileEntry objects relative to a directory recursively
+    
+    Args:
+        path: Directory to scan for files
+        main_executable: Name of the main executable to give special treatment
+        auto_flags: Whether to automatically assign appropriate flags based on file type
+        trie: A DestinationTrie which records every directory visited, empty ones
+            included, so [Dirs] can be generated without walking the tree again
+        deterministic: Visit every directory in stable_sort_key order instead of
+            the filesystem's, and give destinations backslashes with "" for the
+            top directory, so every machine produces the same entries
+    """
+    path = pathlib.Path(path)
+
+    def _all_files(_path: pathlib.Path, node: Optional[DestinationNode]) -> Generator[FileEntry, None, None]:
+        entries = _path.iterdir()
+        if deterministic:
+            entries = sorted(entries, key=lambda entry: stable_sort_key(entry.name))
+        for entry in entries:
+            if entry.is_dir():
+                yield from _all_files(entry, node.child(entry.name) if node is not None else None)
+            else:
+                if node is not None:
+                    node.files += 1
+                flags = get_default_flags_for_file(entry, main_executable) if auto_flags else []
+                destination = str(entry.relative_to(path).parent)
+                yield FileEntry(
+                    source=str(entry.absolute()), 
+                    destination=_inno_path(destination) if deterministic else destination,
+                    flags=flags
+                )
+    yield from _all_files(path, trie.root if trie is not None else None)
+
+
+# section -> (entry class, Inno parameter name in lower case -> attribute name)
+ISS_SECTIONS: Dict[str, Any] = {
+    'files': (FileEntry, {
+        'source': 'source', 'destdir': 'destination', 'destname': 'dest_name', 'excludes': 'excludes',
+        'externalsize': 'external_size', 'attribs': 'attribs', 'permissions': 'permissions',
+        'fontinstall': 'font_install', 'strongassemblyname': 'strong_assembly_name', 'flags': 'flags',
+        'components': 'components'}),
+    'registry': (RegistryEntry, {
+        'root': 'root', 'subkey': 'subkey', 'valuetype': 'value_type', 'valuename': 'value_name',
+        'valuedata': 'value_data', 'permissions': 'permissions', 'flags': 'flags', 'components': 'components'}),
+    'dirs': (DirEntry, {
+        'name': 'name', 'permissions': 'permissions', 'attribs': 'attribs', 'flags': 'flags',
+        'components': 'components'}),
+    'run': (RunEntry, {
+        'filename': 'filename', 'description': 'description', 'parameters': 'parameters',
+        'workingdir': 'working_dir', 'statusmsg': 'status_msg', 'verb': 'verb', 'flags': 'flags',
+        'components': 'components'}),
+    'uninstallrun': (UninstallRunEntry, {
+        'filename': 'filename', 'parameters': 'parameters', 'workingdir': 'working_dir',
+        'runonceid': 'runonce_id', 'verb': 'verb', 'flags': 'flags', 'components': 'components'}),
+    'components': (Component, {
+        'name': 'name', 'description': 'description', 'types': 'types',
+        'extradiskspacerequired': 'extra_disk_space_required', 'flags': 'flags'}),
+    'types': (ComponentType, {'name': 'name', 'description': 'description', 'flags': 'flags'}),
+}
+
+# section -> Installer list attribute
+# [Setup] directive in lower case -> Installer attribute
+_ISS_SETUP_DIRECTIVES = {
+    'appname': 'app_name', 'appid': 'app_id', 'appversion': 'app_version',
+    'licensefile': 'license_file', 'outputbasefilename': 'output_base_filename',
+}
+
+
+def parse_iss_parameters(line: str) -> Dict[str, str]:
+    """Split an entry line into its parameters, keyed by lower case name.
+
+    Surrounding quotes are removed but the value is otherwise kept as Inno Setup
+    text (doubled quotes and {{ stay escaped), which is what the entry classes hold.
+    """
+    parameters = {}
+    pending = ''
+    # plain str methods rather than a regular expression: this runs once per line
+    # of scripts with hundreds of thousands of lines
+    for piece in line.split(';'):
+        if pending:
+            piece = pending + ';' + piece
+        # an odd number of quotes means the semicolon was inside a quoted value
+        if piece.count('"') % 2:
+            pending = piece
+            continue
+        pending = ''
+        name, separator, value = piece.partition(':')
+        if not separator:
+            continue
+        value = value.strip()
+        if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1]
+        parameters[name.strip().lower()] = value
+    return parameters
+
+
+def _parse_entry(section: str, parameters: Dict[str, str]) -> Optional[Any]:
+    """Build the entry for a parsed line, or None if it uses parameters the class cannot hold."""
+    cls, names = ISS_SECTIONS[section]
+    kwargs = {}
+    for name, value in parameters.items():
+        attribute = names.get(name)
+        if attribute is None:
+            return None
+        kwargs[attribute] = value
+    if section == 'files':
+        destination = kwargs.get('destination', '{app}')
+        if destination == '{app}':
+            kwargs['destination'] = ''
+        elif destination.startswith('{app}\\'):
+            kwargs['destination'] = destination[6:]
+        else:
+            return None
+    return cls(**kwargs)
+
+
+def _generated_setup(installer: Installer) -> Dict[str, str]:
+    """[Setup] directives the template writes by itself, lower cased."""
+    return {'wizardstyle': 'modern',
+            'defaultdirname': '{autopf}\\' + installer.app_name,
+            'defaultgroupname': installer.app_name,
+            'compression': 'lzma2/ultra',
+            'versioninfoproductname': installer.app_name}
+
+
+def parse_iss(lines: Iterable[str]) -> Installer:
+    """Parse the lines of an Inno Setup script into an Installer.
+
+    The script is read line by line, so ``lines`` may be an open file. [Setup],
+    [Types], [Components], [Files], [Dirs], [Registry], [Run], [UninstallRun] and
+    [Languages] become Installer fields; the [Icons] and [Tasks] rows the template
+    generates set main_executable, desktop_icon and run_at_startup. Everything else,
+    including rows with parameters the entry classes cannot hold and preprocessor
+    lines, is kept verbatim in ``extra_iss`` grouped by section.
+    """
+    installer = Installer(multilingual=False)
+    setup: Dict[str, Any] = {}  # lower case directive -> (directive, value)
+    extra: Dict[Optional[str], List[str]] = {}
+    headers: Dict[Optional[str], str] = {}
+    lists = {section: getattr(installer, attribute) for section, attribute in SECTION_ATTRIBUTES.items()}
+    languages: List[str] = []
+    section: Optional[str] = None
+    header = ''
+    for raw_line in lines:
+        line = raw_line.strip()
+        if not line or line[0] == ';':
+            continue
+        if line[0] == '[' and line[-1] == ']':
+            header = line
+            section = line[1:-1].strip().lower()
+            continue
+        if section in ISS_SECTIONS and line[0] != '#':
+            parameters = parse_iss_parameters(line)
+            if section == 'registry' and parameters.get('tasks') == 'startup':
+                installer.run_at_startup = True
+                continue
+            entry = _parse_entry(section, parameters)
+            if entry is not None:
+                lists[section].append(entry)
+                continue
+        elif section == 'setup' and '=' in line and line[0] != '#':
+            name, value = line.split('=', 1)
+            setup[name.strip().lower()] = (name.strip(), value.strip())
+            continue
+        elif section == 'languages' and line[0] != '#':
+            installer.multilingual = True
+            name = parse_iss_parameters(line).get('name', '')
+            if name and name != 'Default':
+                languages.append(name)
+            continue
+        elif section == 'icons' and line[0] != '#':
+            parameters = parse_iss_parameters(line)
+            filename = parameters.get('filename', '')
+            if parameters.get('tasks') == 'desktopicon':
+                continue
+            if filename == '{uninstallexe}':
+                continue
+            if filename.startswith('{app}\\') and parameters.get('name', '').startswith('{group}\\'):
+                installer.main_executable = filename[6:]
+                continue
+        elif section == 'tasks' and line[0] != '#':
+            name = parse_iss_parameters(line).get('name', '')
+            if name == 'desktopicon':
+                installer.desktop_icon = True
+                continue
+            if name == 'startup':
+                continue
+        headers.setdefault(section, header)
+        extra.setdefault(section, []).append(line)
+    for name, attribute in _ISS_SETUP_DIRECTIVES.items():
+        if name in setup:
+            setattr(installer, attribute, setup.pop(name)[1])
+    generated = _generated_setup(installer)
+    leftover = ['{}={}'.format(*directive) for name, directive in setup.items() if generated.get(name) != directive[1]]
+    if leftover:
+        headers.setdefault('setup', '[Setup]')
+        extra.setdefault('setup', [])[0:0] = leftover
+    if languages:
+        installer.languages = languages
+    blocks = []
+    for key, block in extra.items():
+        blocks.append('\n'.join(([headers[key]] if headers.get(key) else []) + block))
+    installer.extra_iss = '\n\n'.join(blocks)
+    return installer
+
+
+def load_iss(path: Union[str, pathlib.Path], encoding: str = 'utf-8-sig') -> Installer:
+    """Parse the Inno Setup script at ``path`` into an Installer."""
+    with open(str(path), encoding=encoding) as script:
+        return parse_iss(script)
+
+
+def _is_wildcard(source: str) -> bool:
+    """Whether a Source parameter is a wildcard, which names no single file."""
+    return '*' in source or '?' in source
+
+
+def _extension(name: str) -> str:
+    """The lower case extension of a file name, '' for none or a name such as .gitignore."""
+    dot = name.rfind('.')
+    return name[dot:].lower() if dot > 0 else ''
+
+
+def _file_key(entry: FileEntry) -> Any:
+    """Where a file ends up: destination directory and name, case-insensitively as on Windows.
+
+    The destination is spelled as _destination_parts() splits it, so "." and "" or
+    "a/b" and "a\\b" give the same key.
+    """
+    # str methods rather than PureWindowsPath, which is several times slower
+    name = entry.dest_name or (entry.source or '').replace('/', '\\').rpartition('\\')[2]
+    return ('\\'.join(_destination_parts(entry.destination or '')).lower(), name.lower())
+
+
+# section -> function returning the identity of an entry
+DIFF_SECTIONS: Dict[str, Any] = {
+    'files': _file_key,
+    'registry': lambda entry: (entry.root.upper(), entry.subkey.lower(), entry.value_name.lower()),
+    'dirs': lambda entry: entry.name.lower(),
+    'run': lambda entry: (entry.filename.lower(), entry.parameters),
+    'uninstallrun': lambda entry: (entry.filename.lower(), entry.runonce_id),
+    'components': lambda entry: entry.name.lower(),
+    'types': lambda entry: entry.name.lower(),
+}
+
+
+def _entry_values(entry: Any) -> Dict[str, Any]:
+    """The attributes of an entry, with FileEntry flags normalised to their string form."""
+    import attr
+    values = {field.name: getattr(entry, field.name) for field in attr.fields(type(entry))}
+    if isinstance(entry, FileEntry):
+        values['flags'] = entry.flags_string
+    return values
+
+
+@define
+class EntryChange:
+    """An entry present in both installers whose attributes differ."""
+    key: Any
+    old: Any
+    new: Any
+    changes: Dict[str, Any] = field(default=Factory(dict))  # attribute -> (old value, new value)
+
+
+@define
+class SectionDiff:
+    """Added, removed and changed entries of one section."""
+    added: List[Any] = field(default=Factory(list))
+    removed: List[Any] = field(default=Factory(list))
+    changed: List[EntryChange] = field(default=Factory(list))
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+@define
+class InstallerDiff:
+    """The differences between two installers, section by section."""
+    setup: Dict[str, Any] = field(default=Factory(dict))  # attribute -> (old value, new value)
+    sections: Dict[str, SectionDiff] = field(default=Factory(dict))
+    old_payload_bytes: int = field(default=0)
+    new_payload_bytes: int = field(default=0)
+
+    def __bool__(self) -> bool:
+        return bool(self.setup) or any(self.sections.values())
+
+    @property
+    def payload_growth(self) -> int:
+        """How many more source bytes the new installer packs."""
+        return self.new_payload_bytes - self.old_payload_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        """A JSON-serialisable form of the diff."""
+        def change(entry_change: EntryChange) -> Dict[str, Any]:
+            return {'key': list(entry_change.key) if isinstance(entry_change.key, tuple) else entry_change.key,
+                    'changes': {name: {'old': old, 'new': new} for name, (old, new) in entry_change.changes.items()}}
+        return {
+            'setup': {name: {'old': old, 'new': new} for name, (old, new) in self.setup.items()},
+            'sections': {name: {'added': [_entry_values(entry) for entry in section.added],
+                                'removed': [_entry_values(entry) for entry in section.removed],
+                                'changed': [change(entry_change) for entry_change in section.changed]}
+                         for name, section in self.sections.items() if section},
+            'payload': {'old_bytes': self.old_payload_bytes, 'new_bytes': self.new_payload_bytes,
+                        'growth_bytes': self.payload_growth},
+        }
+
+    def summary(self) -> str:
+        """A short human readable description of the diff."""
+        lines = ["setup: {} changed".format(", ".join(sorted(self.setup)))] if self.setup else []
+        for name, section in self.sections.items():
+            if section:
+                lines.append("{}: {} added, {} removed, {} changed".format(
+                    name, len(section.added), len(section.removed), len(section.changed)))
+        lines.append("payload: {} -> {} bytes ({:+d})".format(
+            self.old_payload_bytes, self.new_payload_bytes, self.payload_growth))
+        return "\n".join(lines)
+
+
+def _diff_section(old_entries: Iterable[Any], new_entries: Iterable[Any], key: Any) -> SectionDiff:
+    """Match entries by key in one pass over each side and compare their attributes."""
+    diff = SectionDiff()
+    remaining: Dict[Any, List[Any]] = {}
+    for entry in old_entries:
+        remaining.setdefault(key(entry), []).append(entry)
+    for entry in new_entries:
+        entry_key = key(entry)
+        candidates = remaining.get(entry_key)
+        if not candidates:
+            diff.added.append(entry)
+            continue
+        old = candidates.pop(0)
+        if old == entry:
+            continue
+        old_values = _entry_values(old)
+        new_values = _entry_values(entry)
+        changes = {name: (value, new_values[name]) for name, value in old_values.items() if value != new_values[name]}
+        if changes:
+            diff.changed.append(EntryChange(key=entry_key, old=old, new=entry, changes=changes))
+    for candidates in remaining.values():
+        diff.removed.extend(candidates)
+    return diff
+
+
+def payload_size(files: Iterable[FileEntry]) -> int:
+    """The total size of the file sources which exist on this machine."""
+    total = 0
+    for entry in files:
+        try:
+            total += os.stat(entry.source).st_size
+        except (OSError, TypeError, ValueError):
+            pass
+    return total
+
+
+def diff_installers(old: Installer, new: Installer, payload: bool = True) -> InstallerDiff:
+    """Compare two installers section by section.
+
+    Files are matched by destination, registry values by root, subkey and value
+    name, and the other entries by name or filename, so the diff takes time linear
+    in the number of entries. With ``payload`` the sources are stat'ed to report
+    payload growth. The files of a FileSource are read in one pass.
+    """
+    import attr
+    diff = InstallerDiff()
+    skipped = set(SECTION_ATTRIBUTES.values()) | {'registry'}
+    for installer_field in attr.fields(Installer):
+        if installer_field.name in skipped:
+            continue
+        old_value = getattr(old, installer_field.name)
+        new_value = getattr(new, installer_field.name)
+        if old_value != new_value:
+            diff.setup[installer_field.name] = (old_value, new_value)
+    old_sections, new_sections = _section_entries(old), _section_entries(new)
+    old_sections['files'], new_sections['files'] = _file_list(old.files), _file_list(new.files)
+    for section, key in DIFF_SECTIONS.items():
+        diff.sections[section] = _diff_section(old_sections[section], new_sections[section], key)
+    if payload:
+        diff.old_payload_bytes = payload_size(old_sections['files'])
+        diff.new_payload_bytes = payload_size(new_sections['files'])
+    return diff
+
+
+def diff_scripts(old_path: Union[str, pathlib.Path], new_path: Union[str, pathlib.Path], payload: bool = True) -> InstallerDiff:
+    """Compare two rendered or hand-written .iss scripts."""
+    return diff_installers(load_iss(old_path), load_iss(new_path), payload=payload)
+
+
+# hex(n) type number -> Inno Setup value type; anything else is written as binary
+REG_HEX_TYPES = {'1': 'string', '2': 'expandsz', '3': 'binary', '4': 'dword', '7': 'multisz', 'b': 'qword'}
+
+_REG_VALUE_RE = re.compile(r'^(@|"((?:[^"\\]|\\.)*)")\s*=\s*(.*)$')
+
+
+def _inno_text(text: str) -> str:
+    """Escape registry text for an Inno Setup quoted parameter: { starts a constant, " ends the value."""
+    return text.replace('{', '{{').replace('"', '""')
+
+
+def _reg_unescape(text: str) -> str:
+    """Undo the backslash escapes regedit writes inside quoted strings."""
+    if '\\' not in text:
+        return text
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def _reg_value(data: str, unicode: bool) -> Any:
+    """Convert the right hand side of a .reg value line to an Inno (value type, value data) pair."""
+    if data.startswith('"'):
+        return 'string', _inno_text(_reg_unescape(data[1:data.rindex('"')]))
+    lowered = data.lower()
+    if lowered.startswith('dword:'):
+        return 'dword', str(int(data[6:], 16))
+    if lowered.startswith('hex'):
+        kind, _, hex_bytes = data.partition(':')
+        kind = kind.lower()
+        # plain "hex:" is REG_BINARY, "hex(n):" names the type number in hex
+        type_code = '3' if kind == 'hex' else kind[4:-1].lstrip('0') or '0'
+        raw = bytes.fromhex(hex_bytes.replace(',', ' '))
+        value_type = REG_HEX_TYPES.get(type_code, 'binary')
+        if value_type in ('string', 'expandsz', 'multisz'):
+            text = raw.decode('utf-16-le' if unicode else 'mbcs' if sys.platform == 'win32' else 'latin-1')
+            parts = text.split('\0')
+            while parts and parts[-1] == '':
+                parts.pop()
+            if value_type == 'multisz':
+                return value_type, '{break}'.join(_inno_text(part) for part in parts)
+            return value_type, _inno_text(parts[0] if parts else '')
+        if value_type in ('dword', 'qword'):
+            return value_type, str(int.from_bytes(raw, 'little'))
+        return 'binary', ' '.join('{:02x}'.format(byte) for byte in raw)
+    raise ValueError("Unsupported registry value: {}".format(data))
+
+
+def _reg_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Join lines continued with a trailing backslash and drop comments and blanks."""
+    pending = ''
+    for raw_line in lines:
+        line = raw_line.strip()
+        if pending:
+            line = pending + line
+            pending = ''
+        if line.endswith('\\') and not line.startswith('['):
+            pending = line[:-1]
+            continue
+        if line and line[0] != ';':
+            yield line
+    if pending:
+        yield pending
+
+
+def parse_reg(lines: Iterable[str], flags: str = "", components: str = "") -> List[RegistryEntry]:
+    """Turn the lines of a REGEDIT4 or version 5.00 .reg export into RegistryEntry rows.
+
+    Keys that appear more than once are merged and a value set twice keeps its last
+    data, as regedit would. Keys without values become key-only rows, deleted keys
+    and values (``[-KEY]`` and ``"name"=-``) get the deletekey and deletevalue flags.
+    ``flags`` and ``components`` are applied to every other row.
+    """
+    unicode = True
+    # (root, lower case subkey) -> [root, subkey, {lower case value name: entry}, deleted]
+    keys: Dict[Any, List[Any]] = {}
+    current: Optional[List[Any]] = None
+    for line in _reg_lines(lines):
+        if line[0] == '[' and line[-1] == ']':
+            path = line[1:-1]
+            deleted = path.startswith('-')
+            root_name, _, subkey = path.lstrip('-').partition('\\')
+            root = REG_ROOTS.get(root_name.upper())
+            if root is None:
+                raise ValueError("Unknown registry root: {}".format(root_name))
+            key = (root, subkey.lower())
+            current = keys.get(key)
+            if current is None:
+                current = keys[key] = [root, _inno_text(subkey), {}, deleted]
+            elif deleted:
+                current[2].clear()
+                current[3] = True
+            continue
+        if line == 'REGEDIT4':
+            unicode = False
+            continue
+        if line.startswith('Windows Registry Editor'):
+            continue
+        match = _REG_VALUE_RE.match(line)
+        if match is None or current is None:
+            raise ValueError("Unexpected line in .reg file: {}".format(line))
+        name = '' if match.group(1) == '@' else _reg_unescape(match.group(2))
+        data = match.group(3)
+        if data == '-':
+            entry = RegistryEntry(root=current[0], subkey=current[1], value_name=_inno_text(name), flags="deletevalue")
+        else:
+            value_type, value_data = _reg_value(data, unicode)
+            entry = RegistryEntry(root=current[0], subkey=current[1], value_type=value_type,
+                                  value_name=_inno_text(name), value_data=value_data,
+                                  flags=flags, components=components)
+        current[2][name.lower()] = entry
+    entries = []
+    for root, subkey, values, deleted in keys.values():
+        if deleted:
+            entries.append(RegistryEntry(root=root, subkey=subkey, flags="deletekey"))
+        if values:
+            entries.extend(values.values())
+        elif not deleted:
+            entries.append(RegistryEntry(root=root, subkey=subkey, flags=flags, components=components))
+    return entries
+
+
+def import_reg(path: Union[str, pathlib.Path], flags: str = "", components: str = "",
+               encoding: Optional[str] = None) -> List[RegistryEntry]:
+    """Read a .reg export into RegistryEntry rows, see parse_reg.
+
+    The encoding is detected from the byte order mark; regedit writes version
+    5.00 files as UTF-16. Files without one are read as UTF-8 unless ``encoding``
+    says otherwise.
+    """
+    if encoding is None:
+        with open(str(path), 'rb') as reg_file:
+            start = reg_file.read(3)
+        if start[:2] in (b'\xff\xfe', b'\xfe\xff'):
+            encoding = 'utf-16'
+        else:
+            encoding = 'utf-8-sig'
+    with open(str(path), encoding=encoding) as reg_file:
+        return parse_reg(reg_file, flags=flags, components=components)
+
+
+# Windows MAX_PATH, counting the terminating NUL
+MAX_PATH = 260
+
+# stand-in for {app} when estimating installed path lengths
+DEFAULT_APP_DIR = "C:\\Program Files (x86)\\"
+
+# FileEntry flags under which a missing source is not an error
+_OPTIONAL_SOURCE_FLAGS = {str(FileFlags.SKIP_IF_SOURCE_DOESNT_EXIST), str(FileFlags.EXTERNAL)}
+
+
+@define
+class ValidationIssue:
+    """A problem found before compiling."""
+    severity: str = field(default="error")  # error or warning
+    section: str = field(default="")
+    index: int = field(default=-1)  # position in the section's entry list, -1 for installer-wide issues
+    message: str = field(default="")
+
+    def __str__(self) -> str:
+        location = "{}[{}]".format(self.section, self.index) if self.index >= 0 else self.section
+        return "{}: {}: {}".format(self.severity, location, self.message)
+
+
+class ValidationError(ValueError):
+    """Raised by InnosetupCompiler.build(validate=True) when validation finds errors."""
+
+    def __init__(self, issues: List[ValidationIssue]):
+        self.issues = issues
+        errors = [issue for issue in issues if issue.severity == "error"]
+        super().__init__("{} validation error(s):\n{}".format(len(errors), "\n".join(str(issue) for issue in errors[:20])))
+
+
+def _stat_chunk(paths: List[str]) -> List[Optional[os.stat_result]]:
+    results: List[Optional[os.stat_result]] = []
+    for path in paths:
+        try:
+            results.append(os.stat(path))
+        except (OSError, ValueError):
+            results.append(None)
+    return results
+
+
+def stat_paths(paths: Iterable[str], max_workers: Optional[int] = None, chunk_size: int = 2048,
+               cache: Optional[Dict[str, Optional[os.stat_result]]] = None) -> Dict[str, Optional[os.stat_result]]:
+    """Stat many paths at once on a thread pool; missing paths map to None.
+
+    Each worker stats a chunk of paths, so a million paths cost a few hundred
+    tasks rather than a million futures. Duplicates are stat'ed once. Paths
+    already in ``cache`` are not stat'ed again, and new results are added to it,
+    so one cache can be shared by validation and size rollups of the same build.
+    """
+    unique = list(dict.fromkeys(paths))
+    results: Dict[str, Optional[os.stat_result]] = {}
+    if cache is not None:
+        results.update((path, cache[path]) for path in unique if path in cache)
+        unique = [path for path in unique if path not in results]
+    if len(unique) <= chunk_size:
+        fresh = dict(zip(unique, _stat_chunk(unique)))
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        chunks = [unique[start:start + chunk_size] for start in range(0, len(unique), chunk_size)]
+        fresh = {}
+        with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+            for chunk, stats in zip(chunks, executor.map(_stat_chunk, chunks)):
+                fresh.update(zip(chunk, stats))
+    if cache is not None:
+        cache.update(fresh)
+    results.update(fresh)
+    return results
+
+
+# words of Inno Setup boolean expressions, which Components and Types parameters may contain
+_EXPRESSION_WORDS = {'and', 'or', 'not'}
+
+
+def _referenced_names(expression: str) -> List[str]:
+    """Names used in a Components/Types parameter such as ``main or (help\\english and not dev)``."""
+    return [word for word in expression.replace('(', ' ').replace(')', ' ').split()
+            if word.lower() not in _EXPRESSION_WORDS]
+
+
+def validate_installer(installer: Installer, check_sources: bool = True, max_workers: Optional[int] = None,
+                       max_path: int = MAX_PATH, app_dir: str = DEFAULT_APP_DIR,
+                       stat_cache: Optional[Dict[str, Optional[os.stat_result]]] = None) -> List[ValidationIssue]:
+    """Check an installer for mistakes ISCC would only report late, or not at all.
+
+    Component and type names are indexed once, then every ``components`` and
+    ``types`` reference is checked against them. Files installed to the same
+    destination are reported, as errors unless they belong to different
+    components. Installed paths are estimated with ``app_dir`` standing in for
+    {app} and checked against ``max_path``. With ``check_sources`` every source
+    is stat'ed in parallel and missing ones are errors unless the entry is
+    external or has skipifsourcedoesntexist. ``stat_cache`` is passed on to
+    stat_paths.
+    """
+    issues: List[ValidationIssue] = []
+    files = _file_list(installer.files)
+    component_names = {component.name.lower() for component in installer.components}
+    type_names = {component_type.name.lower() for component_type in installer.component_types}
+
+    for index, component in enumerate(installer.components):
+        for name in _referenced_names(component.types):
+            if name.lower() not in type_names:
+                issues.append(ValidationIssue("error", "components", index,
+                                              "{} uses unknown type {!r}".format(component.name, name)))
+
+    sections = _section_entries(installer)
+    sections['files'] = files
+    referencing = [(section, sections[section]) for section in SECTION_ATTRIBUTES
+                   if section not in ('types', 'components')]
+    # most entries share a handful of expressions, so each is checked once
+    unknown_by_expression: Dict[str, List[str]] = {}
+    for section, entries in referencing:
+        for index, entry in enumerate(entries):
+            if not entry.components:
+                continue
+            unknown = unknown_by_expression.get(entry.components)
+            if unknown is None:
+                unknown = unknown_by_expression[entry.components] = [
+                    name for name in _referenced_names(entry.components) if name.lower() not in component_names]
+            for name in unknown:
+                issues.append(ValidationIssue("error", section, index, "unknown component {!r}".format(name)))
+
+    destinations: Dict[Any, int] = {}
+    app_prefix = len(app_dir) + len(installer.app_name) + 1
+    for index, entry in enumerate(files):
+        source = entry.source or ''
+        if not source:
+            issues.append(ValidationIssue("error", "files", index, "entry has no source"))
+            continue
+        if _is_wildcard(source):
+            continue
+        key = _file_key(entry)
+        first = destinations.setdefault(key, index)
+        if first != index:
+            other = files[first]
+            exclusive = other.components and entry.components and other.components != entry.components
+            issues.append(ValidationIssue("warning" if exclusive else "error", "files", index,
+                                          "destination {!r} already used by files[{}]".format("\\".join(key), first)))
+        installed_length = app_prefix + len(key[0]) + 1 + len(key[1])
+        if installed_length >= max_path:
+            issues.append(ValidationIssue("warning", "files", index,
+                                          "installed path is about {} characters, over {}".format(installed_length, max_path)))
+        if len(source) >= max_path:
+            issues.append(ValidationIssue("warning", "files", index,
+                                          "source path is {} characters, over {}".format(len(source), max_path)))
+
+    if check_sources:
+        checked = [(index, entry.source) for index, entry in enumerate(files)
+                   if entry.source and not _is_wildcard(entry.source)
+                   and not _OPTIONAL_SOURCE_FLAGS.intersection(entry.flags_string.split())]
+        stats = stat_paths((source for _, source in checked), max_workers=max_workers, cache=stat_cache)
+        for index, source in checked:
+            if stats[source] is None:
+                issues.append(ValidationIssue("error", "files", index, "source {!r} does not exist".format(source)))
+        if installer.license_file and not os.path.exists(installer.license_file):
+            issues.append(ValidationIssue("error", "setup", -1,
+                                          "license file {!r} does not exist".format(installer.license_file)))
+    return issues
+
+
+def validate_variants(installer: Installer, variants: List['Variant'], check_sources: bool = True,
+                      max_workers: Optional[int] = None,
+                      stat_cache: Optional[Dict[str, Optional[os.stat_result]]] = None) -> List[ValidationIssue]:
+    """Validate a shared installer once and each variant's own entries on top of it.
+
+    A variant's entries may use the shared components and types, and its files
+    must not be installed where a shared file is. Issues of a variant have its
+    name in front of their section, such as ``pro:files``.
+    """
+    if isinstance(installer.files, FileSource):
+        import attr
+        installer = attr.evolve(installer, files=list(installer.files))
+    issues = validate_installer(installer, check_sources=check_sources, max_workers=max_workers, stat_cache=stat_cache)
+    shared_destinations = {_file_key(entry): index for index, entry in enumerate(installer.files)
+                           if entry.source and not _is_wildcard(entry.source)}
+    shared_components = len(installer.components)
+    for variant in variants:
+        own = Installer(app_name=installer.app_name,
+                        **{attribute: getattr(variant, attribute) for attribute in SECTION_ATTRIBUTES.values()})
+        own.component_types = installer.component_types + own.component_types
+        own.components = installer.components + own.components
+        for issue in validate_installer(own, check_sources=check_sources, max_workers=max_workers, stat_cache=stat_cache):
+            if issue.section == "components":
+                if issue.index < shared_components:
+                    continue  # already reported for the shared installer
+                issue.index -= shared_components
+            issue.section = "{}:{}".format(variant.name, issue.section)
+            issues.append(issue)
+        for index, entry in enumerate(variant.files):
+            if not entry.source or _is_wildcard(entry.source):
+                continue
+            key = _file_key(entry)
+            first = shared_destinations.get(key)
+            if first is not None:
+                other = installer.files[first]
+                exclusive = other.components and entry.components and other.components != entry.components
+                issues.append(ValidationIssue("warning" if exclusive else "error", "{}:files".format(variant.name), index,
+                                              "destination {!r} already used by shared files[{}]".format("\\".join(key), first)))
+    return issues
+
+
+@define
+class SizeRollup:
+    """Real payload sizes summed per component, destination directory and type.
+
+    Directory totals include their subdirectories, so ``directories['']`` is
+    the whole {app} payload, and component totals include their child
+    components. A file whose Components parameter names several components
+    counts towards each of them, and files without components count towards
+    every type. ``unsized`` lists the indexes of files whose size is unknown:
+    wildcards, missing sources and external sources such as ``{src}\\x``.
+    """
+    total_bytes: int = field(default=0)
+    external_bytes: int = field(default=0)
+    components: Dict[str, int] = field(default=Factory(dict))
+    directories: Dict[str, int] = field(default=Factory(dict))
+    types: Dict[str, int] = field(default=Factory(dict))
+    file_sizes: List[Optional[int]] = field(default=Factory(list))
+    unsized: List[int] = field(default=Factory(list))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """A JSON-serialisable form of the rollup, largest entries first."""
+        def ranked(sizes: Dict[str, int]) -> Dict[str, int]:
+            return dict(sorted(sizes.items(), key=lambda item: (-item[1], item[0])))
+        return {'total_bytes': self.total_bytes, 'external_bytes': self.external_bytes,
+                'components': ranked(self.components), 'directories': ranked(self.directories),
+                'types': ranked(self.types), 'unsized': self.unsized}
+
+    def summary(self, top: int = 10) -> str:
+        """A short human readable report of where the payload goes."""
+        lines = ["payload: {} bytes ({} external, {} files unsized)".format(
+            self.total_bytes, self.external_bytes, len(self.unsized))]
+        for title, sizes in (("types", self.types), ("components", self.components), ("directories", self.directories)):
+            if sizes:
+                lines.append(title + ":")
+                for name, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0]))[:top]:
+                    lines.append("  {:>14}  {}".format(size, name or "{app}"))
+        return "\n".join(lines)
+
+
+def _component_and_ancestors(name: str) -> List[str]:
+    parts = name.split('\\')
+    return ['\\'.join(parts[:end]) for end in range(1, len(parts) + 1)]
+
+
+def _selected_components(expression: str) -> List[str]:
+    """Names a Components expression selects, leaving out the ones behind a ``not``."""
+    words = expression.replace('(', ' ').replace(')', ' ').split()
+    return [word for position, word in enumerate(words) if word.lower() not in _EXPRESSION_WORDS
+            and not (position and words[position - 1].lower() == 'not')]
+
+
+def _assign(entries: List[Any], index: int, **changes: Any) -> None:
+    """Change an entry in place, or replace it in ``entries`` when it is frozen."""
+    entry = entries[index]
+    if isinstance(entry, FrozenEntry):
+        import attr
+        entries[index] = attr.evolve(entry, **changes)
+    else:
+        for name, value in changes.items():
+            setattr(entry, name, value)
+
+
+def size_rollup(installer: Installer, fill_external_size: bool = False, fill_extra_disk_space: bool = False,
+                max_workers: Optional[int] = None,
+                stat_cache: Optional[Dict[str, Optional[os.stat_result]]] = None) -> SizeRollup:
+    """Sum the real sizes of an installer's files in one pass over ``installer.files``.
+
+    Sources are stat'ed in parallel through stat_paths, sharing ``stat_cache``.
+    Inno Setup sizes the files it compiles in itself; what it cannot see is
+    external files. With ``fill_external_size`` every external file of known
+    size gets its ExternalSize, and with ``fill_extra_disk_space`` the
+    ExtraDiskSpaceRequired of each component with external files which still
+    have no ExternalSize is set to their bytes; other components keep theirs.
+    The files of a FileSource are read in one pass; only the mutable entries
+    of a source with passes="cache" keep their ExternalSize.
+    """
+    rollup = SizeRollup()
+    names = {component.name.lower(): component.name for component in installer.components}
+    types_of = {component.name.lower(): component.types.split() for component in installer.components}
+    all_types = [component_type.name for component_type in installer.component_types]
+    files = _file_list(installer.files)
+    sources = [entry.source for entry in files
+               if entry.source and not _is_wildcard(entry.source)]
+    stats = stat_paths(sources, max_workers=max_workers, cache=stat_cache)
+
+    # a few Components expressions and destinations are shared by many files, so
+    # bytes are summed per expression and destination and only then rolled up
+    by_expression: Dict[str, int] = {}
+    by_destination: Dict[str, int] = {}
+    unsized_external: Dict[str, int] = {}
+    external_flag = str(FileFlags.EXTERNAL)
+    for index, entry in enumerate(files):
+        stat = stats.get(entry.source) if entry.source else None
+        if stat is None:
+            rollup.file_sizes.append(None)
+            rollup.unsized.append(index)
+            continue
+        size = stat.st_size
+        rollup.file_sizes.append(size)
+        rollup.total_bytes += size
+        by_expression[entry.components] = by_expression.get(entry.components, 0) + size
+        by_destination[entry.destination or ''] = by_destination.get(entry.destination or '', 0) + size
+        flags = entry.flags_string
+        if external_flag in flags and external_flag in flags.split():
+            rollup.external_bytes += size
+            if fill_external_size:
+                _assign(files, index, external_size=str(size))
+            elif not entry.external_size:
+                unsized_external[entry.components] = unsized_external.get(entry.components, 0) + size
+
+    external_by_component: Dict[str, int] = {}
+    for expression, size in by_expression.items():
+        direct = [names.get(word.lower(), word) for word in _selected_components(expression)]
+        for name in dict.fromkeys(names.get(ancestor.lower(), ancestor)
+                                  for name in direct for ancestor in _component_and_ancestors(name)):
+            rollup.components[name] = rollup.components.get(name, 0) + size
+        type_names = dict.fromkeys(type_name for name in direct for type_name in types_of.get(name.lower(), []))
+        for name in (type_names if direct else all_types):
+            rollup.types[name] = rollup.types.get(name, 0) + size
+        for name in direct:
+            external_by_component[name.lower()] = (external_by_component.get(name.lower(), 0)
+                                                   + unsized_external.get(expression, 0))
+
+    spelling: Dict[str, str] = {}
+    for destination, size in by_destination.items():
+        key = ''
+        rollup.directories[key] = rollup.directories.get(key, 0) + size
+        for part in _destination_parts(destination):
+            key = key + '\\' + part if key else part
+            key = spelling.setdefault(key.lower(), key)
+            rollup.directories[key] = rollup.directories.get(key, 0) + size
+
+    if fill_extra_disk_space:
+        for index, component in enumerate(installer.components):
+            extra = external_by_component.get(component.name.lower(), 0)
+            if extra:
+                _assign(installer.components, index, extra_disk_space_required=str(extra))
+    return rollup
+
+
+# extensions whose content is already compressed; they are not sampled
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.7z', '.bz2', '.cab', '.gz', '.jpeg', '.jpg', '.mp3', '.mp4', '.msi', '.nupkg', '.ogg', '.png', '.rar',
+    '.webm', '.webp', '.whl', '.xz', '.zip', '.zst',
+}
+
+
+@define
+class PayloadTotals:
+    """File count, raw bytes and estimated compressed bytes of part of a payload."""
+    files: int = field(default=0)
+    raw_bytes: int = field(default=0)
+    compressed_bytes: int = field(default=0)
+
+    def add(self, files: int, raw_bytes: int, compressed_bytes: int) -> None:
+        self.files += files
+        self.raw_bytes += raw_bytes
+        self.compressed_bytes += compressed_bytes
+
+    def to_dict(self) -> Dict[str, int]:
+        return {'files': self.files, 'raw_bytes': self.raw_bytes, 'compressed_bytes': self.compressed_bytes}
+
+
+@define
+class PayloadNode(PayloadTotals):
+    """A destination directory in a payload report; its totals include its subdirectories."""
+    name: str = field(default="")
+    children: Dict[str, "PayloadNode"] = field(default=Factory(dict))  # lower case name -> node
+
+    def child(self, name: str) -> "PayloadNode":
+        node = self.children.get(name.lower())
+        if node is None:
+            node = self.children[name.lower()] = PayloadNode(name=name)
+        return node
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {'name': self.name}
+        data.update(super().to_dict())
+        children = sorted(self.children.values(), key=lambda node: (-node.raw_bytes, node.name))
+        data['children'] = [child.to_dict() for child in children]
+        return data
+
+
+class _CompressionEstimator:
+    """Estimates compressed sizes per extension from LZMA-compressed samples.
+
+    The first ``samples`` files of each extension have up to ``sample_bytes``
+    read and compressed, so the cost is bounded by the number of extensions,
+    not the number of files. Files are estimated with the ratio known when
+    they are seen, which is exact enough for a report.
+    """
+
+    def __init__(self, samples: int, sample_bytes: int):
+        self.samples = samples
+        self.sample_bytes = sample_bytes
+        self.sampled: Dict[str, Tuple[int, int, int]] = {}  # extension -> (files, raw bytes, compressed bytes)
+        self.ratios: Dict[str, float] = dict.fromkeys(INCOMPRESSIBLE_EXTENSIONS, 1.0)  # settled ratios
+        self.compress_seconds = 0.0  # time spent compressing samples, and their bytes
+        self.compressed_input_bytes = 0
+
+    def ratio(self, extension: str, path: str) -> float:
+        settled = self.ratios.get(extension)
+        if settled is not None:
+            return settled
+        files, raw, compressed = self.sampled.get(extension, (0, 0, 0))
+        if files < self.samples:
+            import lzma
+            try:
+                with open(path, 'rb') as sample_file:
+                    sample = sample_file.read(self.sample_bytes)
+            except OSError:
+                sample = b""
+            if sample:
+                started = time.perf_counter()
+                # the xz container adds a fixed overhead that would dwarf tiny samples
+                compressed += max(1, len(lzma.compress(sample, format=lzma.FORMAT_RAW,
+                                                       filters=[{'id': lzma.FILTER_LZMA2, 'preset': 6}])))
+                self.compress_seconds += time.perf_counter() - started
+                self.compressed_input_bytes += len(sample)
+                raw += len(sample)
+            self.sampled[extension] = (files + 1, raw, compressed)
+        ratio = min(1.0, compressed / raw) if raw else 1.0
+        if files + 1 >= self.samples:
+            self.ratios[extension] = ratio
+        return ratio
+
+
+def _squarify(sizes: List[float], x: float, y: float, width: float, height: float) -> List[Tuple[float, float, float, float]]:
+    """Lay out sizes, largest first, as rectangles filling the given one (squarified treemap)."""
+    def worst(row: List[float], side: float) -> float:
+        total = sum(row)
+        return max(max(row) * side * side / (total * total), total * total / (side * side * min(row)))
+
+    total = sum(sizes)
+    areas = [size * width * height / total for size in sizes] if total else []
+    rectangles = []
+    index = 0
+    while index < len(areas):
+        side = min(width, height) or 1e-9
+        row = [areas[index]]
+        index += 1
+        while index < len(areas) and worst(row + [areas[index]], side) <= worst(row, side):
+            row.append(areas[index])
+            index += 1
+        row_area = sum(row)
+        if width >= height:
+            column = row_area / height if height else 0.0
+            offset = y
+            for area in row:
+                rectangles.append((x, offset, column, area / column if column else 0.0))
+                offset += rectangles[-1][3]
+            x += column
+            width -= column
+        else:
+            band = row_area / width if width else 0.0
+            offset = x
+            for area in row:
+                rectangles.append((offset, y, area / band if band else 0.0, band))
+                offset += rectangles[-1][2]
+            y += band
+            height -= band
+    return rectangles
+
+
+_TREEMAP_COLOURS = ['#4e79a7', '#f28e2b', '#59a14f', '#e15759', '#76b7b2', '#edc948', '#b07aa1', '#9c755f']
+
+
+@define
+class PayloadReport:
+    """Raw and estimated compressed payload bytes by destination directory, extension and component."""
+    root: PayloadNode = field(default=Factory(PayloadNode))
+    extensions: Dict[str, PayloadTotals] = field(default=Factory(dict))
+    components: Dict[str, PayloadTotals] = field(default=Factory(dict))  # "" for files without components
+    unsized: int = field(default=0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """A JSON-serialisable form of the report, largest entries first."""
+        def ranked(totals: Dict[str, PayloadTotals]) -> Dict[str, Dict[str, int]]:
+            ordered = sorted(totals.items(), key=lambda item: (-item[1].raw_bytes, item[0]))
+            return {name: total.to_dict() for name, total in ordered}
+        return {'totals': PayloadTotals.to_dict(self.root), 'unsized_files': self.unsized,
+                'directories': self.root.to_dict(), 'extensions': ranked(self.extensions),
+                'components': ranked(self.components)}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_html(self, width: int = 1200, height: int = 800, max_depth: int = 4, min_pixels: float = 4.0) -> str:
+        """A self-contained HTML page with a treemap of the directories by raw size.
+
+        Directories are nested ``max_depth`` deep; rectangles smaller than
+        ``min_pixels`` on either side are left out to keep the page small.
+        """
+        import html
+        boxes: List[str] = []
+
+        def megabytes(size: int) -> str:
+            return "{:.1f} MB".format(size / 1048576.0)
+
+        def draw(node: PayloadNode, path: str, x: float, y: float, w: float, h: float, depth: int) -> None:
+            if w < min_pixels or h < min_pixels:
+                return
+            title = "{}\n{} files, {} raw, {} compressed".format(
+                path or "{app}", node.files, megabytes(node.raw_bytes), megabytes(node.compressed_bytes))
+            boxes.append('<div class="box" style="left:{:.1f}px;top:{:.1f}px;width:{:.1f}px;height:{:.1f}px;'
+                         'background:{}" title="{}">{}</div>'.format(
+                             x, y, w, h, _TREEMAP_COLOURS[depth % len(_TREEMAP_COLOURS)], html.escape(title),
+                             html.escape(node.name or "{app}") if w > 60 and h > 16 else ""))
+            if depth >= max_depth or not node.children:
+                return
+            children = sorted((child for child in node.children.values() if child.raw_bytes > 0),
+                              key=lambda child: -child.raw_bytes)
+            # leave room for the label and for files directly in this directory
+            own = node.raw_bytes - sum(child.raw_bytes for child in children)
+            sizes = [float(child.raw_bytes) for child in children] + ([float(own)] if own > 0 else [])
+            inner = _squarify(sizes, x + 2, y + 16, max(0.0, w - 4), max(0.0, h - 18))
+            for child, (cx, cy, cw, ch) in zip(children, inner):
+                draw(child, path + "\\" + child.name if path else child.name, cx, cy, cw, ch, depth + 1)
+
+        draw(self.root, "", 0, 0, width, height, 0)
+        return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Payload treemap</title><style>'
+                'body{{font:12px sans-serif}}#map{{position:relative;width:{}px;height:{}px}}'
+                '.box{{position:absolute;box-sizing:border-box;border:1px solid #fff;overflow:hidden;color:#fff;'
+                'padding:1px 3px;white-space:nowrap}}</style></head><body>\n<h1>Payload: {} raw, {} compressed</h1>\n'
+                '<div id="map">\n{}\n</div></body></html>\n').format(
+                    width, height, megabytes(self.root.raw_bytes), megabytes(self.root.compressed_bytes),
+                    "\n".join(boxes))
+
+    def write(self, json_path: Optional[Union[str, pathlib.Path]] = None,
+              html_path: Optional[Union[str, pathlib.Path]] = None) -> None:
+        """Write the JSON report and/or the HTML treemap."""
+        if json_path is not None:
+            pathlib.Path(json_path).write_text(self.to_json(), encoding='utf-8')
+        if html_path is not None:
+            pathlib.Path(html_path).write_text(self.to_html(), encoding='utf-8')
+
+
+def payload_report(files: Iterable[FileEntry], samples: int = 4, sample_bytes: int = 65536,
+                   stat_cache: Optional[Dict[str, Optional[os.stat_result]]] = None) -> PayloadReport:
+    """Break a payload down by destination directory, extension and component.
+
+    ``files`` may be a generator such as all_files(), which is consumed in one
+    pass: each source is stat'ed (or looked up in ``stat_cache``) as it comes,
+    and bytes are summed per destination, extension and Components expression.
+    The directory trie is only built from the per-destination sums at the end,
+    so memory grows with the number of directories, not files. Compressed
+    sizes are estimated from a few LZMA-compressed samples per extension.
+    """
+    report = PayloadReport()
+    estimator = _CompressionEstimator(samples, sample_bytes)
+    # (extension, destination, Components expression) -> [files, raw bytes, compressed bytes]
+    groups: Dict[Tuple[str, str, str], List[int]] = {}
+    for entry in files:
+        source = entry.source or ''
+        if stat_cache is not None and source in stat_cache:
+            stat = stat_cache[source]
+        else:
+            stat = None
+            if source and not _is_wildcard(source):
+                try:
+                    stat = os.stat(source)
+                except (OSError, ValueError):
+                    pass
+            if stat_cache is not None:
+                stat_cache[source] = stat
+        if stat is None:
+            report.unsized += 1
+            continue
+        size = stat.st_size
+        name = entry.dest_name or source.replace('/', '\\').rpartition('\\')[2]
+        extension = _extension(name)
+        key = (extension, entry.destination or '', entry.components)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [0, 0, 0]
+        group[0] += 1
+        group[1] += size
+        group[2] += int(size * estimator.ratio(extension, source)) if size else 0
+
+    by_destination: Dict[str, PayloadTotals] = {}
+    by_expression: Dict[str, PayloadTotals] = {}
+    for (extension, destination, expression), group in groups.items():
+        for totals, key in ((report.extensions, extension), (by_destination, destination),
+                            (by_expression, expression)):
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = PayloadTotals()
+            total.add(*group)
+
+    for expression, total in by_expression.items():
+        for name in _selected_components(expression) or ['']:
+            report.components.setdefault(name, PayloadTotals()).add(total.files, total.raw_bytes,
+                                                                   total.compressed_bytes)
+    for destination, total in by_destination.items():
+        node = report.root
+        node.add(total.files, total.raw_bytes, total.compressed_bytes)
+        for part in _destination_parts(destination):
+            node = node.child(part)
+            node.add(total.files, total.raw_bytes, total.compressed_bytes)
+    return report
+
+
+# LZMA throughput assumed for OffloadReport's projection when no sample was compressed
+LZMA_BYTES_PER_SECOND = 2 << 20
+
+# what OffloadPolicy does with the files it offloads
+OFFLOAD_ACTIONS = ("nocompression", "external")
+
+
+@define
+class OffloadReport:
+    """The files after OffloadPolicy.apply and what was offloaded.
+
+    ``offloaded`` maps each offloaded source to its size and estimated LZMA
+    ratio. ``external`` maps the sources of files made external to where the
+    installer reads them at install time; copying them there is left to the
+    release. ``projected_seconds_saved`` is the LZMA time the compile no
+    longer spends on the offloaded bytes at ``bytes_per_second``.
+    """
+    files: List[FileEntry] = field(default=Factory(list))
+    offloaded: Dict[str, Tuple[int, float]] = field(default=Factory(dict))
+    external: Dict[str, str] = field(default=Factory(dict))
+    offloaded_bytes: int = field(default=0)
+    bytes_per_second: float = field(default=float(LZMA_BYTES_PER_SECOND))
+
+    @property
+    def projected_seconds_saved(self) -> float:
+        return self.offloaded_bytes / self.bytes_per_second if self.bytes_per_second else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'offloaded': {source: {'bytes': size, 'ratio': ratio}
+                              for source, (size, ratio) in self.offloaded.items()},
+                'external': dict(self.external), 'offloaded_bytes': self.offloaded_bytes,
+                'bytes_per_second': self.bytes_per_second,
+                'projected_seconds_saved': self.projected_seconds_saved}
+
+
+@define
+class OffloadPolicy:
+    """Which payload files are not worth compressing, and what becomes of them.
+
+    A file of at least ``threshold_bytes`` whose LZMA ratio, estimated from
+    samples as payload_report does, is at least ``min_ratio`` is offloaded:
+    with ``action="nocompression"`` it is stored in the installer as it is,
+    with ``action="external"`` it is read from ``external_dir`` at install
+    time and its ExternalSize is filled in. ``bytes_per_second`` is the LZMA
+    throughput for the projected saving; it is measured on the samples when
+    None.
+    """
+    threshold_bytes: int = field(default=64 << 20)
+    min_ratio: float = field(default=0.9)
+    action: str = field(default="nocompression")
+    external_dir: str = field(default="{src}")
+    samples: int = field(default=4)
+    sample_bytes: int = field(default=1 << 20)
+    bytes_per_second: Optional[float] = field(default=None)
+
+    def apply(self, files: Iterable[FileEntry], max_workers: Optional[int] = None,
+              stat_cache: Optional[Dict[str, Optional[os.stat_result]]] = None) -> OffloadReport:
+        """This method offloads the large, poorly compressible files among ``files``.
+
+        ``files`` is left as it was; the report holds the new list, with the
+        offloaded entries moved to the end so the compressible files stay
+        together in the solid stream. An entry installing to the same place
+        as another keeps its position, since their order decides which one
+        wins. Wildcard sources and files already external or stored are
+        left alone.
+        """
+        import attr
+        if self.action not in OFFLOAD_ACTIONS:
+            raise ValueError("action must be one of {}, not {!r}".format(", ".join(OFFLOAD_ACTIONS), self.action))
+        files = _file_list(files)
+        settled = {str(FileFlags.EXTERNAL), str(FileFlags.NO_COMPRESSION)}
+        stats = stat_paths([entry.source for entry in files
+                            if entry.source and not _is_wildcard(entry.source)
+                            and settled.isdisjoint(entry.flags_string.split())],
+                           max_workers=max_workers, cache=stat_cache)
+        destinations: Dict[Any, int] = {}
+        for entry in files:
+            key = _file_key(entry)
+            destinations[key] = destinations.get(key, 0) + 1
+        estimator = _CompressionEstimator(self.samples, self.sample_bytes)
+        report = OffloadReport()
+        kept: List[FileEntry] = []
+        moved: List[FileEntry] = []
+        for entry in files:
+            stat = stats.get(entry.source) if entry.source else None
+            if stat is None or stat.st_size < self.threshold_bytes:
+                kept.append(entry)
+                continue
+            name = entry.dest_name or entry.source.replace('/', '\\').rpartition('\\')[2]
+            ratio = estimator.ratio(_extension(name), entry.source)
+            if ratio < self.min_ratio:
+                kept.append(entry)
+                continue
+            report.offloaded[entry.source] = (stat.st_size, ratio)
+            report.offloaded_bytes += stat.st_size
+            unique = destinations[_file_key(entry)] == 1
+            if self.action == "external":
+                source = "\\".join(part for part in (self.external_dir, _inno_path(entry.destination or ""), name)
+                                   if part)
+                report.external[entry.source] = source
+                entry = attr.evolve(entry, source=source, external_size=str(stat.st_size),
+                                    flags=_with_flag(entry.flags, FileFlags.EXTERNAL))
+            else:
+                entry = attr.evolve(entry, flags=_with_flag(entry.flags, FileFlags.NO_COMPRESSION))
+            (moved if unique else kept).append(entry)
+        report.files = kept + moved
+        if self.bytes_per_second is not None:
+            report.bytes_per_second = float(self.bytes_per_second)
+        elif estimator.compress_seconds > 0:
+            report.bytes_per_second = estimator.compressed_input_bytes / estimator.compress_seconds
+        return report
+
+
+def _with_flag(flags: Union[str, List[FileFlags], FileFlags], flag: FileFlags) -> Union[str, List[FileFlags]]:
+    """``flags`` with ``flag`` added, keeping a list a list."""
+    if isinstance(flags, list):
+        return flags if flag in flags else flags + [flag]
+    return _merge_flags(str(flags), str(flag))
+
+
+def _hash_chunk(paths: List[str]) -> List[Optional[str]]:
+    import hashlib
+    digests: List[Optional[str]] = []
+    for path in paths:
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as source:
+                for block in iter(lambda: source.read(1 << 20), b""):
+                    digest.update(block)
+        except (OSError, ValueError):
+            digests.append(None)
+            continue
+        digests.append(digest.hexdigest())
+    return digests
+
+
+def hash_paths(paths: Iterable[str], max_workers: Optional[int] = None, chunk_size: int = 256,
+               cache: Optional[Dict[str, Tuple[int, int, str]]] = None) -> Dict[str, Optional[str]]:
+    """SHA-256 the contents of many files on a thread pool; missing files map to None.
+
+    ``cache`` maps a path to (size, mtime_ns, digest) and is checked with a
+    stat, so a long-lived cache only re-reads files which changed.
+    """
+    unique = list(dict.fromkeys(paths))
+    results: Dict[str, Optional[str]] = {}
+    stats = stat_paths(unique, max_workers=max_workers) if cache is not None else {}
+    if cache is not None:
+        for path in unique:
+            stat, cached = stats[path], cache.get(path)
+            if stat is not None and cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                results[path] = cached[2]
+        unique = [path for path in unique if path not in results]
+    chunks = [unique[start:start + chunk_size] for start in range(0, len(unique), chunk_size)]
+    if len(chunks) <= 1:
+        digests = [_hash_chunk(chunk) for chunk in chunks]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+            digests = list(executor.map(_hash_chunk, chunks))
+    for chunk, chunk_digests in zip(chunks, digests):
+        for path, digest in zip(chunk, chunk_digests):
+            results[path] = digest
+            stat = stats.get(path)
+            if cache is not None and digest is not None and stat is not None:
+                cache[path] = (stat.st_size, stat.st_mtime_ns, digest)
+    return results
+
+
+# bump when the fingerprint's inputs change, so older artifacts are not reused
+FINGERPRINT_VERSION = "1"
+
+
+def build_fingerprint(script: str, installer: Installer, compiler_version: Optional[str] = None,
+                      source_root: Optional[Union[str, pathlib.Path]] = None, max_workers: Optional[int] = None,
+                      hash_cache: Optional[Dict[str, Tuple[int, int, str]]] = None) -> str:
+    """The key of a compiled installer: a SHA-256 of the rendered script, the
+    compiler version and the contents of every source and the license file.
+
+    Sources are identified by content, so a checkout with new timestamps keeps
+    its key. When agents build from different directories, ``source_root`` is
+    replaced by a placeholder in the script before hashing so they share keys.
+    Wildcard sources are only represented by their pattern in the script.
+    """
+    import hashlib
+    if source_root is not None:
+        script = script.replace(str(source_root), "{source_root}")
+    sources = [entry.source for entry in installer.files
+               if entry.source and not _is_wildcard(entry.source)]
+    if installer.license_file:
+        sources.append(installer.license_file)
+    digests = hash_paths(sources, max_workers=max_workers, cache=hash_cache)
+    fingerprint = hashlib.sha256()
+    for part in (FINGERPRINT_VERSION, compiler_version or "", script):
+        fingerprint.update(part.encode('utf-8'))
+        fingerprint.update(b"\0")
+    for source in sources:
+        fingerprint.update((digests[source] or "missing").encode('ascii'))
+    return fingerprint.hexdigest()
+
+
+class ArtifactStore(ABC):
+    """Where compiled installers are kept by fingerprint, for InnosetupCompiler.build(store=...).
+
+    Backends implement get and put; a put must publish atomically, since other
+    processes may get the same key at any time.
+    """
+
+    @abstractmethod
+    def get(self, key: str, destination: Union[str, pathlib.Path]) -> bool:
+        """Copy the artifact stored under ``key`` to ``destination``; False when there is none."""
+
+    @abstractmethod
+    def put(self, key: str, source: Union[str, pathlib.Path]) -> None:
+        """Store the file ``source`` under ``key``."""
+
+
+_ARTIFACT_KEY = re.compile(r'[0-9a-f]{16,128}')
+
+
+@define
+class LocalArtifactStore(ArtifactStore):
+    """An artifact store in a directory, which may be shared by several machines over NFS or SMB.
+
+    Artifacts are published by writing a temporary file in the store and
+    renaming it into place, so readers see a whole artifact or none. Reads
+    copy the artifact and refresh its modification time, which orders the
+    least recently used eviction down to ``max_bytes``. A reader which has
+    an artifact open keeps reading it even if another process evicts it.
+    """
+    root: pathlib.Path = field(converter=pathlib.Path)
+    max_bytes: Optional[int] = field(default=None)
+
+    def path(self, key: str) -> pathlib.Path:
+        if not _ARTIFACT_KEY.fullmatch(key):
+            raise ValueError("not an artifact key: {!r}".format(key))
+        return self.root / "objects" / key[:2] / key
+
+    def __contains__(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def get(self, key: str, destination: Union[str, pathlib.Path]) -> bool:
+        import shutil
+        import threading
+        path = self.path(key)
+        destination = pathlib.Path(destination)
+        try:
+            artifact = open(path, 'rb')
+        except FileNotFoundError:
+            return False
+        temporary = destination.with_name("{}.{}.{}.tmp".format(destination.name, os.getpid(), threading.get_ident()))
+        try:
+            with artifact, open(temporary, 'wb') as copy:
+                shutil.copyfileobj(artifact, copy, 1 << 20)
+            os.replace(str(temporary), str(destination))
+        except BaseException:
+            if temporary.exists():
+                temporary.unlink()
+            raise
+        try:
+            os.utime(str(path))
+        except OSError:
+            pass
+        return True
+
+    def put(self, key: str, source: Union[str, pathlib.Path]) -> None:
+        import shutil
+        import tempfile
+        path = self.path(key)
+        if path.exists():
+            # the same key means the same content; only mark it as used
+            os.utime(str(path))
+            return
+        incoming = self.root / "incoming"
+        incoming.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=str(incoming))
+        try:
+            with os.fdopen(descriptor, 'wb') as copy, open(source, 'rb') as artifact:
+                shutil.copyfileobj(artifact, copy, 1 << 20)
+                copy.flush()
+                os.fsync(copy.fileno())
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temporary, str(path))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes: int) -> List[str]:
+        """Delete the least recently used artifacts until the store holds at most
+        ``max_bytes``, returning the evicted keys. Safe to run from several
+        processes at once."""
+        artifacts = []
+        for path in (self.root / "objects").glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            artifacts.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in artifacts)
+        evicted = []
+        for _, size, path in sorted(artifacts, key=lambda artifact: artifact[0]):
+            if total <= max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass  # another process evicted it first
+            except PermissionError:
+                continue  # open by a reader on Windows; try the next one
+            total -= size
+            evicted.append(path.name)
+        return evicted
+
+
+# extensions of the files signtool can sign, for Signer
+SIGNABLE_EXTENSIONS = {'.exe', '.dll', '.sys', '.ocx', '.msi', '.cab', '.cat', '.ps1'}
+
+
+@define
+class SigningReport:
+    """The outcome of Signer.sign: the file entries to package and what happened to each source.
+
+    ``files`` is the input list with the sources of signed files replaced by
+    their signed copies. ``signed`` lists the sources signed by this run and
+    ``cached`` those whose signed copy was already staged or in the cache.
+    """
+    files: List[FileEntry] = field(default=Factory(list))
+    signed: List[str] = field(default=Factory(list))
+    cached: List[str] = field(default=Factory(list))
+
+
+@define
+class Signer:
+    """Signs the executables of a payload before it is packaged.
+
+    ``command`` runs once per file, with ``$f`` in its arguments replaced by
+    the path of a copy to sign in place, like Inno Setup's SignTool. Up to
+    ``max_workers`` commands run at once. Signed copies are staged below
+    ``staging_dir`` and published to ``cache`` under a key made of the
+    unsigned content's hash and the command, so a binary which did not change
+    is never signed again, also by other machines sharing the cache.
+
+    Entries with the sign or signonce flag are left to Inno Setup, and
+    wildcard and external sources are not touched.
+    """
+    command: List[str]
+    staging_dir: pathlib.Path = field(converter=pathlib.Path)
+    cache: Optional[ArtifactStore] = field(default=None)
+    max_workers: int = field(default=4)
+    extensions: Iterable[str] = field(default=SIGNABLE_EXTENSIONS)
+
+    def signable(self, entry: FileEntry) -> bool:
+        """This method tells whether ``entry`` is signed by this signer."""
+        source = entry.source or ""
+        if _is_wildcard(source):
+            return False
+        flags = entry.flags_string.split()
+        if {str(FileFlags.SIGN), str(FileFlags.SIGN_ONCE), str(FileFlags.EXTERNAL)} & set(flags):
+            return False
+        return os.path.splitext(source)[1].lower() in self.extensions
+
+    def key(self, digest: str) -> str:
+        """This method returns the cache key of a file with the content hash ``digest``."""
+        import hashlib
+        return hashlib.sha256("\0".join([digest] + list(self.command)).encode('utf-8')).hexdigest()
+
+    def _sign(self, source: str, key: str, staged: pathlib.Path) -> bool:
+        """Stage the signed copy of ``source``; True when the command had to run."""
+        import shutil
+        import subprocess
+        import threading
+        if staged.exists():
+            return False
+        staged.parent.mkdir(parents=True, exist_ok=True)
+        if self.cache is not None and self.cache.get(key, staged):
+            return False
+        work = self.staging_dir / ".signing" / "{}.{}.{}".format(key, os.getpid(), threading.get_ident())
+        work.mkdir(parents=True)
+        try:
+            copy = work / staged.name
+            shutil.copyfile(source, str(copy))
+            subprocess.check_call([argument.replace("$f", str(copy)) for argument in self.command])
+            if self.cache is not None:
+                self.cache.put(key, copy)
+            os.replace(str(copy), str(staged))
+        finally:
+            shutil.rmtree(str(work), ignore_errors=True)
+        return True
+
+    def sign(self, files: Iterable[FileEntry], hash_cache: Optional[Dict[str, Tuple[int, int, str]]] = None) -> SigningReport:
+        """This method signs the signable files among ``files``
+
+        Sources are hashed on a thread pool first; a source which appears in
+        several entries, or whose content appears under several names, is
+        signed once per name. A failing command raises CalledProcessError.
+        """
+        import attr
+        from concurrent.futures import ThreadPoolExecutor
+        files = list(files)
+        sources = [entry.source for entry in files if self.signable(entry)]
+        digests = hash_paths(sources, cache=hash_cache)
+        missing = [source for source in sources if digests[source] is None]
+        if missing:
+            raise FileNotFoundError("cannot sign missing source {}".format(missing[0]))
+        jobs: Dict[pathlib.Path, Tuple[str, str]] = {}
+        staged_paths: Dict[str, pathlib.Path] = {}
+        for source in dict.fromkeys(sources):
+            key = self.key(digests[source])
+            staged = self.staging_dir / key[:2] / key / os.path.basename(source)
+            staged_paths[source] = staged
+            jobs.setdefault(staged, (source, key))
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            outcomes = list(executor.map(lambda item: self._sign(item[1][0], item[1][1], item[0]), jobs.items()))
+        report = SigningReport()
+        for (source, _), ran in zip(jobs.values(), outcomes):
+            (report.signed if ran else report.cached).append(source)
+        for source, staged in staged_paths.items():
+            if staged in jobs and jobs[staged][0] != source:
+                report.cached.append(source)
+        report.files = [attr.evolve(entry, source=str(staged_paths[entry.source]))
+                        if entry.source in staged_paths else entry for entry in files]
+        return report
+
+
+# LZMA dictionary size per Compression level; the encoder's match finder needs
+# about LZMA_MEMORY_PER_DICTIONARY_BYTE bytes for every dictionary byte
+LZMA_DICTIONARY_BYTES = {'fast': 1 << 20, 'normal': 1 << 24, 'max': 1 << 25, 'ultra': 1 << 26, 'ultra64': 1 << 30}
+LZMA_MEMORY_PER_DICTIONARY_BYTE = 11.5
+# what ISCC itself needs besides the compressor
+ISCC_BASE_MEMORY = 64 << 20
+OTHER_COMPRESSION_MEMORY = {'none': 0, 'zip': 1 << 20, 'bzip': 8 << 20}
+
+
+def _setup_directives(installer: Installer) -> Dict[str, str]:
+    """The [Setup] directives of an installer, lower cased, with extra_iss overriding the template."""
+    directives = _generated_setup(installer)
+    section = None
+    for line in installer.extra_iss.splitlines():
+        line = line.strip()
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1].lower()
+        elif section == "setup" and "=" in line and not line.startswith(";"):
+            name, _, value = line.partition("=")
+            directives[name.strip().lower()] = value.strip()
+    return directives
+
+
+@define
+class BuildCost:
+    """What a compile is expected to take from the host: resident memory and busy CPUs."""
+    memory_bytes: int = field(default=0)
+    cpus: int = field(default=1)
+
+
+def estimate_build_cost(installer: Installer, payload_bytes: Optional[int] = None) -> BuildCost:
+    """Estimate the memory and CPUs ISCC needs to compile ``installer``.
+
+    The estimate follows the [Setup] Compression, LZMADictionarySize and
+    LZMANumBlockThreads directives: every LZMA2 block thread has a dictionary
+    of its own, and a dictionary is never filled beyond the payload, which is
+    stat-ed when ``payload_bytes`` is not given; that takes one pass over the
+    files of a FileSource. The match finder of every level but fast runs on a
+    second thread.
+    """
+    directives = _setup_directives(installer)
+    method, _, level = directives.get('compression', 'lzma2/max').lower().partition("/")
+    if method not in ('lzma', 'lzma2'):
+        return BuildCost(ISCC_BASE_MEMORY + OTHER_COMPRESSION_MEMORY.get(method, 0), 1)
+    if payload_bytes is None:
+        payload_bytes = payload_size(_file_list(installer.files))
+    dictionary = LZMA_DICTIONARY_BYTES.get(level or 'max', LZMA_DICTIONARY_BYTES['max'])
+    if directives.get('lzmadictionarysize', '').isdigit():
+        dictionary = int(directives['lzmadictionarysize']) * 1024
+    threads = 1
+    if method == 'lzma2' and directives.get('lzmanumblockthreads', '').isdigit():
+        threads = max(1, int(directives['lzmanumblockthreads']))
+    # a solid stream is cut into blocks of four dictionaries, so small payloads keep fewer threads busy
+    threads = max(1, min(threads, -(-payload_bytes // (4 * dictionary))))
+    used = min(dictionary, max(payload_bytes, 1 << 16))
+    memory = ISCC_BASE_MEMORY + int(threads * used * LZMA_MEMORY_PER_DICTIONARY_BYTE)
+    return BuildCost(memory, threads * (1 if level == 'fast' else 2))
+
+
+@contextmanager
+def file_lock(path: Union[str, pathlib.Path]) -> Iterator[int]:
+    """Hold an exclusive lock on ``path`` across processes and yield its descriptor.
+
+    The file is created when needed; its contents are left to the caller.
+    """
+    descriptor = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    os.lseek(descriptor, 0, os.SEEK_SET)
+                    msvcrt.locking(descriptor, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ten seconds; keep waiting
+        else:
+            import fcntl
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+        try:
+            yield descriptor
+        finally:
+            if os.name == 'nt':
+                os.lseek(descriptor, 0, os.SEEK_SET)
+                msvcrt.locking(descriptor, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(descriptor, fcntl.LOCK_UN)
+    finally:
+        os.close(descriptor)
+
+
+@contextmanager
+def _locked_json(path: Union[str, pathlib.Path]) -> Iterator[Dict[str, Any]]:
+    """Load the JSON object kept in ``path`` under file_lock and write it back when the block ends."""
+    with file_lock(path) as descriptor:
+        data = b""
+        while True:
+            block = os.read(descriptor, 1 << 16)
+            if not block:
+                break
+            data += block
+        try:
+            state = json.loads(data.decode('utf-8')) if data else {}
+        except ValueError:
+            state = {}  # torn by a process killed while writing
+        if not isinstance(state, dict):
+            state = {}
+        yield state
+        os.lseek(descriptor, 0, os.SEEK_SET)
+        os.ftruncate(descriptor, 0)
+        os.write(descriptor, json.dumps(state).encode('utf-8'))
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION; os.kill would terminate the process on Windows
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _physical_memory() -> Optional[int]:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    if os.name == 'nt':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('length', ctypes.c_ulong), ('load', ctypes.c_ulong), ('total', ctypes.c_ulonglong),
+                        ('available', ctypes.c_ulonglong), ('rest', ctypes.c_ulonglong * 5)]
+
+        status = MemoryStatus()
+        status.length = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.total
+    return None
+
+
+class SchedulerMetrics:
+    """Counters and queue wait times of a BuildScheduler, as seen by this process."""
+
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.deferred = 0  # admission checks which had to wait for resources or for a build of higher priority
+        self.oversized = 0  # builds larger than the host, admitted once nothing else was running
+        self.timed_out = 0
+        self.max_queue_depth = 0
+        self.wait_seconds: List[float] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        waits = sorted(self.wait_seconds)
+
+        def percentile(fraction: float) -> float:
+            return waits[min(len(waits) - 1, int(fraction * len(waits)))] if waits else 0.0
+
+        return {'admitted': self.admitted, 'deferred': self.deferred, 'oversized': self.oversized,
+                'timed_out': self.timed_out, 'max_queue_depth': self.max_queue_depth,
+                'wait_seconds': {'total': sum(waits), 'p50': percentile(0.5), 'p95': percentile(0.95),
+                                 'max': waits[-1] if waits else 0.0}}
+
+
+class BuildScheduler:
+    """Admits compiles one at a time in priority order while they fit the host.
+
+    A build waits until the memory and CPUs of the running builds plus its own
+    cost fit ``memory_bytes`` and ``cpus``, and until no build with a lower
+    ``priority`` value, or the same priority queued earlier, is waiting. A
+    build larger than the host runs alone. Without ``lock_path`` the queue is
+    shared by the threads of this process; with it, the queue is kept in that
+    file under an exclusive lock and shared by every process using the same
+    path, and the entries of processes which died are dropped.
+    """
+
+    def __init__(self, memory_bytes: Optional[int] = None, cpus: Optional[int] = None,
+                 lock_path: Optional[Union[str, pathlib.Path]] = None, poll_interval: float = 0.5):
+        import itertools
+        import threading
+        self.memory_bytes = memory_bytes if memory_bytes is not None else _physical_memory()
+        self.cpus = cpus if cpus is not None else (os.cpu_count() or 1)
+        self.lock_path = pathlib.Path(lock_path) if lock_path is not None else None
+        self.poll_interval = poll_interval
+        self.metrics = SchedulerMetrics()
+        self._condition = threading.Condition()
+        self._local_state: Dict[str, Any] = {'sequence': 0, 'waiting': {}, 'running': {}}
+        self._tickets = itertools.count()
+
+    @contextmanager
+    def _state(self) -> Iterator[Dict[str, Any]]:
+        """The queue, locked for reading and updating; called with the condition held."""
+        if self.lock_path is None:
+            yield self._local_state
+            return
+        with _locked_json(self.lock_path) as state:
+            if not state:
+                state.update(sequence=0, waiting={}, running={})
+            for table in ('waiting', 'running'):
+                state[table] = {ticket: entry for ticket, entry in state[table].items()
+                                if entry['pid'] == os.getpid() or _process_alive(entry['pid'])}
+            yield state
+
+    def _admissible(self, state: Dict[str, Any], ticket: str) -> Tuple[bool, bool]:
+        """Whether ``ticket`` may start now, and whether it only may because it runs alone."""
+        entry = state['waiting'][ticket]
+        first = min(state['waiting'].values(), key=lambda waiting: (waiting['priority'], waiting['sequence']))
+        if first is not entry:
+            return False, False
+        running = state['running'].values()
+        memory = sum(other['memory'] for other in running) + entry['memory']
+        cpus = sum(other['cpus'] for other in running) + entry['cpus']
+        if (self.memory_bytes is None or memory <= self.memory_bytes) and cpus <= self.cpus:
+            return True, False
+        return not state['running'], True
+
+    @contextmanager
+    def slot(self, cost: BuildCost, priority: int = 0, timeout: Optional[float] = None) -> Iterator[None]:
+        """Wait until a build of ``cost`` is admitted and hold its resources until the block ends.
+
+        Lower ``priority`` values are admitted first. Raises TimeoutError when
+        the build is not admitted within ``timeout`` seconds.
+        """
+        import threading
+        ticket = "{}-{}-{}".format(os.getpid(), threading.get_ident(), next(self._tickets))
+        entry = {'pid': os.getpid(), 'priority': priority, 'memory': cost.memory_bytes, 'cpus': cost.cpus}
+        start = time.monotonic()
+        with self._condition:
+            with self._state() as state:
+                state['sequence'] += 1
+                state['waiting'][ticket] = dict(entry, sequence=state['sequence'])
+                self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, len(state['waiting']))
+            while True:
+                with self._state() as state:
+                    admitted, alone = self._admissible(state, ticket)
+                    if admitted:
+                        del state['waiting'][ticket]
+                        state['running'][ticket] = entry
+                    elif timeout is not None and time.monotonic() - start >= timeout:
+                        del state['waiting'][ticket]
+                if admitted:
+                    break
+                if ticket not in state['waiting']:
+                    self.metrics.timed_out += 1
+                    self._condition.notify_all()
+                    raise TimeoutError("build not admitted within {} seconds".format(timeout))
+                self.metrics.deferred += 1
+                wait = self.poll_interval if self.lock_path is not None else None
+                if timeout is not None:
+                    remaining = max(0.0, timeout - (time.monotonic() - start))
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._condition.wait(wait)
+            self.metrics.admitted += 1
+            self.metrics.oversized += alone
+            self.metrics.wait_seconds.append(time.monotonic() - start)
+            # the next build in line may fit as well
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                with self._state() as state:
+                    state['running'].pop(ticket, None)
+                self._condition.notify_all()
+
+
+# the [Setup] directives which change how long a compile takes and how large its output is
+COMPRESSION_DIRECTIVES = ('compression', 'solidcompression', 'lzmaalgorithm', 'lzmadictionarysize',
+                          'lzmamatchfinder', 'lzmanumblockthreads', 'lzmanumfastbytes', 'compressionthreads')
+
+
+def compression_settings(installer: Installer) -> str:
+    """The installer's compression directives as one string, e.g. ``compression=lzma2/ultra``."""
+    directives = _setup_directives(installer)
+    return "; ".join("{}={}".format(name, directives[name].lower()) for name in COMPRESSION_DIRECTIVES
+                     if name in directives)
+
+
+@define
+class BuildRecord:
+    """The metrics of one build in a BuildHistory."""
+    installer: str
+    file_count: int = field(default=0)
+    source_bytes: int = field(default=0)
+    output_bytes: int = field(default=0)
+    render_seconds: float = field(default=0.0)
+    compile_seconds: float = field(default=0.0)
+    compression: str = field(default="")
+    cached: bool = field(default=False)  # fetched from an artifact store instead of compiled
+    finished: float = field(default=Factory(time.time))
+
+
+@define
+class BuildAlert:
+    """A build which was much slower or larger than its history predicts."""
+    installer: str
+    metric: str
+    value: float
+    expected: float
+
+    def __str__(self) -> str:
+        return "{}: {} was {:.4g}, {:.1f}x the {:.4g} its history predicts".format(
+            self.installer, self.metric, self.value, self.value / self.expected if self.expected else float('inf'),
+            self.expected)
+
+
+class BuildRegressionWarning(UserWarning):
+    """Issued by InnosetupCompiler.build for every BuildAlert of a recorded build."""
+
+
+_HISTORY_COLUMNS = ('installer', 'file_count', 'source_bytes', 'output_bytes', 'render_seconds', 'compile_seconds',
+                    'compression', 'cached', 'finished')
+
+
+def _median(values: List[float]) -> float:
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+class BuildHistory:
+    """Metrics of past builds in a SQLite database, for percentiles and regression alerts.
+
+    Every operation opens its own connection, so one history can be shared by
+    threads and by processes; SQLite serialises the writers. Predictions
+    only use the last ``window`` compiled builds of an installer with the same
+    compression settings, and need at least ``min_builds`` of them. A build
+    is reported when its compile takes ``slowdown`` times longer than the
+    history's seconds per source byte predict, or its output is ``growth``
+    times larger than the history's compression ratio predicts.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path], window: int = 50, min_builds: int = 5,
+                 slowdown: float = 1.5, growth: float = 1.2):
+        self.path = pathlib.Path(path)
+        self.window = window
+        self.min_builds = min_builds
+        self.slowdown = slowdown
+        self.growth = growth
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS builds (id INTEGER PRIMARY KEY, installer TEXT NOT NULL, "
+                "file_count INTEGER, source_bytes INTEGER, output_bytes INTEGER, render_seconds REAL, "
+                "compile_seconds REAL, compression TEXT, cached INTEGER, finished REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS builds_by_installer ON builds (installer, finished)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[Any]:
+        import sqlite3
+        connection = sqlite3.connect(str(self.path), timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def records(self, installer: str, compression: Optional[str] = None, cached: Optional[bool] = None,
+                limit: Optional[int] = None) -> List[BuildRecord]:
+        """This method returns the recorded builds of ``installer``, newest first
+
+        Args:
+            installer: The name the builds were recorded under
+            compression: Only builds with these compression_settings
+            cached: Only builds fetched from an artifact store (True) or compiled (False)
+            limit: At most this many builds
+        """
+        query = "SELECT {} FROM builds WHERE installer = ?".format(", ".join(_HISTORY_COLUMNS))
+        parameters: List[Any] = [installer]
+        if compression is not None:
+            query += " AND compression = ?"
+            parameters.append(compression)
+        if cached is not None:
+            query += " AND cached = ?"
+            parameters.append(int(cached))
+        query += " ORDER BY finished DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        with self._connect() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        return [BuildRecord(**dict(zip(_HISTORY_COLUMNS, row), cached=bool(row[7]))) for row in rows]
+
+    def percentiles(self, installer: str, metric: str = 'compile_seconds', percents: Iterable[int] = (50, 95),
+                    compression: Optional[str] = None) -> Dict[str, Optional[float]]:
+        """The nearest-rank percentiles of ``metric`` over the last ``window`` compiled builds, as
+        ``{'p50': ..., 'p95': ...}``; None when nothing was recorded."""
+        if metric not in _HISTORY_COLUMNS[1:6]:
+            raise ValueError("not a numeric build metric: {!r}".format(metric))
+        values = sorted(getattr(record, metric) for record in
+                        self.records(installer, compression=compression, cached=False, limit=self.window))
+        result: Dict[str, Optional[float]] = {}
+        for percent in percents:
+            rank = -(-percent * len(values) // 100)
+            result['p{}'.format(percent)] = values[max(0, rank - 1)] if values else None
+        return result
+
+    def check(self, record: BuildRecord) -> List[BuildAlert]:
+        """This method compares a build against what the history predicts for it"""
+        if record.cached:
+            return []
+        history = self.records(record.installer, compression=record.compression, cached=False, limit=self.window)
+        if len(history) < max(1, self.min_builds):
+            return []
+        alerts = []
+        sized = [past for past in history if past.source_bytes > 0]
+        if record.source_bytes > 0 and sized:
+            expected_seconds = _median([past.compile_seconds / past.source_bytes for past in sized]) * record.source_bytes
+            expected_bytes = _median([past.output_bytes / past.source_bytes for past in sized]) * record.source_bytes
+        else:
+            expected_seconds = _median([past.compile_seconds for past in history])
+            expected_bytes = _median([past.output_bytes for past in history])
+        if record.compile_seconds > expected_seconds * self.slowdown:
+            alerts.append(BuildAlert(record.installer, 'compile_seconds', record.compile_seconds, expected_seconds))
+        if record.output_bytes > expected_bytes * self.growth:
+            alerts.append(BuildAlert(record.installer, 'output_bytes', record.output_bytes, expected_bytes))
+        return alerts
+
+    def record(self, record: BuildRecord) -> List[BuildAlert]:
+        """This method stores a build and returns the alerts check raised for it"""
+        alerts = self.check(record)
+        with self._connect() as connection:
+            connection.execute("INSERT INTO builds ({}) VALUES ({})".format(
+                ", ".join(_HISTORY_COLUMNS), ", ".join("?" * len(_HISTORY_COLUMNS))),
+                [getattr(record, column) for column in _HISTORY_COLUMNS[:7]] + [int(record.cached), record.finished])
+        return alerts
+
+
+# upper bounds of the build phase histograms, in seconds
+DEFAULT_SECONDS_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+# state key -> (metric name, help)
+_EXPORTED_COUNTERS = {
+    'builds': ("innosetup_builds_total", "Builds finished."),
+    'files': ("innosetup_files_packed_total", "File entries packed into installers."),
+    'bytes_in': ("innosetup_source_bytes_total", "Bytes of the sources packed into installers."),
+    'bytes_out': ("innosetup_output_bytes_total", "Bytes of the installers written."),
+    'cache_hits': ("innosetup_cache_hits_total", "Builds fetched from an artifact store."),
+    'cache_misses': ("innosetup_cache_misses_total", "Builds looked up in an artifact store and compiled."),
+}
+
+
+def _prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _write_atomically(path: pathlib.Path, text: str) -> None:
+    import tempfile
+    descriptor, temporary = tempfile.mkstemp(dir=str(path.parent), prefix="." + path.name, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8', newline="\n") as handle:
+            handle.write(text)
+        os.replace(temporary, str(path))
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+
+class MetricsExporter:
+    """Accumulates build metrics and writes them for Prometheus and as JSON after every build.
+
+    ``textfile_path`` should end in .prom and sit in node-exporter's textfile
+    collector directory; ``json_path`` receives the same data as JSON. Both
+    are replaced atomically. The running totals live in ``state_path``
+    (``<output>.state.json`` by default) and are updated under file_lock, so
+    the builds of several threads and processes add up in one place.
+    """
+
+    def __init__(self, textfile_path: Optional[Union[str, pathlib.Path]] = None,
+                 json_path: Optional[Union[str, pathlib.Path]] = None,
+                 state_path: Optional[Union[str, pathlib.Path]] = None,
+                 buckets: Iterable[float] = DEFAULT_SECONDS_BUCKETS):
+        import threading
+        self.textfile_path = pathlib.Path(textfile_path) if textfile_path is not None else None
+        self.json_path = pathlib.Path(json_path) if json_path is not None else None
+        if state_path is None:
+            output = self.textfile_path or self.json_path
+            if output is None:
+                raise ValueError("MetricsExporter needs a textfile_path, a json_path or a state_path")
+            state_path = output.with_name(output.name + ".state.json")
+        self.state_path = pathlib.Path(state_path)
+        self.buckets = sorted(float(bound) for bound in buckets)
+        self._lock = threading.Lock()
+
+    def record_build(self, installer: str, phases: Dict[str, float], files: int = 0, bytes_in: int = 0,
+                     bytes_out: int = 0, cache_hit: Optional[bool] = None) -> Dict[str, Any]:
+        """This method adds one build to the totals, writes the outputs and returns the new state
+
+        Args:
+            installer: The installer label of the build
+            phases: Seconds per phase, e.g. scan, render and compile
+            files: How many file entries were packed
+            bytes_in: The bytes of the packed sources
+            bytes_out: The bytes of the written installer
+            cache_hit: Whether an artifact store had the build, None when none was asked
+        """
+        with self._lock, _locked_json(self.state_path) as state:
+            if state.get('buckets') != self.buckets:
+                # totals kept with other buckets cannot be continued
+                state.clear()
+                state.update(buckets=self.buckets, installers={})
+            totals = state['installers'].setdefault(installer, dict.fromkeys(_EXPORTED_COUNTERS, 0))
+            totals['builds'] += 1
+            totals['files'] += files
+            totals['bytes_in'] += bytes_in
+            totals['bytes_out'] += bytes_out
+            if cache_hit is not None:
+                totals['cache_hits' if cache_hit else 'cache_misses'] += 1
+            totals['last_build'] = time.time()
+            histograms = totals.setdefault('phases', {})
+            for phase, seconds in phases.items():
+                histogram = histograms.setdefault(phase, {'count': 0, 'sum': 0.0, 'buckets': [0] * len(self.buckets)})
+                histogram['count'] += 1
+                histogram['sum'] += seconds
+                for index, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        histogram['buckets'][index] += 1
+            # written while the state is locked, so an older state never replaces a newer one
+            if self.textfile_path is not None:
+                _write_atomically(self.textfile_path, self.prometheus_text(state))
+            if self.json_path is not None:
+                _write_atomically(self.json_path, json.dumps(state, indent=2, sort_keys=True))
+            return dict(state)
+
+    @staticmethod
+    def prometheus_text(state: Dict[str, Any]) -> str:
+        """Render a state in the Prometheus text exposition format."""
+        lines = []
+        installers = sorted(state.get('installers', {}).items())
+        for key, (name, help_text) in _EXPORTED_COUNTERS.items():
+            lines += ["# HELP {} {}".format(name, help_text), "# TYPE {} counter".format(name)]
+            lines += ['{}{{installer="{}"}} {}'.format(name, _prometheus_label(installer), totals[key])
+                      for installer, totals in installers]
+        lines += ["# HELP innosetup_last_build_timestamp_seconds When the last build finished.",
+                  "# TYPE innosetup_last_build_timestamp_seconds gauge"]
+        lines += ['innosetup_last_build_timestamp_seconds{{installer="{}"}} {}'.format(
+            _prometheus_label(installer), _prometheus_number(totals['last_build'])) for installer, totals in installers]
+        lines += ["# HELP innosetup_build_phase_seconds Duration of the phases of builds.",
+                  "# TYPE innosetup_build_phase_seconds histogram"]
+        for installer, totals in installers:
+            for phase, histogram in sorted(totals.get('phases', {}).items()):
+                labels = 'installer="{}",phase="{}"'.format(_prometheus_label(installer), _prometheus_label(phase))
+                bounds = [_prometheus_number(bound) for bound in state['buckets']] + ["+Inf"]
+                for bound, count in zip(bounds, histogram['buckets'] + [histogram['count']]):
+                    lines.append('innosetup_build_phase_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, count))
+                lines.append('innosetup_build_phase_seconds_sum{{{}}} {}'.format(
+                    labels, _prometheus_number(histogram['sum'])))
+                lines.append('innosetup_build_phase_seconds_count{{{}}} {}'.format(labels, histogram['count']))
+        return "\n".join(lines) + "\n"
+
+
+# languages folder -> (directory mtime, index); rebuilt when a language is added or removed
+_language_indexes: Dict[str, Any] = {}
+
+
+def language_index(languages_path: Union[str, pathlib.Path], base_path: Union[str, pathlib.Path]) -> List[Dict[str, Any]]:
+    """Return the .isl files in ``languages_path``, cached until the directory changes."""
+    languages_path = pathlib.Path(languages_path)
+    try:
+        mtime_ns = languages_path.stat().st_mtime_ns
+    except OSError:
+        return []
+    key = str(languages_path)
+    cached = _language_indexes.get(key)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    index = []
+    with os.scandir(str(languages_path)) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith('.isl'):
+                language = pathlib.Path(entry.path)
+                index.append({'name': language.stem,
+                              'messages_file': 'compiler:' + str(language.relative_to(base_path)),
+                              'size_bytes': entry.stat().st_size})
+    index.sort(key=lambda language: language['name'])
+    _language_indexes[key] = (mtime_ns, index)
+    return index
+
+
+def _path_size(path: pathlib.Path) -> int:
+    """Size of a file, or of every file below a directory."""
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob('*') if child.is_file())
+    return path.stat().st_size
+
+
+PROFILE_ENV_VAR = "INNOSETUP_PROFILE"
+
+
+class BuildTimer:
+    """Records the wall-clock time of the phases of a build."""
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str, python: bool = True, trace_memory: bool = False) -> Iterator[None]:
+        """Time a phase; ``python`` and ``trace_memory`` only matter to BuildProfiler."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+
+class BuildProfiler(BuildTimer):
+    """Collects cProfile stats and tracemalloc snapshots for the phases of a build.
+
+    Python-side phases run under a single cProfile profiler; phases started with
+    ``trace_memory=True`` additionally record the tracemalloc peak and the top
+    allocation sites. ``write`` puts ``<output>.pstats`` and ``<output>.profile.json``
+    next to the output installer.
+    """
+
+    def __init__(self, top: int = 25):
+        import cProfile
+        super().__init__()
+        self.top = top
+        self.memory: Dict[str, Dict[str, Any]] = {}
+        self.profile = cProfile.Profile()
+
+    @contextmanager
+    def phase(self, name: str, python: bool = True, trace_memory: bool = False) -> Iterator[None]:
+        """Time a phase, optionally profiling it and tracing its allocations.
+
+        When the caller is tracing already the phase leaves tracing running, and its
+        figures then cover everything traced since the caller started.
+        """
+        import tracemalloc
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if python:
+            self.profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+            if python:
+                self.profile.disable()
+            if trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+                self.memory[name] = {
+                    'peak_bytes': peak,
+                    'top_allocations': [
+                        {'location': "{}:{}".format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                         'size_bytes': stat.size,
+                         'count': stat.count}
+                        for stat in snapshot.statistics('lineno')[:self.top]
+                    ],
+                }
+
+    def report(self) -> Dict[str, Any]:
+        """Return the collected data as a JSON-serialisable dictionary."""
+        import pstats
+        stats = pstats.Stats(self.profile)
+        functions = []
+        for (filename, lineno, funcname), (_, calls, total, cumulative, _) in stats.stats.items():
+            functions.append({'function': "{}:{}({})".format(filename, lineno, funcname),
+                              'calls': calls,
+                              'total_seconds': total,
+                              'cumulative_seconds': cumulative})
+        functions.sort(key=lambda function: function['cumulative_seconds'], reverse=True)
+        return {'phases': self.timings, 'memory': self.memory, 'functions': functions[:self.top]}
+
+    def write(self, output_path: Union[str, pathlib.Path]) -> Dict[str, pathlib.Path]:
+        """Write the pstats dump and the JSON report next to ``output_path``."""
+        output_path = pathlib.Path(output_path)
+        paths = {'pstats': output_path.with_name(output_path.name + ".pstats"),
+                 'json': output_path.with_name(output_path.name + ".profile.json")}
+        self.profile.dump_stats(str(paths['pstats']))
+        paths['json'].write_text(json.dumps(self.report(), indent=2))
+        return paths
+
+
+@contextmanager
+def _phase(profiler: Optional[BuildTimer], name: str, python: bool = True, trace_memory: bool = False) -> Iterator[None]:
+    """Run a build phase under ``profiler``, if there is one."""
+    if profiler is None:
+        yield
+        return
+    with profiler.phase(name, python=python, trace_memory=trace_memory):
+        yield
+
+
+class CompilerBackend(ABC):
+    """Turns a rendered script into an installer, for InnosetupCompiler(backend=...).
+
+    ``options`` are ISCC command line options such as the /D defines of
+    Variant.iscc_options. A failing compile raises an exception.
+    """
+
+    @property
+    def version(self) -> Optional[str]:
+        """The version of the compiler, when it can tell."""
+        return None
+
+    @abstractmethod
+    def compile(self, script_path: Union[str, pathlib.Path], output_path: Union[str, pathlib.Path],
+                options: Iterable[str] = ()) -> None:
+        """This method compiles ``script_path`` into ``output_path``"""
+
+
+@define
+class IsccBackend(CompilerBackend):
+    """Runs ISCC natively; a failing compile raises CalledProcessError."""
+    compiler_path: pathlib.Path = field(converter=pathlib.Path)
+
+    @property
+    def version(self) -> Optional[str]:
+        return probe_compiler_version(str(self.compiler_path))
+
+    @property
+    def command(self) -> List[str]:
+        """The command line prefix which runs the compiler."""
+        return [str(self.compiler_path)]
+
+    def host_path(self, path: Union[str, pathlib.Path]) -> str:
+        """This method spells ``path`` the way the compiler reads it"""
+        return str(path)
+
+    def compile(self, script_path: Union[str, pathlib.Path], output_path: Union[str, pathlib.Path],
+                options: Iterable[str] = ()) -> None:
+        import subprocess
+        subprocess.check_call(self.command + ['/Qp', '/O' + self.host_path(output_path)] + list(options)
+                              + [self.host_path(script_path)])
+
+
+@define
+class WineIsccBackend(IsccBackend):
+    """Runs ISCC.exe under Wine, passing paths through Wine's Z: drive."""
+    wine: str = field(default=Factory(lambda: os.environ.get(WINE_ENV_VAR, "wine")))
+
+    @property
+    def command(self) -> List[str]:
+        return [self.wine, str(self.compiler_path)]
+
+    def host_path(self, path: Union[str, pathlib.Path]) -> str:
+        # under Wine, paths starting with "/" would be read as ISCC options
+        return _wine_path(path)
+
+
+def preprocess_iss(path: Union[str, pathlib.Path], defines: Iterable[str] = ()) -> List[str]:
+    """The lines of a script after the ISPP directives the builder emits.
+
+    #include, #ifdef, #if defined(...), #elif defined(...), #else and #endif
+    are followed, with ``defines`` as the defined names; other directives are
+    dropped.
+    """
+    defines = set(defines)
+    path = pathlib.Path(path)
+    lines: List[str] = []
+    stack: List[List[bool]] = []  # one entry per open #if: [this branch active, some branch taken]
+    for line in path.read_text(encoding='utf-8-sig').splitlines():
+        directive = line.strip()
+        if not directive.startswith("#"):
+            if all(branch[0] for branch in stack):
+                lines.append(line)
+            continue
+        names = re.findall(r"defined\((\w+)\)", directive)
+        if directive.startswith(("#ifdef ", "#if ")):
+            taken = any(name in defines for name in names or directive.split()[1:])
+            stack.append([taken, taken])
+        elif directive.startswith("#elif "):
+            taken = not stack[-1][1] and any(name in defines for name in names)
+            stack[-1] = [taken, stack[-1][1] or taken]
+        elif directive == "#else":
+            stack[-1] = [not stack[-1][1], True]
+        elif directive == "#endif":
+            stack.pop()
+        elif directive.startswith("#include ") and all(branch[0] for branch in stack):
+            lines.extend(preprocess_iss(path.parent / directive.split('"')[1], defines))
+    return lines
+
+
+# Compression level -> lzma preset of FakeCompilerBackend
+_FAKE_LZMA_PRESETS = {'fast': 1, 'normal': 6, 'max': 9, 'ultra': 9, 'ultra64': 9}
+
+
+@define
+class FakeCompilerBackend(CompilerBackend):
+    """A compiler in pure Python, for exercising and benchmarking builds without Inno Setup.
+
+    It preprocesses the script, stats every [Files] source the way ISCC
+    would, failing with FileNotFoundError on a missing one, and compresses
+    the payload with lzma, zlib or bz2 according to the [Setup] Compression
+    and SolidCompression directives. The artifact holds a manifest of the
+    packed destinations and the compressed stream; it only depends on the
+    destinations and contents of the files, so it is reproducible. ``preset``
+    overrides the lzma preset chosen by the compression level.
+    """
+    preset: Optional[int] = field(default=None)
+
+    @property
+    def version(self) -> Optional[str]:
+        return "6.2.2-fake"
+
+    def compile(self, script_path: Union[str, pathlib.Path], output_path: Union[str, pathlib.Path],
+                options: Iterable[str] = ()) -> None:
+        import fnmatch
+        defines = [option[2:].partition("=")[0] for option in options if option.startswith("/D")]
+        script_path = pathlib.Path(script_path)
+        setup: Dict[str, str] = {}
+        entries = []
+        section = None
+        for line in preprocess_iss(script_path, defines):
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1].lower()
+            elif not line or line.startswith(";"):
+                continue
+            elif section == "setup" and "=" in line:
+                name, _, value = line.partition("=")
+                setup[name.strip().lower()] = value.strip().lower()
+            elif section == "files":
+                entries.append(parse_iss_parameters(line))
+        files = []
+        for entry in entries:
+            flags = entry.get('flags', "").lower().split()
+            if 'external' in flags:
+                continue
+            source = str(script_path.parent / entry.get('source', ""))
+            destination = entry.get('destdir', "")
+            optional = 'skipifsourcedoesntexist' in flags
+            if not _is_wildcard(source):
+                name = entry.get('destname') or os.path.basename(source)
+                files.append((destination + "\\" + name, source, 'nocompression' in flags, optional))
+                continue
+            directory, pattern = os.path.split(source)
+            matched = len(files)
+            for root, subdirectories, names in os.walk(directory):
+                subdirectories.sort()
+                if 'recursesubdirs' not in flags:
+                    subdirectories[:] = []
+                relative = os.path.relpath(root, directory)
+                prefix = destination if relative == "." else destination + "\\" + relative.replace(os.sep, "\\")
+                for name in sorted(fnmatch.filter(names, pattern)):
+                    files.append((prefix + "\\" + name, os.path.join(root, name), 'nocompression' in flags, True))
+            if len(files) == matched and not optional:
+                raise FileNotFoundError("No files found matching \"{}\"".format(source))
+        stats = stat_paths([source for _, source, _, _ in files])
+        packed = []
+        for destination, source, stored, optional in files:
+            if stats[source] is None:
+                if optional:
+                    continue
+                raise FileNotFoundError("Source file \"{}\" does not exist".format(source))
+            packed.append((destination, source, stored, stats[source].st_size))
+        if setup.get('licensefile'):
+            license_file = script_path.parent / setup['licensefile']
+            if not license_file.exists():
+                raise FileNotFoundError("LicenseFile \"{}\" does not exist".format(license_file))
+        self._write(pathlib.Path(output_path), packed, setup)
+
+    def _compressor(self, setup: Dict[str, str], size: Optional[int] = None) -> Any:
+        """A compressor for the stream, or for one file of ``size`` bytes; None for stored data."""
+        import bz2
+        import lzma
+        import zlib
+        method, _, level = setup.get('compression', 'lzma2/max').partition("/")
+        if method == 'none' or size == 0:
+            return None
+        if method == 'zip':
+            return zlib.compressobj(int(level or 7))
+        if method == 'bzip':
+            return bz2.BZ2Compressor(int(level or 9))
+        preset = self.preset if self.preset is not None else _FAKE_LZMA_PRESETS.get(level or 'max', 9)
+        if level.startswith('ultra') and self.preset is None:
+            preset |= lzma.PRESET_EXTREME
+        options = {'id': lzma.FILTER_LZMA2, 'preset': preset}
+        if size is not None and size < 1 << 18:
+            # like LZMA itself, do not allocate a dictionary larger than the data; presets start at 256 KB
+            options['dict_size'] = max(1 << 12, size)
+        return lzma.LZMACompressor(format=lzma.FORMAT_RAW, filters=[options])
+
+    def _write(self, output_path: pathlib.Path, packed: List[Tuple[str, str, bool, int]],
+               setup: Dict[str, str]) -> None:
+        import struct
+        solid = setup.get('solidcompression', 'no') in ('yes', 'true', '1')
+        manifest = json.dumps({'compiler': self.version, 'compression': setup.get('compression', 'lzma2/max'),
+                               'solid': solid, 'files': [[destination, size, stored]
+                                                         for destination, _, stored, size in packed]},
+                              sort_keys=True).encode('utf-8')
+        temporary = output_path.with_name(output_path.name + ".tmp")
+        with open(str(temporary), 'wb') as output:
+            output.write(b"MZ" + struct.pack("<I", len(manifest)) + manifest)
+            compressor = self._compressor(setup) if solid else None
+            for _, source, stored, size in packed:
+                if not solid:
+                    compressor = None if stored else self._compressor(setup, size)
+                with open(source, 'rb') as handle:
+                    for block in iter(lambda: handle.read(1 << 20), b""):
+                        output.write(block if stored or compressor is None else compressor.compress(block))
+                if not solid and compressor is not None:
+                    output.write(compressor.flush())
+            if solid and compressor is not None:
+                output.write(compressor.flush())
+        os.replace(str(temporary), str(output_path))
 
 
 @define
 class InnosetupCompiler:
     """Represents the local innosetup installation"""
-    base_path: Optional[str] = field(default=Factory(get_path_from_registry))
+    base_path: Optional[str] = field(default=Factory(_discovered_base_path))
+    # how scripts are compiled; IsccBackend or WineIsccBackend for the installation by default
+    backend: Optional[CompilerBackend] = field(default=None)
 
     @property
     def languages_path(self) -> pathlib.Path:
@@ -433,22 +4142,354 @@ class InnosetupCompiler:
     @property
     def compiler_path(self) -> pathlib.Path:
         """This property returns the path to the compiler executable."""
-        return pathlib.Path(self.base_path) / "ISCC.exe"
+        return _compiler_in(self.base_path)
+
+    @property
+    def compiler_backend(self) -> CompilerBackend:
+        """The backend which compiles scripts: ``backend``, or ISCC from ``base_path``, through Wine when needed."""
+        if self.backend is not None:
+            return self.backend
+        if self.base_path is None:
+            raise FileNotFoundError("Inno Setup is not installed; set {} to its directory".format(INNOSETUP_PATH_ENV_VAR))
+        return self._iscc_backend()
+
+    def _iscc_backend(self) -> IsccBackend:
+        if _needs_wine(self.compiler_path):
+            return WineIsccBackend(self.compiler_path)
+        return IsccBackend(self.compiler_path)
+
+    @property
+    def compiler_command(self) -> List[str]:
+        """The command line prefix which runs the compiler, through Wine when needed."""
+        return self._iscc_backend().command
 
-    def available_languages(self) -> Generator[Dict[str, str], None, None]:
-        if self.base_path is None or not self.languages_path.exists():
+    @property
+    def version(self) -> Optional[str]:
+        """The compiler version, probed once and cached."""
+        if self.backend is not None:
+            return self.backend.version
+        if self.base_path is None:
+            return None
+        discovery = discover_compiler()
+        if discovery.version and discovery.base_path == self.base_path:
+            return discovery.version
+        return probe_compiler_version(str(self.compiler_path))
+
+    def available_languages(self) -> Generator[Dict[str, Any], None, None]:
+        """Yield the languages shipped with the compiler, sorted by name.
+
+        Each language is a dict with ``name``, ``messages_file`` and ``size_bytes``.
+        """
+        if self.base_path is None:
             return
-        for language in self.languages_path.iterdir():
-            if language.is_file() and language.suffix.lower() == '.isl':
-                yield {'name': language.stem,
-                       'messages_file': 'compiler:' + str(language.relative_to(self.base_path))
-                       }
-
-    def build(self, installer: Installer, output_path: Union[str, pathlib.Path] = pathlib.Path.cwd() / "installer.exe") -> None:
-        """This method compiles the given installer"""
+        yield from language_index(self.languages_path, self.base_path)
+
+    def language_impact(self, installer: Installer, output_dir: Union[str, pathlib.Path],
+                        languages: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Measure what each additional language costs by compiling ``installer`` with it.
+
+        One build without additional languages is the baseline, then one build per
+        language. Each row holds the language, its .isl size and the extra installer
+        bytes and compile seconds over the baseline.
+        """
+        import attr
+        output_dir = pathlib.Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        def measure(name: str, selection: List[str]) -> Dict[str, float]:
+            output_path = output_dir / "{}.exe".format(name)
+            start = time.perf_counter()
+            self.build(attr.evolve(installer, multilingual=True, languages=selection), output_path)
+            return {'seconds': time.perf_counter() - start, 'bytes': _path_size(output_path)}
+
+        baseline = measure("_baseline", [])
+        report = []
+        for language in self.available_languages():
+            if languages is not None and language['name'] not in languages:
+                continue
+            measured = measure(language['name'], [language['name']])
+            report.append({'name': language['name'],
+                           'size_bytes': language['size_bytes'],
+                           'installer_bytes': measured['bytes'] - baseline['bytes'],
+                           'compile_seconds': measured['seconds'] - baseline['seconds']})
+        return report
+
+    def build(self, installer: Installer, output_path: Optional[Union[str, pathlib.Path]] = None, profile: Optional[bool] = None,
+              validate: bool = False, fragments_dir: Optional[Union[str, pathlib.Path]] = None,
+              shard_by: str = "section", store: Optional[ArtifactStore] = None,
+              source_root: Optional[Union[str, pathlib.Path]] = None, signer: Optional[Signer] = None,
+              scheduler: Optional[BuildScheduler] = None, priority: int = 0,
+              history: Optional[BuildHistory] = None, metrics: Optional[MetricsExporter] = None) -> None:
+        """This method compiles the given installer
+
+        Args:
+            installer: The installer to render and compile
+            output_path: Where the compiled installer is written, installer.exe
+                in the current directory by default
+            profile: Write cProfile and tracemalloc reports next to the output.
+                Defaults to the INNOSETUP_PROFILE environment variable.
+            validate: Run validate_installer first and raise ValidationError
+                instead of compiling when it finds errors
+            fragments_dir: Keep the script in this directory, split into
+                #include fragments by ``shard_by``, instead of a temporary file;
+                fragments which did not change are not rewritten between builds
+            store: Look the build up in this ArtifactStore by build_fingerprint
+                and copy it to ``output_path`` instead of compiling; a compiled
+                installer is published to the store
+            source_root: Passed to build_fingerprint, so builds from different
+                checkout directories share artifacts
+            signer: Sign the payload's executables with this Signer first and
+                package the signed copies
+            scheduler: Wait for this BuildScheduler to admit the compile, with
+                the cost from estimate_build_cost
+            priority: The compile's priority with ``scheduler``; lower values
+                are admitted first
+            history: Record the build's metrics in this BuildHistory under the
+                installer's app_name, or the output's name without one, and
+                issue a BuildRegressionWarning for every alert it raises
+            metrics: Add the build's phase times, sizes and artifact store
+                lookup to this MetricsExporter, under the same name
+        """
+        import tempfile
+        if output_path is None:
+            output_path = pathlib.Path.cwd() / "installer.exe"
+        backend = self.compiler_backend
+        if profile is None:
+            profile = os.environ.get(PROFILE_ENV_VAR, "") not in ("", "0")
+        profiler = BuildProfiler() if profile else BuildTimer()
+        tally = None
+        if isinstance(installer.files, FileSource):
+            if installer.files.passes == "error":
+                # fail before anything is compiled rather than after
+                needed = ["validate"] if validate else []
+                needed.append("signer" if signer is not None else "render")
+                if signer is None and store is not None:
+                    needed += ["store", "fragments_dir"] if fragments_dir is not None else ["store"]
+                if len(needed) > 1:
+                    raise FileSourceConsumedError(
+                        "{} each need a pass over files which can only be read once; use a FileSource with "
+                        "passes='rescan' or 'cache'".format(", ".join(needed)))
+            if history is not None or metrics is not None or scheduler is not None:
+                import attr
+                tally = _PayloadTally()
+                installer = attr.evolve(installer, files=tally.source(installer.files))
+        if validate:
+            with _phase(profiler, "validate"):
+                issues = validate_installer(installer)
+            if any(issue.severity == "error" for issue in issues):
+                raise ValidationError(issues)
+        if signer is not None:
+            import attr
+            with _phase(profiler, "sign", python=False):
+                installer = attr.evolve(installer, files=signer.sign(installer.files).files)
+        installer_text = None
+        if store is not None:
+            with _phase(profiler, "render", trace_memory=True):
+                installer_text = installer.render(self)
+            with _phase(profiler, "fingerprint"):
+                key = build_fingerprint(installer_text, installer, self.version, source_root=source_root)
+            with _phase(profiler, "fetch"):
+                fetched = store.get(key, output_path)
+            if fetched:
+                self._finish(installer, output_path, profiler, history, metrics, cached=True, tally=tally)
+                return
+        with ExitStack() as stack:
+            if fragments_dir is not None:
+                with _phase(profiler, "render fragments", trace_memory=True):
+                    installer_path = installer.render_fragments(self, fragments_dir, shard_by=shard_by).script_path
+            else:
+                installer_path = pathlib.Path(stack.enter_context(tempfile.TemporaryDirectory())) / "installer.iss"
+                if installer_text is None and isinstance(installer.files, FileSource):
+                    # the files are produced and written one by one
+                    with _phase(profiler, "render", trace_memory=True):
+                        installer.render_to(self, installer_path)
+                else:
+                    if installer_text is None:
+                        with _phase(profiler, "render", trace_memory=True):
+                            installer_text = installer.render(self)
+                    with _phase(profiler, "write"):
+                        _write_script(installer_path, installer_text, installer.deterministic)
+            if scheduler is not None:
+                cost = estimate_build_cost(installer, tally.source_bytes if tally is not None and tally.done else None)
+                with _phase(profiler, "queue", python=False):
+                    stack.enter_context(scheduler.slot(cost, priority=priority))
+            with _phase(profiler, "compile", python=False):
+                backend.compile(installer_path, output_path)
+        if store is not None:
+            with _phase(profiler, "publish"):
+                store.put(key, output_path)
+        self._finish(installer, output_path, profiler, history, metrics, cached=False if store is not None else None,
+                     tally=tally)
+
+    @staticmethod
+    def _finish(installer: Installer, output_path: Union[str, pathlib.Path], profiler: BuildTimer,
+                history: Optional[BuildHistory], metrics: Optional[MetricsExporter], cached: Optional[bool],
+                tally: Optional[_PayloadTally] = None) -> None:
+        """Record the metrics of a finished build and write its profile, if it was profiled.
+
+        ``cached`` tells whether an artifact store had the build, None when none was asked.
+        ``tally`` holds the counts of a FileSource taken while it was consumed.
+        """
+        import warnings
+        if history is not None or metrics is not None:
+            name = installer.app_name or pathlib.Path(output_path).stem
+            if tally is not None and tally.done:
+                file_count, source_bytes = tally.files, tally.source_bytes
+            else:
+                # a list was scanned before the build; only its sources are stat'ed here
+                with _phase(profiler, "stat"):
+                    files = _file_list(installer.files)
+                    file_count, source_bytes = len(files), payload_size(files)
+            output_bytes = _path_size(pathlib.Path(output_path))
+            timings = profiler.timings
+            phases = {}
+            if tally is not None and tally.done:
+                # the time the FileSource took to produce its entries, such as an all_files walk
+                phases['scan'] = tally.scan_seconds
+            for phase, source in (('stat', 'stat'), ('render', 'render fragments'), ('render', 'render'),
+                                  ('compile', 'compile')):
+                if source in timings:
+                    phases[phase] = timings[source]
+        if history is not None:
+            with _phase(profiler, "history"):
+                alerts = history.record(BuildRecord(
+                    installer=name,
+                    file_count=file_count,
+                    source_bytes=source_bytes,
+                    output_bytes=output_bytes,
+                    render_seconds=phases.get('render', 0.0),
+                    compile_seconds=phases.get('compile', 0.0),
+                    compression=compression_settings(installer),
+                    cached=bool(cached)))
+            for alert in alerts:
+                warnings.warn(str(alert), BuildRegressionWarning, stacklevel=3)
+        if metrics is not None:
+            with _phase(profiler, "metrics"):
+                metrics.record_build(name, phases, files=file_count, bytes_in=source_bytes,
+                                     bytes_out=output_bytes, cache_hit=cached)
+        if isinstance(profiler, BuildProfiler):
+            profiler.write(output_path)
+
+    def build_variants(self, installer: Installer, variants: List[Variant],
+                       output_dir: Optional[Union[str, pathlib.Path]] = None, max_workers: int = 1,
+                       validate: bool = False, scheduler: Optional[BuildScheduler] = None,
+                       priority: int = 0) -> Dict[str, pathlib.Path]:
+        """This method compiles several variants of an installer from one rendered script
+
+        The script is rendered once with render_variants, then ISCC runs once
+        per variant with the variant's /D options, ``max_workers`` at a time.
+
+        Args:
+            installer: The installer shared by every variant
+            variants: The variants to compile
+            output_dir: Where <variant name>.exe files are written, the current
+                directory by default
+            max_workers: How many ISCC processes may run at once
+            validate: Run validate_variants once before compiling anything and
+                raise ValidationError when it finds errors
+            scheduler: Have every variant's compile admitted by this
+                BuildScheduler, costed as a compile of the whole payload
+            priority: The compiles' priority with ``scheduler``
+
+        Returns:
+            The output path of each variant by name
+        """
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        output_dir = pathlib.Path(output_dir) if output_dir is not None else pathlib.Path.cwd()
+        backend = self.compiler_backend
+        if validate:
+            issues = validate_variants(installer, variants)
+            if any(issue.severity == "error" for issue in issues):
+                raise ValidationError(issues)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        outputs = {variant.name: output_dir / (variant.name + ".exe") for variant in variants}
         with tempfile.TemporaryDirectory() as tmpdir:
             installer_path = pathlib.Path(tmpdir) / "installer.iss"
-            installer_text = installer.render(self)
-            installer_path.write_text(installer_text)
-            subprocess.check_call(
-                [str(self.compiler_path), '/Qp', '/O' + str(output_path), str(installer_path)])
+            _write_script(installer_path, render_variants(installer, variants, self), installer.deterministic)
+            cost = estimate_build_cost(installer) if scheduler is not None else None
+
+            def compile_variant(variant: Variant) -> None:
+                with scheduler.slot(cost, priority=priority) if scheduler is not None else ExitStack():
+                    backend.compile(installer_path, outputs[variant.name], variant.iscc_options())
+
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                list(executor.map(compile_variant, variants))
+        return outputs
+
+
+def _command_diff(arguments: Any) -> int:
+    diff = diff_scripts(arguments.old, arguments.new, payload=not arguments.no_payload)
+    print(json.dumps(diff.to_dict(), indent=2) if arguments.json else diff.summary())
+    problems = []
+    if arguments.max_growth_bytes is not None and diff.payload_growth > arguments.max_growth_bytes:
+        problems.append("payload grew by {} bytes, more than {}".format(diff.payload_growth, arguments.max_growth_bytes))
+    if arguments.max_growth_percent is not None and diff.old_payload_bytes:
+        percent = 100.0 * diff.payload_growth / diff.old_payload_bytes
+        if percent > arguments.max_growth_percent:
+            problems.append("payload grew by {:.1f}%, more than {}%".format(percent, arguments.max_growth_percent))
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+
+def _command_validate(arguments: Any) -> int:
+    issues = validate_installer(load_iss(arguments.script), check_sources=not arguments.no_sources)
+    for issue in issues:
+        print(issue)
+    return 1 if any(issue.severity == "error" for issue in issues) else 0
+
+
+def _command_sizes(arguments: Any) -> int:
+    rollup = size_rollup(load_iss(arguments.script))
+    print(json.dumps(rollup.to_dict(), indent=2) if arguments.json else rollup.summary(top=arguments.top))
+    return 0
+
+
+def _command_payload(arguments: Any) -> int:
+    report = payload_report(load_iss(arguments.script).files)
+    report.write(json_path=arguments.json, html_path=arguments.html)
+    if arguments.json is None and arguments.html is None:
+        print(report.to_json())
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point: ``python -m innosetup_builder <command>``."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m innosetup_builder")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    diff_parser = commands.add_parser("diff", help="compare two .iss scripts section by section")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("--json", action="store_true", help="print the diff as JSON")
+    diff_parser.add_argument("--no-payload", action="store_true", help="do not stat sources for payload sizes")
+    diff_parser.add_argument("--max-growth-bytes", type=int, help="fail if the payload grows by more bytes")
+    diff_parser.add_argument("--max-growth-percent", type=float, help="fail if the payload grows by more percent")
+    diff_parser.set_defaults(handler=_command_diff)
+
+    validate_parser = commands.add_parser("validate", help="check a .iss script before compiling it")
+    validate_parser.add_argument("script")
+    validate_parser.add_argument("--no-sources", action="store_true", help="do not check that sources exist")
+    validate_parser.set_defaults(handler=_command_validate)
+
+    sizes_parser = commands.add_parser("sizes", help="report payload sizes per type, component and directory")
+    sizes_parser.add_argument("script")
+    sizes_parser.add_argument("--json", action="store_true", help="print the full rollup as JSON")
+    sizes_parser.add_argument("--top", type=int, default=10, help="how many of the largest entries to list")
+    sizes_parser.set_defaults(handler=_command_sizes)
+
+    payload_parser = commands.add_parser("payload", help="break the payload down by directory, extension and component")
+    payload_parser.add_argument("script")
+    payload_parser.add_argument("--json", metavar="PATH", help="write the report as JSON")
+    payload_parser.add_argument("--html", metavar="PATH", help="write an HTML treemap")
+    payload_parser.set_defaults(handler=_command_payload)
+
+    arguments = parser.parse_args(argv)
+    return arguments.handler(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
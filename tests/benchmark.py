@@ -0,0 +1,234 @@
+"""Helpers for the benchmark suite: synthetic trees, a stand-in ISCC and baselines.
+
+Benchmarks are opt-in. Set ``INNOSETUP_BENCHMARK=1`` to run them. The other
+environment variables are:
+
+- ``INNOSETUP_BENCHMARK_SIZES``: comma separated tree sizes (default ``10000``;
+  use ``10000,100000,1000000`` for the full matrix)
+- ``INNOSETUP_BENCHMARK_THRESHOLD``: allowed slowdown over the baseline as a
+  fraction (default ``0.25``, i.e. 25%)
+- ``INNOSETUP_BENCHMARK_BASELINES``: path of the JSON baseline store (default
+  ``.benchmarks/baselines.json`` in the repository root)
+- ``INNOSETUP_BENCHMARK_UPDATE``: set to ``1`` to overwrite stored baselines
+- ``INNOSETUP_BENCHMARK_REPEATS``: how many times each measurement is taken;
+  the fastest run is kept (default ``3``)
+"""
+
+import json
+import os
+import pathlib
+import random
+import stat
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+ENABLED = os.environ.get("INNOSETUP_BENCHMARK", "") not in ("", "0")
+
+requires_benchmark = pytest.mark.skipif(
+    not ENABLED, reason="set INNOSETUP_BENCHMARK=1 to run benchmarks")
+
+# Rough extension mix of a frozen Python application: lots of bytecode and
+# extension modules, a fair amount of data files and a handful of everything else.
+EXTENSION_WEIGHTS = {
+    ".pyc": 30,
+    ".py": 15,
+    ".pyd": 8,
+    ".dll": 8,
+    ".json": 6,
+    ".txt": 6,
+    ".png": 6,
+    ".xml": 3,
+    ".ini": 2,
+    ".exe": 2,
+    ".zip": 2,
+    ".ttf": 1,
+    ".chm": 1,
+    ".tlb": 1,
+    ".ocx": 1,
+    ".mp3": 1,
+    ".dat": 7,
+}
+
+STAND_IN_ISCC = """\
+#!{python}
+\"\"\"Stand-in for ISCC.exe: preprocesses the script and writes a fake installer.
+
+Understands the ISPP subset the builder emits: /D defines, #include, #ifdef,
+#if defined(...), #elif defined(...), #else and #endif. With
+STAND_IN_ISCC_SAVE set the preprocessed script is saved next to the output.
+\"\"\"
+import hashlib
+import os
+import pathlib
+import re
+import sys
+
+if sys.argv[1:] in ([], ["/?"]):
+    print("Inno Setup 6.2.2 Command-Line Compiler (stand-in)")
+    sys.exit(1)
+# the script is always the last argument; on Linux it also starts with "/"
+output = None
+defines = set()
+script = sys.argv[-1]
+for arg in sys.argv[1:-1]:
+    if arg.startswith("/O"):
+        output = arg[2:]
+    elif arg.startswith("/D"):
+        defines.add(arg[2:].partition("=")[0])
+
+
+def preprocess(path):
+    lines = []
+    # one entry per open #if: [this branch active, some branch taken]
+    stack = []
+    for line in pathlib.Path(path).read_bytes().splitlines(keepends=True):
+        directive = line.strip().decode("utf-8", "replace")
+        active = all(branch[0] for branch in stack)
+        if directive.startswith(("#ifdef ", "#if ")):
+            names = re.findall(r"defined\\((\\w+)\\)", directive) or directive.split()[1:]
+            taken = any(name in defines for name in names)
+            stack.append([taken, taken])
+        elif directive.startswith("#elif "):
+            taken = not stack[-1][1] and any(name in defines for name in re.findall(r"defined\\((\\w+)\\)", directive))
+            stack[-1] = [taken, stack[-1][1] or taken]
+        elif directive == "#else":
+            stack[-1] = [not stack[-1][1], True]
+        elif directive == "#endif":
+            stack.pop()
+        elif active and directive.startswith("#include "):
+            lines.append(preprocess(pathlib.Path(path).parent / directive.split('"')[1]))
+        elif active:
+            lines.append(line)
+    return b"".join(lines)
+
+
+text = preprocess(script)
+pathlib.Path(output).write_bytes(b"MZ" + hashlib.sha256(text).digest())
+if os.environ.get("STAND_IN_ISCC_SAVE"):
+    pathlib.Path(output + ".iss").write_bytes(text)
+"""
+
+STAND_IN_SIGNER = """\
+#!{python}
+\"\"\"Stand-in for signtool: appends a signature block to the file in place.
+
+Each signed path is appended to the log next to this script, and with
+STAND_IN_SIGNER_DELAY set every signature takes that many seconds.
+\"\"\"
+import hashlib
+import os
+import pathlib
+import sys
+import time
+
+path = pathlib.Path(sys.argv[-1])
+time.sleep(float(os.environ.get("STAND_IN_SIGNER_DELAY", "0")))
+data = path.read_bytes()
+path.write_bytes(data + b"SIGNATURE" + hashlib.sha256(data).digest())
+with open(pathlib.Path(__file__).with_suffix(".log"), "a") as log:
+    log.write(path.name + "\\n")
+"""
+
+
+def env_sizes() -> List[int]:
+    """The tree sizes requested through the environment."""
+    raw = os.environ.get("INNOSETUP_BENCHMARK_SIZES", "10000")
+    return [int(size) for size in raw.split(",") if size.strip()]
+
+
+def make_tree(root: pathlib.Path, count: int, seed: int = 0, max_depth: int = 6, fan_out: int = 8) -> pathlib.Path:
+    """Create ``count`` empty files below ``root`` in a random directory tree.
+
+    Files are empty because the scanner, classifier and renderer only look at
+    names; benchmarks that need payload bytes write them separately.
+    """
+    rng = random.Random(seed)
+    extensions = list(EXTENSION_WEIGHTS)
+    weights = list(EXTENSION_WEIGHTS.values())
+    directories = [root]
+    root.mkdir(parents=True, exist_ok=True)
+    depth = {root: 0}
+    for index in range(count):
+        # grow the directory tree roughly once every 40 files
+        if rng.random() < 0.025:
+            parent = rng.choice(directories)
+            if depth[parent] < max_depth and len(directories) < count:
+                child = parent / "dir{}".format(len(directories))
+                child.mkdir()
+                directories.append(child)
+                depth[child] = depth[parent] + 1
+        directory = rng.choice(directories[-fan_out:] if rng.random() < 0.5 else directories)
+        suffix = rng.choices(extensions, weights)[0]
+        (directory / "file{}{}".format(index, suffix)).touch()
+    return root
+
+
+def make_stand_in_iscc(base_path: pathlib.Path) -> pathlib.Path:
+    """Write an executable stand-in ``ISCC.exe`` into ``base_path``."""
+    base_path.mkdir(parents=True, exist_ok=True)
+    compiler = base_path / "ISCC.exe"
+    compiler.write_text(STAND_IN_ISCC.format(python=sys.executable))
+    compiler.chmod(compiler.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return compiler
+
+
+def make_stand_in_signer(directory: pathlib.Path) -> List[str]:
+    """Write a stand-in signtool into ``directory`` and return its Signer command.
+
+    The names of the signed files are logged to ``directory / "signtool.log"``.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    signer = directory / "signtool.py"
+    signer.write_text(STAND_IN_SIGNER.format(python=sys.executable))
+    return [sys.executable, str(signer), "sign", "/fd", "sha256", "$f"]
+
+
+def measure(func: Callable[[], object], repeats: Optional[int] = None) -> float:
+    """Run ``func`` several times and return the fastest wall-clock time."""
+    if repeats is None:
+        repeats = int(os.environ.get("INNOSETUP_BENCHMARK_REPEATS", "3"))
+    best = float("inf")
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+class Baselines:
+    """A JSON file of benchmark name to seconds, checked against a threshold."""
+
+    def __init__(self, path: Optional[pathlib.Path] = None, threshold: Optional[float] = None, update: Optional[bool] = None):
+        if path is None:
+            path = pathlib.Path(os.environ.get(
+                "INNOSETUP_BENCHMARK_BASELINES", ROOT / ".benchmarks" / "baselines.json"))
+        if threshold is None:
+            threshold = float(os.environ.get("INNOSETUP_BENCHMARK_THRESHOLD", "0.25"))
+        if update is None:
+            update = os.environ.get("INNOSETUP_BENCHMARK_UPDATE", "") not in ("", "0")
+        self.path = pathlib.Path(path)
+        self.threshold = threshold
+        self.update = update
+        self.results: Dict[str, Dict[str, float]] = {}
+        if self.path.exists():
+            self.results = json.loads(self.path.read_text())
+
+    def check(self, name: str, seconds: float) -> None:
+        """Record ``seconds`` for ``name`` or fail if it regressed past the threshold."""
+        baseline = self.results.get(name)
+        if baseline is None or self.update:
+            self.results[name] = {"seconds": seconds}
+            self.save()
+            return
+        limit = baseline["seconds"] * (1 + self.threshold)
+        assert seconds <= limit, "{} regressed: {:.4f}s vs baseline {:.4f}s (threshold {:.0%})".format(
+            name, seconds, baseline["seconds"], self.threshold)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.results, indent=2, sort_keys=True))
@@ -0,0 +1,56 @@
+"""Shared fixtures for the test suite."""
+
+import pytest
+
+import innosetup_builder
+
+
+@pytest.fixture(autouse=True)
+def isolated_compiler_discovery(tmp_path, monkeypatch):
+    """Keep compiler discovery from reading or writing the real user cache."""
+    monkeypatch.setenv("INNOSETUP_DISCOVERY_CACHE", str(tmp_path / "discovery" / "compiler.json"))
+    monkeypatch.delenv("INNOSETUP_PATH", raising=False)
+    innosetup_builder.discover_compiler.cache_clear()
+    innosetup_builder.probe_compiler_version.cache_clear()
+    yield
+    innosetup_builder.discover_compiler.cache_clear()
+    innosetup_builder.probe_compiler_version.cache_clear()
+
+class MockInnosetupCompiler(innosetup_builder.InnosetupCompiler):
+    """A compiler without an Inno Setup installation, offering ``languages``."""
+
+    def __init__(self, languages=()):
+        super().__init__(base_path=None)
+        self.languages = list(languages)
+
+    def available_languages(self):
+        return iter(self.languages)
+
+
+@pytest.fixture
+def compiler():
+    """A compiler that renders scripts without Inno Setup; set ``languages`` to offer some."""
+    return MockInnosetupCompiler()
+
+
+@pytest.fixture
+def write_tree(tmp_path):
+    """Return a function writing ``{relative path: contents}`` below ``tmp_path / root`` and returning that root.
+
+    Contents may be ``str`` or ``bytes``; a path ending in ``/`` is created as an empty directory.
+    """
+    def write(files, root=""):
+        base = tmp_path / root
+        base.mkdir(parents=True, exist_ok=True)
+        for name, contents in files.items():
+            path = base / name
+            if name.endswith("/"):
+                path.mkdir(parents=True, exist_ok=True)
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(contents, bytes):
+                path.write_bytes(contents)
+            else:
+                path.write_text(contents)
+        return base
+    return write
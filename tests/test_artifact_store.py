@@ -0,0 +1,136 @@
+"""Tests for the content-addressed artifact store and compile avoidance."""
+
+import os
+import threading
+
+import pytest
+from innosetup_builder import (ArtifactStore, FileEntry, Installer, InnosetupCompiler, LocalArtifactStore,
+                               build_fingerprint, hash_paths)
+
+from tests.benchmark import make_stand_in_iscc
+
+KEY_A = "a" * 64
+KEY_B = "b" * 64
+KEY_C = "c" * 64
+
+
+def artifact(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(name.encode() * (size // len(name)))
+    return path
+
+
+class TestLocalArtifactStore:
+    def test_put_and_get(self, tmp_path):
+        store = LocalArtifactStore(tmp_path / "store")
+        store.put(KEY_A, artifact(tmp_path, "one.exe", 100))
+        assert KEY_A in store
+        assert store.get(KEY_A, tmp_path / "copy.exe")
+        assert (tmp_path / "copy.exe").read_bytes() == (tmp_path / "one.exe").read_bytes()
+        assert not store.get(KEY_B, tmp_path / "other.exe")
+        assert not (tmp_path / "other.exe").exists()
+        # nothing is left behind by the atomic publish
+        assert list((tmp_path / "store" / "incoming").iterdir()) == []
+
+    def test_backends_implement_get_and_put(self):
+        class GetOnly(ArtifactStore):
+            def get(self, key, destination):
+                return False
+
+        with pytest.raises(TypeError):
+            GetOnly()
+
+    def test_keys_validated(self, tmp_path):
+        with pytest.raises(ValueError):
+            LocalArtifactStore(tmp_path).get("../../etc/passwd", tmp_path / "x")
+
+    def test_lru_eviction(self, tmp_path):
+        store = LocalArtifactStore(tmp_path / "store", max_bytes=250)
+        store.put(KEY_A, artifact(tmp_path, "a.exe", 100))
+        store.put(KEY_B, artifact(tmp_path, "b.exe", 100))
+        os.utime(str(store.path(KEY_A)), ns=(1, 1))
+        os.utime(str(store.path(KEY_B)), ns=(2, 2))
+        # reading A makes B the least recently used
+        store.get(KEY_A, tmp_path / "copy.exe")
+        store.put(KEY_C, artifact(tmp_path, "c.exe", 100))
+        assert KEY_A in store and KEY_C in store
+        assert KEY_B not in store
+
+    def test_evict_returns_keys(self, tmp_path):
+        store = LocalArtifactStore(tmp_path / "store")
+        store.put(KEY_A, artifact(tmp_path, "a.exe", 100))
+        assert store.evict(0) == [KEY_A]
+        assert store.evict(0) == []
+
+    def test_concurrent_readers_and_writers(self, tmp_path):
+        store = LocalArtifactStore(tmp_path / "store", max_bytes=1000000)
+        source = artifact(tmp_path, "big.exe", 200000)
+        errors = []
+
+        def worker(index):
+            try:
+                for _ in range(10):
+                    store.put(KEY_A, source)
+                    destination = tmp_path / "out{}.exe".format(index)
+                    if store.get(KEY_A, destination):
+                        assert destination.read_bytes() == source.read_bytes()
+            except Exception as error:  # pragma: no cover - reported below
+                errors.append(error)
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+
+class TestFingerprint:
+    def test_content_not_timestamps(self, tmp_path, compiler):
+        source = tmp_path / "app.exe"
+        source.write_bytes(b"one")
+        installer = Installer(files=[FileEntry(source=str(source), destination="")])
+        script = installer.render(compiler)
+        first = build_fingerprint(script, installer, "6.2.2")
+        os.utime(str(source), ns=(1, 1))
+        assert build_fingerprint(script, installer, "6.2.2") == first
+        source.write_bytes(b"two")
+        assert build_fingerprint(script, installer, "6.2.2") != first
+        assert build_fingerprint(script, installer, "6.3.0") != build_fingerprint(script, installer, "6.2.2")
+
+    def test_source_root_placeholder(self, tmp_path, compiler):
+        keys = []
+        for agent in ("agent1", "agent2"):
+            root = tmp_path / agent
+            root.mkdir()
+            (root / "app.exe").write_bytes(b"same")
+            installer = Installer(files=[FileEntry(source=str(root / "app.exe"), destination="")])
+            keys.append(build_fingerprint(installer.render(compiler), installer, source_root=root))
+        assert keys[0] == keys[1]
+
+    def test_hash_cache(self, tmp_path):
+        source = tmp_path / "data.bin"
+        source.write_bytes(b"x" * 10)
+        cache = {}
+        digest = hash_paths([str(source)], cache=cache)[str(source)]
+        assert cache[str(source)][2] == digest
+        cache[str(source)] = cache[str(source)][:2] + ("cached",)
+        assert hash_paths([str(source)], cache=cache)[str(source)] == "cached"
+        assert hash_paths([str(tmp_path / "missing")])[str(tmp_path / "missing")] is None
+
+
+class TestBuildWithStore:
+    def test_second_build_served_from_store(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        source = tmp_path / "app.exe"
+        source.write_bytes(b"app")
+        installer = Installer(app_name="App", multilingual=False, files=[FileEntry(source=str(source), destination="")])
+        store = LocalArtifactStore(tmp_path / "store")
+        compiler.build(installer, tmp_path / "first.exe", store=store)
+        assert len(list((tmp_path / "store" / "objects").glob("*/*"))) == 1
+        # with the compiler gone, only the store can produce the installer
+        (tmp_path / "innosetup" / "ISCC.exe").write_text(
+            '#!/bin/sh\n[ "$1" = "/?" ] && echo "Inno Setup 6.2.2 Command-Line Compiler (stand-in)"\nexit 1\n')
+        compiler.build(installer, tmp_path / "second.exe", store=store)
+        assert (tmp_path / "second.exe").read_bytes() == (tmp_path / "first.exe").read_bytes()
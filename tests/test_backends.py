@@ -0,0 +1,133 @@
+"""Tests for the compiler backends."""
+
+import json
+import lzma
+import struct
+
+import pytest
+from innosetup_builder import (CompilerBackend, FakeCompilerBackend, FileEntry, FileFlags, Installer, InnosetupCompiler,
+                               IsccBackend, LocalArtifactStore, Variant, WineIsccBackend, preprocess_iss)
+
+from tests.benchmark import make_stand_in_iscc
+
+
+def manifest(path):
+    data = path.read_bytes()
+    assert data[:2] == b"MZ"
+    (length,) = struct.unpack("<I", data[2:6])
+    return json.loads(data[6:6 + length]), data[6 + length:]
+
+
+@pytest.fixture
+def payload(write_tree):
+    return write_tree({"app.exe": b"MZ" + b"code " * 1000, "readme.txt": "read me " * 500, "sub/notes.txt": "notes"},
+                      root="source")
+
+
+@pytest.fixture
+def compiler():
+    return InnosetupCompiler(base_path=None, backend=FakeCompilerBackend(preset=1))
+
+
+class TestIsccBackends:
+    def test_native(self, tmp_path):
+        iscc = make_stand_in_iscc(tmp_path / "innosetup")
+        script = tmp_path / "setup.iss"
+        script.write_text("[Setup]\n")
+        IsccBackend(iscc).compile(script, tmp_path / "setup.exe")
+        assert (tmp_path / "setup.exe").read_bytes().startswith(b"MZ")
+        assert IsccBackend(iscc).version == "6.2.2"
+
+    def test_wine(self, tmp_path):
+        backend = WineIsccBackend(tmp_path / "ISCC.exe", wine="/opt/wine/bin/wine")
+        assert backend.command == ["/opt/wine/bin/wine", str(tmp_path / "ISCC.exe")]
+        assert backend.host_path("/build/setup.iss") == "Z:\\build\\setup.iss"
+
+    def test_installation_picks_backend(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        assert isinstance(InnosetupCompiler(base_path=str(tmp_path / "innosetup")).compiler_backend, IsccBackend)
+        with pytest.raises(FileNotFoundError):
+            InnosetupCompiler(base_path=None).compiler_backend
+
+    def test_backends_implement_compile(self):
+        with pytest.raises(TypeError):
+            CompilerBackend()
+
+
+class TestPreprocess:
+    def test_includes_and_conditions(self, tmp_path):
+        (tmp_path / "files.iss").write_text("[Files]\nSource: a\n")
+        (tmp_path / "setup.iss").write_text('#include "files.iss"\n#ifdef PRO\nSource: pro\n#elif defined(LITE)\n'
+                                            'Source: lite\n#else\nSource: none\n#endif\n')
+        assert preprocess_iss(tmp_path / "setup.iss") == ["[Files]", "Source: a", "Source: none"]
+        assert preprocess_iss(tmp_path / "setup.iss", ["LITE"])[-1] == "Source: lite"
+
+
+class TestFakeCompilerBackend:
+    def test_build_packs_the_payload(self, tmp_path, payload, compiler):
+        installer = Installer(app_name="App", multilingual=False, files=[
+            FileEntry(source=str(payload / "app.exe"), destination="bin"),
+            FileEntry(source=str(payload / "readme.txt"), destination="", dest_name="README.txt"),
+            FileEntry(source=str(payload / "*.txt"), destination="docs", flags="recursesubdirs")])
+        compiler.build(installer, tmp_path / "setup.exe")
+        data, stream = manifest(tmp_path / "setup.exe")
+        assert data['compression'] == "lzma2/ultra"
+        assert [entry[0] for entry in data['files']] == ["{app}\\bin\\app.exe", "{app}\\README.txt",
+                                                         "{app}\\docs\\readme.txt", "{app}\\docs\\sub\\notes.txt"]
+        assert [entry[1] for entry in data['files']] == [5002, 4000, 4000, 5]
+        assert len(stream) < 1000
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA2}])
+        assert decompressor.decompress(stream).startswith(b"MZcode")
+
+    def test_reproducible(self, tmp_path, payload, compiler):
+        copy = tmp_path / "copy"
+        copy.mkdir()
+        (copy / "app.exe").write_bytes((payload / "app.exe").read_bytes())
+        for index, source in enumerate((payload, payload, copy)):
+            installer = Installer(app_name="App", multilingual=False,
+                                  files=[FileEntry(source=str(source / "app.exe"), destination="")])
+            compiler.build(installer, tmp_path / "setup{}.exe".format(index))
+        outputs = {(tmp_path / "setup{}.exe".format(index)).read_bytes() for index in range(3)}
+        assert len(outputs) == 1
+
+    def test_missing_sources(self, tmp_path, payload, compiler):
+        installer = Installer(multilingual=False, files=[FileEntry(source=str(payload / "gone.dll"), destination="")])
+        with pytest.raises(FileNotFoundError):
+            compiler.build(installer, tmp_path / "setup.exe")
+        installer.files[0].flags = [FileFlags.SKIP_IF_SOURCE_DOESNT_EXIST]
+        compiler.build(installer, tmp_path / "setup.exe")
+        assert manifest(tmp_path / "setup.exe")[0]['files'] == []
+        installer.files = [FileEntry(source=str(payload / "*.dat"), destination="")]
+        with pytest.raises(FileNotFoundError):
+            compiler.build(installer, tmp_path / "setup.exe")
+
+    def test_compression_settings(self, tmp_path, payload, compiler):
+        sizes = {}
+        for compression in ("none", "zip", "bzip", "lzma2/fast"):
+            installer = Installer(multilingual=False,
+                                  extra_iss="[Setup]\nCompression={}\nSolidCompression=yes\n".format(compression),
+                                  files=[FileEntry(source=str(payload / "readme.txt"), destination="")])
+            compiler.build(installer, tmp_path / "setup.exe")
+            data, stream = manifest(tmp_path / "setup.exe")
+            assert data['solid'] is True
+            sizes[compression] = len(stream)
+        assert sizes["none"] == 4000
+        assert max(sizes["zip"], sizes["bzip"], sizes["lzma2/fast"]) < 200
+
+    def test_nocompression_files_stored(self, tmp_path, payload, compiler):
+        installer = Installer(multilingual=False, files=[
+            FileEntry(source=str(payload / "readme.txt"), destination="", flags=[FileFlags.NO_COMPRESSION])])
+        compiler.build(installer, tmp_path / "setup.exe")
+        assert manifest(tmp_path / "setup.exe")[1] == (payload / "readme.txt").read_bytes()
+
+    def test_variants_and_store(self, tmp_path, payload, compiler):
+        installer = Installer(app_name="App", multilingual=False,
+                              files=[FileEntry(source=str(payload / "app.exe"), destination="")])
+        variants = [Variant("lite"), Variant("pro", files=[FileEntry(source=str(payload / "readme.txt"),
+                                                                     destination="")])]
+        outputs = compiler.build_variants(installer, variants, tmp_path / "dist", max_workers=2)
+        assert len(manifest(outputs["lite"])[0]['files']) == 1
+        assert len(manifest(outputs["pro"])[0]['files']) == 2
+        store = LocalArtifactStore(tmp_path / "store")
+        compiler.build(installer, tmp_path / "one.exe", store=store)
+        assert len(list((tmp_path / "store" / "objects").glob("*/*"))) == 1
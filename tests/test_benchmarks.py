@@ -0,0 +1,400 @@
+"""Benchmarks for scanning, classifying, rendering and compiling at scale.
+
+See tests/benchmark.py for the environment variables that control them.
+"""
+
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import attr
+import pytest
+import innosetup_builder
+from innosetup_builder import (BuildScheduler, Component, DestinationTrie, FakeCompilerBackend, FileEntry, FileSource,
+                               Installer, InnosetupCompiler, LocalArtifactStore, OffloadPolicy, RegistryTree, Signer,
+                               Variant,
+                               all_files, build_fingerprint, diff_installers, get_default_flags_for_file, import_reg,
+                               parse_iss, payload_report, render_fragments, size_rollup, validate_installer)
+
+from tests.benchmark import (Baselines, env_sizes, make_stand_in_iscc, make_stand_in_signer, make_tree, measure,
+                             requires_benchmark)
+
+
+@pytest.fixture(scope="module")
+def baselines():
+    return Baselines()
+
+
+@pytest.fixture(scope="module", params=env_sizes())
+def tree(request, tmp_path_factory):
+    size = request.param
+    root = make_tree(tmp_path_factory.mktemp("tree{}".format(size)), size)
+    return size, root
+
+
+@pytest.fixture(scope="module")
+def stand_in_compiler(tmp_path_factory):
+    base_path = tmp_path_factory.mktemp("innosetup")
+    make_stand_in_iscc(base_path)
+    return InnosetupCompiler(base_path=str(base_path))
+
+
+@requires_benchmark
+class TestBenchmarks:
+    def test_all_files(self, tree, baselines):
+        size, root = tree
+        seconds = measure(lambda: sum(1 for _ in all_files(root, main_executable="file0.exe")))
+        baselines.check("all_files[{}]".format(size), seconds)
+
+    def test_get_default_flags_for_file(self, tree, baselines):
+        size, root = tree
+        paths = [pathlib.Path(entry.source) for entry in all_files(root, auto_flags=False)]
+        seconds = measure(lambda: [get_default_flags_for_file(path, "file0.exe") for path in paths])
+        baselines.check("get_default_flags_for_file[{}]".format(size), seconds)
+
+    def test_render(self, tree, baselines, stand_in_compiler):
+        size, root = tree
+        installer = Installer(app_name="Bench", app_version="1.0", main_executable="file0.exe",
+                              files=list(all_files(root, main_executable="file0.exe")))
+        seconds = measure(lambda: installer.render(stand_in_compiler))
+        baselines.check("render[{}]".format(size), seconds)
+
+    def test_build(self, tree, baselines, stand_in_compiler, tmp_path):
+        size, root = tree
+        installer = Installer(app_name="Bench", app_version="1.0", main_executable="file0.exe",
+                              files=list(all_files(root, main_executable="file0.exe")))
+        output = tmp_path / "installer.exe"
+        seconds = measure(lambda: stand_in_compiler.build(installer, output))
+        assert output.exists()
+        baselines.check("build[{}]".format(size), seconds)
+
+
+class TestBaselines:
+    def test_first_run_records_baseline(self, tmp_path):
+        store = Baselines(tmp_path / "baselines.json", threshold=0.1, update=False)
+        store.check("example", 1.0)
+        assert Baselines(tmp_path / "baselines.json").results["example"]["seconds"] == 1.0
+
+    def test_within_threshold_passes(self, tmp_path):
+        store = Baselines(tmp_path / "baselines.json", threshold=0.1, update=False)
+        store.check("example", 1.0)
+        store.check("example", 1.09)
+
+    def test_regression_fails(self, tmp_path):
+        store = Baselines(tmp_path / "baselines.json", threshold=0.1, update=False)
+        store.check("example", 1.0)
+        with pytest.raises(AssertionError, match="regressed"):
+            store.check("example", 1.2)
+
+    def test_update_overwrites_baseline(self, tmp_path):
+        Baselines(tmp_path / "baselines.json", threshold=0.1, update=False).check("example", 1.0)
+        store = Baselines(tmp_path / "baselines.json", threshold=0.1, update=True)
+        store.check("example", 5.0)
+        assert store.results["example"]["seconds"] == 5.0
+
+    def test_make_tree_creates_requested_files(self, tmp_path):
+        root = make_tree(tmp_path / "tree", 200)
+        assert len(list(all_files(root))) == 200
+
+
+@requires_benchmark
+class TestImportBenchmark:
+    def test_import_time(self, baselines):
+        command = [sys.executable, "-c", "import innosetup_builder"]
+        seconds = measure(lambda: subprocess.check_call(command))
+        baselines.check("import", seconds)
+
+
+@requires_benchmark
+class TestParserBenchmark:
+    def test_round_trip(self, baselines):
+        installer = Installer(
+            app_name="Bench", app_version="1.0", main_executable="file0.exe", multilingual=False,
+            files=[FileEntry(source="C:\\src\\dir{}\\file{}.dll".format(i % 100, i), destination="dir{}".format(i % 100),
+                             flags="ignoreversion sharedfile", components="main") for i in range(50000)])
+        lines = installer.render(InnosetupCompiler(base_path=None)).splitlines()
+        assert len(lines) >= 100000
+        seconds = measure(lambda: parse_iss(lines))
+        assert parse_iss(lines).render(InnosetupCompiler(base_path=None)).splitlines() == lines
+        assert seconds < 1.0
+        baselines.check("parse_iss[{}]".format(len(lines)), seconds)
+
+
+@requires_benchmark
+class TestDiffBenchmark:
+    def test_diff_installers(self, baselines):
+        def installer(version):
+            return Installer(app_name="Bench", files=[
+                FileEntry(source="C:\\src\\file{}.dll".format(i), destination="dir{}".format(i % 100),
+                          flags="ignoreversion", components="v{}".format(version) if i % 1000 == 0 else "main")
+                for i in range(100000)])
+        old, new = installer(1), installer(2)
+        seconds = measure(lambda: diff_installers(old, new, payload=False))
+        assert len(diff_installers(old, new, payload=False).sections['files'].changed) == 100
+        baselines.check("diff_installers[100000]", seconds)
+
+
+@requires_benchmark
+class TestRegImportBenchmark:
+    def test_import_100k_values(self, baselines, tmp_path):
+        path = tmp_path / "com.reg"
+        lines = ["Windows Registry Editor Version 5.00", ""]
+        for key in range(10000):
+            lines.append("[HKEY_CLASSES_ROOT\\CLSID\\{{{:08X}-0000-0000-0000-000000000000}}\\InprocServer32]".format(key))
+            lines.append('@="C:\\\\Program Files\\\\App\\\\server{}.dll"'.format(key))
+            lines.append('"ThreadingModel"="Apartment"')
+            for value in range(7):
+                lines.append('"Value{}"=dword:{:08x}'.format(value, key + value))
+            lines.append('"Blob"=hex:00,01,02,03,04,05,06,07')
+        path.write_text("\r\n".join(lines), encoding="utf-16")
+        seconds = measure(lambda: import_reg(path))
+        assert len(import_reg(path)) == 100000
+        baselines.check("import_reg[100000]", seconds)
+
+
+@requires_benchmark
+class TestRegistryTreeBenchmark:
+    def test_com_registration_set(self, baselines):
+        def build():
+            tree = RegistryTree()
+            # every class registered twice, as happens when type libraries overlap
+            for _ in range(2):
+                for number in range(20000):
+                    clsid = "{{{{{:08X}-0000-0000-0000-000000000000}}".format(number)
+                    tree.update({"CLSID": {clsid: {
+                        "@": "Component {}".format(number),
+                        "InprocServer32": {"@": "{app}\\server.dll", "ThreadingModel": "Apartment"},
+                        "ProgID": {"@": "App.Component{}".format(number)},
+                    }}}, root="HKCR")
+            return tree.entries()
+        seconds = measure(build)
+        assert len(build()) == 80000
+        baselines.check("registry_tree[20000 classes]", seconds)
+
+
+@requires_benchmark
+class TestValidationBenchmark:
+    def test_validate_tree(self, tree, baselines):
+        size, root = tree
+        installer = Installer(app_name="Bench", files=list(all_files(root)))
+        seconds = measure(lambda: validate_installer(installer))
+        assert [issue for issue in validate_installer(installer) if issue.severity == "error"] == []
+        baselines.check("validate_installer[{}]".format(size), seconds)
+
+    def test_validate_million_references(self, baselines):
+        components = [Component(name="c{}".format(i)) for i in range(1000)]
+        installer = Installer(app_name="Bench", components=components, files=[
+            FileEntry(source="C:\\src\\file{}.dll".format(i), destination="dir{}".format(i % 1000),
+                      components="c{} or c{}".format(i % 1000, (i + 1) % 1000)) for i in range(1000000)])
+        seconds = measure(lambda: validate_installer(installer, check_sources=False), repeats=1)
+        assert validate_installer(installer, check_sources=False) == []
+        baselines.check("validate_installer[1000000 references]", seconds)
+
+
+@requires_benchmark
+class TestSizeRollupBenchmark:
+    def test_rollup_tree(self, tree, baselines):
+        size, root = tree
+        installer = Installer(app_name="Bench", files=list(all_files(root)))
+        seconds = measure(lambda: size_rollup(installer))
+        assert not size_rollup(installer).unsized
+        baselines.check("size_rollup[{}]".format(size), seconds)
+
+    def test_rollup_million_cached(self, baselines):
+        components = [Component(name="c{}".format(i), types="full") for i in range(1000)]
+        files = [FileEntry(source="C:\\src\\file{}.dll".format(i), destination="a\\b{}\\c{}".format(i % 100, i % 1000),
+                           components="c{}".format(i % 1000)) for i in range(1000000)]
+        installer = Installer(app_name="Bench", components=components, files=files)
+        stat = os.stat(__file__)
+        cache = {entry.source: stat for entry in files}
+        seconds = measure(lambda: size_rollup(installer, stat_cache=cache), repeats=1)
+        baselines.check("size_rollup[1000000 cached]", seconds)
+
+
+@requires_benchmark
+class TestPayloadReportBenchmark:
+    def test_report_tree(self, tree, baselines):
+        size, root = tree
+        seconds = measure(lambda: payload_report(all_files(root)))
+        assert payload_report(all_files(root)).root.files == size
+        baselines.check("payload_report[{}]".format(size), seconds)
+
+    def test_report_million_streamed(self, baselines):
+        stat = os.stat(__file__)
+
+        def files():
+            for i in range(1000000):
+                yield FileEntry(source="C:\\src\\file{}.dll".format(i), destination="a\\b{}\\c{}".format(i % 100, i % 1000),
+                                components="c{}".format(i % 1000))
+
+        cache = {"C:\\src\\file{}.dll".format(i): stat for i in range(1000000)}
+        seconds = measure(lambda: payload_report(files(), stat_cache=cache), repeats=1)
+        baselines.check("payload_report[1000000 streamed]", seconds)
+
+
+@requires_benchmark
+class TestDestinationTrieBenchmark:
+    def test_scan_with_trie(self, tree, baselines):
+        size, root = tree
+
+        def scan():
+            trie = DestinationTrie()
+            files = list(all_files(root, trie=trie))
+            return files, trie.dir_entries()
+
+        seconds = measure(scan)
+        assert len(scan()[0]) == size
+        baselines.check("all_files_with_dirs[{}]".format(size), seconds)
+
+    def test_trie_from_million_files(self, baselines):
+        files = [FileEntry(source="file{}.dll".format(i), destination="a\\b{}\\c{}".format(i % 100, i % 1000))
+                 for i in range(1000000)]
+        seconds = measure(lambda: DestinationTrie.from_files(files).dir_entries(), repeats=1)
+        baselines.check("destination_trie[1000000 files]", seconds)
+
+
+@requires_benchmark
+class TestFragmentsBenchmark:
+    def test_render_fragments(self, tree, baselines, stand_in_compiler, tmp_path):
+        size, root = tree
+        components = [Component(name="c{}".format(i)) for i in range(100)]
+        files = list(all_files(root))
+        for index, entry in enumerate(files):
+            entry.components = "c{}".format(index % 100)
+        installer = Installer(app_name="Bench", multilingual=False, components=components, files=files)
+        seconds = measure(lambda: render_fragments(installer, stand_in_compiler, tmp_path, shard_by="component"))
+        assert len(render_fragments(installer, stand_in_compiler, tmp_path, shard_by="component").unchanged) == 101
+        baselines.check("render_fragments[{}]".format(size), seconds)
+
+
+@requires_benchmark
+class TestVariantsBenchmark:
+    def test_build_variants(self, tree, baselines, stand_in_compiler, tmp_path):
+        size, root = tree
+        installer = Installer(app_name="Bench", multilingual=False, files=list(all_files(root)))
+        variants = [Variant(name="{}-{}".format(edition, arch), defines={'ARCH': arch},
+                            setup={'OutputBaseFilename': "bench-{}-{}".format(edition, arch)})
+                    for edition in ("basic", "pro") for arch in ("x86", "x64")]
+        seconds = measure(lambda: stand_in_compiler.build_variants(installer, variants, tmp_path, max_workers=4))
+        baselines.check("build_variants[{} x 4]".format(size), seconds)
+
+
+@requires_benchmark
+class TestFingerprintBenchmark:
+    def test_fingerprint_tree(self, tree, baselines, stand_in_compiler):
+        size, root = tree
+        installer = Installer(app_name="Bench", multilingual=False, files=list(all_files(root)))
+        script = installer.render(stand_in_compiler)
+        cache = {}
+        build_fingerprint(script, installer, hash_cache=cache)
+        seconds = measure(lambda: build_fingerprint(script, installer, hash_cache=cache))
+        baselines.check("build_fingerprint[{} cached]".format(size), seconds)
+
+    def test_installer_fingerprint(self, tree, baselines, stand_in_compiler):
+        size, root = tree
+        installer = Installer(app_name="Bench", multilingual=False, deterministic=True,
+                              files=list(all_files(root, deterministic=True)))
+        seconds = measure(lambda: installer.fingerprint())
+        # feeding the hash entry by entry must stay well below a render
+        assert seconds < measure(lambda: installer.render(stand_in_compiler))
+        baselines.check("installer_fingerprint[{}]".format(size), seconds)
+
+
+@requires_benchmark
+class TestFrozenEntriesBenchmark:
+    def test_render_after_a_few_changes(self, tree, baselines, stand_in_compiler):
+        size, root = tree
+        installer = Installer(app_name="Bench", multilingual=False,
+                              files=list(all_files(root, main_executable="file0.exe"))).frozen()
+        installer.render(stand_in_compiler)
+
+        def change_and_render():
+            for index in range(0, len(installer.files), 100):
+                installer.files[index] = attr.evolve(installer.files[index], components=str(time.perf_counter()))
+            return installer.render(stand_in_compiler)
+
+        seconds = measure(change_and_render)
+        mutable = attr.evolve(installer, files=[FileEntry(**attr.asdict(entry)) for entry in installer.files])
+        assert seconds < measure(lambda: mutable.render(stand_in_compiler))
+        baselines.check("frozen_render_1pct_changed[{}]".format(size), seconds)
+
+    def test_first_render(self, tree, baselines, stand_in_compiler):
+        size, root = tree
+        installer = Installer(app_name="Bench", multilingual=False,
+                              files=list(all_files(root, main_executable="file0.exe")))
+
+        def cold_render():
+            # equal entries share their rows across renders
+            innosetup_builder._frozen_lines.clear()
+            return installer.frozen().render(stand_in_compiler)
+
+        seconds = measure(cold_render)
+        baselines.check("frozen_render_cold[{}]".format(size), seconds)
+
+
+@requires_benchmark
+class TestFileSourceBenchmark:
+    def test_scan_and_stream(self, tree, baselines, stand_in_compiler, tmp_path):
+        size, root = tree
+        installer = Installer(app_name="Bench", multilingual=False,
+                              files=FileSource.scan(root, main_executable="file0.exe"))
+        seconds = measure(lambda: installer.render_to(stand_in_compiler, tmp_path / "installer.iss"))
+        baselines.check("scan_and_stream[{}]".format(size), seconds)
+
+
+@requires_benchmark
+class TestSigningBenchmark:
+    def test_sign_cold_and_cached(self, baselines, tmp_path, monkeypatch):
+        monkeypatch.setenv("STAND_IN_SIGNER_DELAY", "0.05")
+        files = []
+        for index in range(64):
+            path = tmp_path / "payload" / "module{}.dll".format(index)
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(b"MZ" + bytes([index]) * 4096)
+            files.append(FileEntry(source=str(path), destination=""))
+        signer = Signer(make_stand_in_signer(tmp_path / "tools"), tmp_path / "staging", max_workers=16)
+        baselines.check("sign_cold[64]", measure(lambda: signer.sign(files), repeats=1))
+        seconds = measure(lambda: signer.sign(files))
+        assert len(signer.sign(files).cached) == 64
+        baselines.check("sign_cached[64]", seconds)
+
+
+@requires_benchmark
+class TestOffloadBenchmark:
+    def test_fake_compile_with_large_assets(self, baselines, tmp_path):
+        files = []
+        for index in range(4):
+            path = tmp_path / "payload" / "voice{}.bin".format(index)
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(os.urandom(2 << 20))
+            files.append(FileEntry(source=str(path), destination="voices"))
+        installer = Installer(app_name="Bench", multilingual=False, files=files)
+        compiler = InnosetupCompiler(base_path=None, backend=FakeCompilerBackend())
+        report = OffloadPolicy(threshold_bytes=1 << 20).apply(files)
+        assert len(report.offloaded) == 4
+        offloaded = attr.evolve(installer, files=report.files)
+        compressed = measure(lambda: compiler.build(installer, tmp_path / "compressed.exe"), repeats=1)
+        stored = measure(lambda: compiler.build(offloaded, tmp_path / "stored.exe"), repeats=1)
+        assert stored < compressed
+        baselines.check("offload_compile_compressed[8MB]", compressed)
+        baselines.check("offload_compile_stored[8MB]", stored)
+
+@requires_benchmark
+class TestPipelineBenchmark:
+    def test_fake_compiler_pipeline(self, tree, baselines, tmp_path):
+        size, root = tree
+        files = list(all_files(root, main_executable="file0.exe"))
+        for index, entry in enumerate(files[::50]):
+            pathlib.Path(entry.source).write_bytes(bytes(range(256)) * (16 + index % 64))
+        installer = Installer(app_name="Bench", app_version="1.0", main_executable="file0.exe", multilingual=False,
+                              files=files)
+        compiler = InnosetupCompiler(base_path=None, backend=FakeCompilerBackend(preset=1))
+        store = LocalArtifactStore(tmp_path / "store")
+        scheduler = BuildScheduler(cpus=4)
+        baselines.check("pipeline_cold[{}]".format(size), measure(
+            lambda: compiler.build(installer, tmp_path / "cold.exe", scheduler=scheduler), repeats=1))
+        compiler.build(installer, tmp_path / "warm.exe", store=store)
+        seconds = measure(lambda: compiler.build(installer, tmp_path / "warm.exe", store=store, scheduler=scheduler))
+        baselines.check("pipeline_cached[{}]".format(size), seconds)
@@ -0,0 +1,128 @@
+"""Tests for deterministic rendering and Installer.fingerprint."""
+
+import pathlib
+
+import pytest
+from innosetup_builder import (DirEntry, FileEntry, FileFlags, Installer, Variant, all_files, render_variants,
+                               stable_sort_key)
+
+
+LANGUAGES = [{'name': "german", 'messages_file': "compiler:Languages/german.isl", 'size_bytes': 1},
+             {'name': "French", 'messages_file': "compiler:Languages/French.isl", 'size_bytes': 1},
+             {'name': "Dutch", 'messages_file': "compiler:Languages/Dutch.isl", 'size_bytes': 1}]
+
+
+@pytest.fixture
+def payload(write_tree):
+    return write_tree({name: name for name in ("b.txt", "A.txt", "a.txt", "sub/z.dll", "Sub2/y.dll")})
+
+
+class TestStableOrder:
+    def test_sort_key(self):
+        assert sorted(["b", "B", "a", "A"], key=stable_sort_key) == ["A", "a", "B", "b"]
+
+    def test_all_files_ignores_the_filesystem_order(self, payload, monkeypatch):
+        scanned = [[(entry.source, entry.destination) for entry in all_files(payload, deterministic=True)]]
+        iterdir = pathlib.Path.iterdir
+        monkeypatch.setattr(pathlib.Path, "iterdir", lambda self: reversed(list(iterdir(self))))
+        scanned.append([(entry.source, entry.destination) for entry in all_files(payload, deterministic=True)])
+        assert scanned[0] == scanned[1]
+        assert [pathlib.Path(source).name for source, _ in scanned[0]] == ["A.txt", "a.txt", "b.txt", "z.dll", "y.dll"]
+        assert [destination for _, destination in scanned[0]] == ["", "", "", "sub", "Sub2"]
+
+    def test_destinations_use_backslashes(self, tmp_path):
+        (tmp_path / "a" / "b").mkdir(parents=True)
+        (tmp_path / "a" / "b" / "c.txt").write_text("c")
+        assert [entry.destination for entry in all_files(tmp_path, deterministic=True)] == ["a\\b"]
+
+
+class TestDeterministicRender:
+    def test_paths_and_line_endings(self, compiler):
+        installer = Installer(app_name="App", multilingual=False, deterministic=True,
+                              files=[FileEntry(source="C:/src/app.exe", destination="bin/x64"),
+                                     FileEntry(source="C:/src/readme.txt", destination=".")],
+                              dirs=[DirEntry(name="{app}/logs")], extra_iss="[Code]\r\nbegin\rend;\r\n")
+        text = installer.render(compiler)
+        assert "\r" not in text
+        assert 'Source: "C:/src/app.exe"; DestDir: "{app}\\bin\\x64"' in text
+        assert 'Source: "C:/src/readme.txt"; DestDir: "{app}"' in text
+        assert 'Name: "{app}\\logs"' in text
+        assert "[Code]\nbegin\nend;\n" in text
+        # the installer itself is left as it was
+        assert installer.files[0].destination == "bin/x64"
+
+    def test_languages_sorted(self, compiler):
+        compiler.languages = LANGUAGES
+        text = Installer(deterministic=True).render(compiler)
+        assert text.index('"Dutch"') < text.index('"French"') < text.index('"german"')
+        assert 'MessagesFile: "compiler:Languages\\Dutch.isl"' in text
+        # an explicit selection keeps its order
+        installer = Installer(deterministic=True, languages=["german", "Dutch"])
+        assert [language['name'] for language in installer.selected_languages(compiler)] == ["german", "Dutch"]
+
+    def test_unchanged_installer_is_not_copied(self):
+        installer = Installer(deterministic=True, files=[FileEntry(source="a", destination="bin")])
+        assert installer.normalised() is installer
+        assert Installer(files=[FileEntry(source="a", destination="bin/x")]).normalised().files[0].destination == "bin/x"
+
+    def test_fragments_written_as_utf8(self, tmp_path, compiler):
+        installer = Installer(app_name="Äpp", multilingual=False, deterministic=True,
+                              files=[FileEntry(source="C:\\src\\ä.txt", destination="docs/ü")])
+        installer.render_fragments(compiler, tmp_path)
+        data = (tmp_path / "files.iss").read_bytes()
+        assert data.startswith(b"\xef\xbb\xbf")
+        assert "{app}\\docs\\ü".encode('utf-8') in data
+        assert (tmp_path / "installer.iss").read_bytes().startswith(b"\xef\xbb\xbf[Setup]\nAppName=\xc3\x84pp\n")
+
+    def test_variants(self, compiler):
+        installer = Installer(multilingual=False, deterministic=True, extra_iss="[Code]\r\n")
+        text = render_variants(installer, [Variant("pro", files=[FileEntry(source="x", destination="pro/bin")])],
+                               compiler)
+        assert "\r" not in text
+        assert 'DestDir: "{app}\\pro\\bin"' in text
+
+
+class TestFingerprint:
+    def installer(self, **kwargs):
+        files = [FileEntry(source="C:\\src\\app.exe", destination="bin", flags=[FileFlags.IGNORE_VERSION]),
+                 FileEntry(source="C:\\src\\data.bin", destination="data")]
+        return Installer(**{'app_name': "App", 'app_version': "1.0", 'files': files, **kwargs})
+
+    def test_stable(self):
+        assert self.installer().fingerprint() == self.installer().fingerprint()
+        assert len(self.installer().fingerprint()) == 64
+
+    def test_follows_what_is_rendered(self):
+        fingerprints = {self.installer().fingerprint(), self.installer(app_version="1.1").fingerprint(),
+                        self.installer(multilingual=False).fingerprint()}
+        changed = self.installer()
+        changed.files[1].components = "main"
+        fingerprints.add(changed.fingerprint())
+        moved = self.installer()
+        moved.files.reverse()
+        fingerprints.add(moved.fingerprint())
+        with_registry = self.installer()
+        with_registry.registry.add_value("HKLM", "Software\\App", "Path", "{app}")
+        fingerprints.add(with_registry.fingerprint())
+        assert len(fingerprints) == 6
+
+    def test_flags_compared_as_rendered(self):
+        spelled = self.installer()
+        spelled.files[0].flags = "ignoreversion"
+        assert spelled.fingerprint() == self.installer().fingerprint()
+
+    def test_deterministic_separators(self, compiler):
+        posix = self.installer(deterministic=True)
+        posix.files[0].destination = "bin/x64"
+        windows = self.installer(deterministic=True)
+        windows.files[0].destination = "bin\\x64"
+        assert posix.fingerprint() == windows.fingerprint()
+        assert posix.render(compiler) == windows.render(compiler)
+
+    def test_compiler_languages(self, compiler):
+        installer = self.installer(deterministic=True)
+        compiler.languages = LANGUAGES
+        fingerprint = installer.fingerprint(compiler)
+        assert fingerprint != installer.fingerprint()
+        compiler.languages = LANGUAGES[::-1]
+        assert installer.fingerprint(compiler) == fingerprint
@@ -0,0 +1,116 @@
+"""Tests for structured diffs between installers."""
+
+import json
+
+import pytest
+from innosetup_builder import (Component, FileEntry, FileFlags, Installer, RegistryEntry,
+                               diff_installers, diff_scripts, main)
+
+
+@pytest.fixture
+def old():
+    return Installer(
+        app_name="App",
+        app_version="1.0",
+        files=[FileEntry(source="C:\\build\\app.exe", destination="", flags=[FileFlags.IGNORE_VERSION]),
+               FileEntry(source="C:\\build\\old.dll", destination="lib"),
+               FileEntry(source="C:\\build\\readme.txt", destination="", components="main")],
+        registry_entries=[RegistryEntry(subkey="Software\\App", value_type="string", value_name="Path", value_data="{app}"),
+                          RegistryEntry(subkey="Software\\App", value_type="dword", value_name="Count", value_data="1")],
+        components=[Component(name="main", description="Main")],
+    )
+
+
+class TestDiffInstallers:
+    def test_identical_installers(self, old):
+        diff = diff_installers(old, old)
+        assert not diff
+        assert diff.setup == {}
+
+    def test_setup_changes(self, old):
+        new = Installer(app_name="App", app_version="2.0", files=old.files,
+                        registry_entries=old.registry_entries, components=old.components)
+        diff = diff_installers(old, new)
+        assert diff.setup == {'app_version': ("1.0", "2.0")}
+        assert not diff.sections['files']
+
+    def test_files_added_removed_and_changed(self, old):
+        new = Installer(
+            app_name="App", app_version="1.0", registry_entries=old.registry_entries, components=old.components,
+            files=[FileEntry(source="D:\\other\\APP.EXE", destination="", flags="ignoreversion"),
+                   FileEntry(source="C:\\build\\new.dll", destination="lib"),
+                   FileEntry(source="C:\\build\\readme.txt", destination="", components="docs")])
+        files = diff_installers(old, new).sections['files']
+        assert [entry.source for entry in files.added] == ["C:\\build\\new.dll"]
+        assert [entry.source for entry in files.removed] == ["C:\\build\\old.dll"]
+        changed = {change.key: change.changes for change in files.changed}
+        # list and string flags compare equal once normalised
+        assert changed[("", "app.exe")] == {'source': ("C:\\build\\app.exe", "D:\\other\\APP.EXE")}
+        assert changed[("", "readme.txt")] == {'components': ("main", "docs")}
+
+    def test_registry_indexed_by_root_subkey_and_value_name(self, old):
+        new = Installer(
+            app_name="App", app_version="1.0", files=old.files, components=old.components,
+            registry_entries=[RegistryEntry(subkey="Software\\App", value_type="dword", value_name="Count", value_data="2"),
+                              RegistryEntry(subkey="Software\\App", value_type="string", value_name="Path", value_data="{app}")])
+        registry = diff_installers(old, new).sections['registry']
+        assert not registry.added and not registry.removed
+        assert len(registry.changed) == 1
+        assert registry.changed[0].key == ("HKLM", "software\\app", "count")
+        assert registry.changed[0].changes == {'value_data': ("1", "2")}
+
+    def test_payload_growth(self, tmp_path):
+        small = tmp_path / "small.bin"
+        small.write_bytes(b"x" * 10)
+        large = tmp_path / "large.bin"
+        large.write_bytes(b"x" * 1000)
+        diff = diff_installers(Installer(files=[FileEntry(source=str(small), destination="")]),
+                               Installer(files=[FileEntry(source=str(large), destination="")]))
+        assert diff.old_payload_bytes == 10
+        assert diff.new_payload_bytes == 1000
+        assert diff.payload_growth == 990
+
+    def test_generator_backed_installers(self, tmp_path, old):
+        (tmp_path / "app.exe").write_bytes(b"x" * 10)
+        files = [FileEntry(source=str(tmp_path / "app.exe"), destination=""),
+                 FileEntry(source=str(tmp_path / "new.dll"), destination="lib")]
+        diff = diff_installers(Installer(files=(entry for entry in files[:1])),
+                               Installer(files=(entry for entry in files)))
+        assert diff.sections['files'].added == [files[1]]
+        assert diff.old_payload_bytes == diff.new_payload_bytes == 10
+
+    def test_to_dict_is_json_serialisable(self, old):
+        new = Installer(app_name="App 2", files=old.files[:1])
+        data = json.loads(json.dumps(diff_installers(old, new).to_dict()))
+        assert data['setup']['app_name'] == {'old': "App", 'new': "App 2"}
+        assert len(data['sections']['files']['removed']) == 2
+
+
+class TestDiffScripts:
+    def write_scripts(self, tmp_path, old, new, compiler):
+        old_path = tmp_path / "old.iss"
+        new_path = tmp_path / "new.iss"
+        old_path.write_text(old.render(compiler))
+        new_path.write_text(new.render(compiler))
+        return old_path, new_path
+
+    def test_diff_rendered_scripts(self, tmp_path, old, compiler):
+        new = Installer(app_name="App", app_version="1.0", files=old.files[:2],
+                        registry_entries=old.registry_entries, components=old.components)
+        old.multilingual = new.multilingual = False
+        diff = diff_scripts(*self.write_scripts(tmp_path, old, new, compiler))
+        assert [entry.dest_name or entry.source for entry in diff.sections['files'].removed] == ["C:\\build\\readme.txt"]
+
+    def test_cli_flags_payload_growth(self, tmp_path, capsys, compiler):
+        payload = tmp_path / "payload.bin"
+        payload.write_bytes(b"x" * 100)
+        extra = tmp_path / "extra.bin"
+        extra.write_bytes(b"x" * 100)
+        old = Installer(app_name="App", multilingual=False, files=[FileEntry(source=str(payload), destination="")])
+        new = Installer(app_name="App", multilingual=False, files=[FileEntry(source=str(payload), destination=""),
+                                                                   FileEntry(source=str(extra), destination="")])
+        old_path, new_path = self.write_scripts(tmp_path, old, new, compiler)
+        assert main(["diff", str(old_path), str(new_path), "--max-growth-percent", "150"]) == 0
+        assert main(["diff", str(old_path), str(new_path), "--max-growth-percent", "50"]) == 1
+        assert main(["diff", str(old_path), str(new_path), "--max-growth-bytes", "10", "--json"]) == 1
+        assert "more than 10" in capsys.readouterr().err
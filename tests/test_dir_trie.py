@@ -0,0 +1,58 @@
+"""Tests for generating [Dirs] from a destination trie."""
+
+import pytest
+from innosetup_builder import DestinationTrie, DirEntry, FileEntry, Installer, all_files
+
+
+@pytest.fixture
+def tree(write_tree):
+    return write_tree({"bin/app.exe": "app", "logs/": None, "cache/thumbnails/": None, "cache/index/db.bin": "db",
+                       "data/readme.txt": "readme"}, root="dist")
+
+
+class TestDestinationTrie:
+    def test_scan_records_empty_directories(self, tree):
+        trie = DestinationTrie()
+        files = list(all_files(tree, trie=trie))
+        assert len(files) == 3
+        assert trie.root.children['bin'].files == 1
+        assert trie.root.children['logs'].files == 0
+        # only empty leaves need a [Dirs] row; "cache" is created by its subdirectories
+        assert trie.dir_entries() == [DirEntry(name="{app}\\cache\\thumbnails"), DirEntry(name="{app}\\logs")]
+
+    def test_scan_without_trie_unchanged(self, tree):
+        assert len(list(all_files(tree))) == 3
+
+    def test_permissions(self, tree):
+        trie = DestinationTrie()
+        list(all_files(tree, trie=trie))
+        entries = trie.dir_entries(permissions={'Data': "users-modify", 'logs': "users-modify",
+                                                'extra/plugins': "users-readexec"})
+        assert entries == [DirEntry(name="{app}\\cache\\thumbnails"),
+                           DirEntry(name="{app}\\data", permissions="users-modify"),
+                           DirEntry(name="{app}\\logs", permissions="users-modify"),
+                           DirEntry(name="{app}\\extra\\plugins", permissions="users-readexec")]
+
+    def test_existing_dirs_skipped(self, tree):
+        trie = DestinationTrie()
+        list(all_files(tree, trie=trie))
+        assert trie.dir_entries(existing=[DirEntry(name="{app}\\LOGS", permissions="everyone-full")]) == [
+            DirEntry(name="{app}\\cache\\thumbnails")]
+
+    def test_post_pass_over_installer_files(self):
+        files = [FileEntry(source="a.exe", destination=""), FileEntry(source="b.dll", destination="lib\\x86"),
+                 FileEntry(source="c.dll", destination="Lib\\X86")]
+        trie = DestinationTrie.from_files(files)
+        assert trie.root.children['lib'].children['x86'].files == 2
+        assert trie.root.children['lib'].name == "lib"
+        assert trie.dir_entries() == []
+        assert trie.dir_entries(permissions={'lib': "users-modify"}) == [
+            DirEntry(name="{app}\\lib", permissions="users-modify")]
+
+    def test_rendered(self, tree, compiler):
+        trie = DestinationTrie()
+        installer = Installer(app_name="App", multilingual=False, files=list(all_files(tree, trie=trie)))
+        installer.dirs.extend(trie.dir_entries())
+        lines = [line for line in installer.render(compiler).splitlines() if line]
+        start = lines.index("[Dirs]")
+        assert lines[start + 1:start + 3] == ['Name: "{app}\\cache\\thumbnails"', 'Name: "{app}\\logs"']
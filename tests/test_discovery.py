@@ -0,0 +1,150 @@
+"""Tests for Inno Setup compiler discovery."""
+
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+import innosetup_builder
+from innosetup_builder import Installer, InnosetupCompiler, discover_compiler, probe_compiler_version
+
+from tests.benchmark import make_stand_in_iscc
+
+
+@pytest.fixture
+def no_system_compiler(tmp_path, monkeypatch):
+    """Hide any Wine prefix or ISCC on PATH of the machine running the tests."""
+    monkeypatch.setenv("WINEPREFIX", str(tmp_path / "empty-prefix"))
+    monkeypatch.setenv("PATH", str(tmp_path / "empty-bin"))
+
+
+def make_executable(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+class TestDiscovery:
+    def test_environment_override_directory(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("INNOSETUP_PATH", str(tmp_path))
+        discovery = discover_compiler()
+        assert discovery.base_path == str(tmp_path)
+        assert discovery.source == "environment"
+
+    def test_environment_override_compiler_file(self, tmp_path, monkeypatch):
+        compiler = make_stand_in_iscc(tmp_path / "innosetup")
+        monkeypatch.setenv("INNOSETUP_PATH", str(compiler))
+        assert InnosetupCompiler().base_path == str(tmp_path / "innosetup")
+
+    def test_nothing_found(self, no_system_compiler):
+        discovery = discover_compiler()
+        assert discovery.base_path is None
+        assert InnosetupCompiler().base_path is None
+
+    def test_found_on_path(self, tmp_path, monkeypatch, no_system_compiler):
+        make_executable(tmp_path / "bin" / "ISCC", "#!/bin/sh\n")
+        monkeypatch.setenv("PATH", str(tmp_path / "bin"))
+        discovery = discover_compiler()
+        assert discovery.source == "path"
+        assert discovery.base_path == str(tmp_path / "bin")
+        assert InnosetupCompiler().compiler_path == tmp_path / "bin" / "ISCC"
+
+    def test_found_in_wine_prefix(self, tmp_path, monkeypatch, no_system_compiler):
+        base_path = tmp_path / "prefix" / "drive_c" / "Program Files (x86)" / "Inno Setup 6"
+        base_path.mkdir(parents=True)
+        (base_path / "ISCC.exe").write_bytes(b"MZ\x90\x00")
+        monkeypatch.setenv("WINEPREFIX", str(tmp_path / "prefix"))
+        discovery = discover_compiler()
+        assert discovery.source == "wine"
+        assert discovery.base_path == str(base_path)
+
+    def test_discovery_runs_once_per_process(self, tmp_path, monkeypatch, no_system_compiler):
+        calls = []
+
+        def fake_find_on_path():
+            calls.append(1)
+            return str(tmp_path)
+
+        monkeypatch.setattr(innosetup_builder, "_find_on_path", fake_find_on_path)
+        compilers = [InnosetupCompiler() for _ in range(5)]
+        assert all(compiler.base_path == str(tmp_path) for compiler in compilers)
+        assert len(calls) == 1
+
+    def test_disk_cache_reused_by_next_process(self, tmp_path, monkeypatch, no_system_compiler):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        monkeypatch.setenv("PATH", str(tmp_path / "innosetup"))
+        monkeypatch.setattr(innosetup_builder, "_find_on_path", lambda: str(tmp_path / "innosetup"))
+        assert discover_compiler().source == "path"
+        # a new process starts with an empty in-memory cache
+        discover_compiler.cache_clear()
+        monkeypatch.setattr(innosetup_builder, "_find_on_path", lambda: None)
+        discovery = discover_compiler()
+        assert discovery.source == "cache"
+        assert discovery.base_path == str(tmp_path / "innosetup")
+
+    def test_disk_cache_ignored_when_compiler_removed(self, tmp_path, no_system_compiler):
+        cache_path = tmp_path / "discovery" / "compiler.json"
+        cache_path.parent.mkdir(parents=True)
+        cache_path.write_text(json.dumps({'base_path': str(tmp_path / "gone")}))
+        assert discover_compiler().base_path is None
+
+    def test_disk_cache_can_be_disabled(self, tmp_path, monkeypatch, no_system_compiler):
+        monkeypatch.setenv("INNOSETUP_DISCOVERY_CACHE", "")
+        monkeypatch.setattr(innosetup_builder, "_find_on_path", lambda: str(tmp_path))
+        discover_compiler()
+        assert not (tmp_path / "discovery").exists()
+
+    def test_registry_keys_are_well_formed(self):
+        for key in innosetup_builder.INNOSETUP_REGISTRY_KEYS:
+            assert " \\" not in key
+            assert "\\\\" not in key
+
+
+class TestVersionProbe:
+    def test_version_probed_from_compiler(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        assert compiler.version == "6.2.2"
+
+    def test_version_cached_on_disk(self, tmp_path):
+        iscc = make_stand_in_iscc(tmp_path / "innosetup")
+        assert probe_compiler_version(str(iscc)) == "6.2.2"
+        probe_compiler_version.cache_clear()
+        # an unchanged compiler is not run again
+        mtime = iscc.stat().st_mtime_ns
+        iscc.write_text(iscc.read_text().replace("6.2.2", "9.9.9"))
+        os.utime(str(iscc), ns=(mtime, mtime))
+        assert probe_compiler_version(str(iscc)) == "6.2.2"
+
+    def test_version_none_without_installation(self):
+        assert InnosetupCompiler(base_path=None).version is None
+
+
+class TestCompilerCommand:
+    def test_native_or_script_compiler_runs_directly(self, tmp_path):
+        iscc = make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        assert compiler.compiler_command == [str(iscc)]
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Wine is only used off Windows")
+    def test_windows_compiler_runs_under_wine(self, tmp_path, monkeypatch):
+        base_path = tmp_path / "innosetup"
+        base_path.mkdir()
+        (base_path / "ISCC.exe").write_bytes(b"MZ\x90\x00")
+        log = tmp_path / "wine.log"
+        wine = make_executable(tmp_path / "wine", '#!/bin/sh\nprintf "%s\\n" "$@" > "{}"\n'.format(log))
+        monkeypatch.setenv("INNOSETUP_WINE", str(wine))
+        compiler = InnosetupCompiler(base_path=str(base_path))
+        assert compiler.compiler_command == [str(wine), str(base_path / "ISCC.exe")]
+        compiler.build(Installer(app_name="Test App", multilingual=False), tmp_path / "installer.exe")
+        arguments = log.read_text().split()
+        assert arguments[0] == str(base_path / "ISCC.exe")
+        assert arguments[2].startswith("/OZ:\\")
+        assert arguments[3].startswith("Z:\\")
+
+    def test_build_without_installation_raises(self):
+        with pytest.raises(FileNotFoundError):
+            InnosetupCompiler(base_path=None).build(Installer(app_name="Test App"))
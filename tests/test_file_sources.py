@@ -0,0 +1,121 @@
+"""Tests for lazily produced Installer.files."""
+
+import tracemalloc
+
+import pytest
+from innosetup_builder import (BuildHistory, BuildScheduler, FileEntry, FileSource, FileSourceConsumedError, Installer,
+                               InnosetupCompiler, LocalArtifactStore, validate_installer)
+
+from tests.benchmark import make_stand_in_iscc
+
+
+@pytest.fixture
+def roots(write_tree):
+    names = ("app/app.exe", "app/readme.txt", "data/voices/en.bin", "data/notes.txt")
+    root = write_tree({name: b"x" * 10 for name in names})
+    return root / "app", root / "data"
+
+
+def generated(count):
+    for index in range(count):
+        yield FileEntry(source="C:\\src\\file{}.dll".format(index), destination="bin{}".format(index % 10))
+
+
+class TestFileSource:
+    def test_generator_read_once(self, compiler):
+        installer = Installer(multilingual=False, files=(entry for entry in generated(3)))
+        assert isinstance(installer.files, FileSource)
+        assert installer.render(compiler) == Installer(multilingual=False, files=list(generated(3))).render(compiler)
+        with pytest.raises(FileSourceConsumedError):
+            installer.render(compiler)
+
+    def test_rescan_chained_roots(self, roots, compiler):
+        source = FileSource.scan(*roots, where=lambda entry: not entry.source.endswith(".txt"), deterministic=True)
+        installer = Installer(multilingual=False, files=source)
+        first = installer.render(compiler)
+        assert installer.render(compiler) == first
+        assert source.scans == 2
+        assert first.count("Source: ") == 2
+        assert 'DestDir: "{app}\\voices"' in first
+
+    def test_cache(self, compiler):
+        source = FileSource(generated(5), passes="cache")
+        installer = Installer(multilingual=False, files=source)
+        assert installer.render(compiler) == installer.render(compiler)
+        assert source.scans == 1
+        assert len(list(source)) == 5
+
+    def test_empty_source(self, compiler):
+        assert (Installer(multilingual=False, files=FileSource(iter([]))).render(compiler)
+                == Installer(multilingual=False).render(compiler))
+
+    def test_policies_checked(self):
+        with pytest.raises(ValueError):
+            FileSource(generated(1), passes="rescan")
+        with pytest.raises(ValueError):
+            FileSource(lambda: generated(1), passes="sometimes")
+
+    def test_lists_and_tuples_stay_lists(self):
+        assert Installer(files=(FileEntry(source="a"),)).files == [FileEntry(source="a")]
+
+    def test_fingerprint_and_validation_take_one_pass(self):
+        listed = Installer(files=list(generated(3)))
+        assert Installer(files=generated(3)).fingerprint() == listed.fingerprint()
+        assert validate_installer(Installer(files=generated(3)), check_sources=False) == []
+
+
+class TestStreamingRender:
+    def test_render_to(self, compiler, tmp_path):
+        installer = Installer(multilingual=False, deterministic=True, extra_iss="[Code]\r\n",
+                              files=FileSource(lambda: generated(20), passes="rescan"))
+        installer.render_to(compiler, tmp_path / "setup.iss")
+        data = (tmp_path / "setup.iss").read_bytes()
+        assert data == installer.render(compiler).encode('utf-8-sig')
+        assert b"\r" not in data
+
+    def test_constant_memory(self, compiler, tmp_path):
+        Installer(multilingual=False, files=generated(10)).render_to(compiler, tmp_path / "warm.iss")
+        tracemalloc.start()
+        try:
+            Installer(multilingual=False, files=generated(20000)).render_to(compiler, tmp_path / "setup.iss")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert (tmp_path / "setup.iss").read_text().count("Source: ") == 20000
+        assert peak < 512 * 1024
+
+
+class TestBuild:
+    def test_build_streams_the_files(self, roots, tmp_path, monkeypatch):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        monkeypatch.setenv("STAND_IN_ISCC_SAVE", "1")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        installer = Installer(app_name="App", multilingual=False, files=FileSource.scan(*roots))
+        compiler.build(installer, tmp_path / "setup.exe")
+        assert (tmp_path / "setup.exe.iss").read_text().count("Source: ") == 4
+        assert installer.files.scans == 1
+
+    def test_metrics_counted_while_streaming(self, roots, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        history = BuildHistory(tmp_path / "builds.sqlite")
+        compiler.build(Installer(app_name="App", multilingual=False, files=generated(2)), tmp_path / "setup.exe",
+                       history=history)
+        source = FileSource.scan(*roots)
+        compiler.build(Installer(app_name="App", multilingual=False, files=source), tmp_path / "setup.exe",
+                       history=history, scheduler=BuildScheduler(cpus=1))
+        assert [(record.file_count, record.source_bytes) for record in history.records("App")] == [(4, 40), (2, 0)]
+        assert source.scans == 1
+
+    def test_second_pass_refused_before_compiling(self, roots, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        for options in ({'validate': True}, {'store': LocalArtifactStore(tmp_path / "store")}):
+            installer = Installer(app_name="App", multilingual=False, files=generated(2))
+            with pytest.raises(FileSourceConsumedError):
+                compiler.build(installer, tmp_path / "setup.exe", **options)
+            assert installer.files.scans == 0
+            assert not (tmp_path / "setup.exe").exists()
+        installer = Installer(app_name="App", multilingual=False, files=FileSource.scan(*roots, passes="cache"))
+        compiler.build(installer, tmp_path / "setup.exe", validate=True)
+        assert installer.files.scans == 1
@@ -0,0 +1,109 @@
+"""Tests for rendering an installer as #include fragments."""
+
+import json
+import os
+
+import pytest
+from innosetup_builder import (Component, DirEntry, FileEntry, Installer, InnosetupCompiler, RegistryEntry, RunEntry,
+                               render_fragments)
+
+from tests.benchmark import make_stand_in_iscc
+
+
+def include(text, directory):
+    """Inline #include lines the way ISPP does, dropping blank lines ISCC ignores anyway."""
+    lines = []
+    for line in text.splitlines():
+        if line.startswith('#include "'):
+            lines.extend(include((directory / line[len('#include "'):-1]).read_text(), directory))
+        elif line:
+            lines.append(line)
+    return lines
+
+
+def lines(text):
+    return [line for line in text.splitlines() if line]
+
+
+@pytest.fixture
+def installer():
+    return Installer(
+        app_name="App",
+        multilingual=False,
+        components=[Component(name="main"), Component(name="help\\english")],
+        files=[FileEntry(source="app.exe", destination="", components="main"),
+               FileEntry(source="help.chm", destination="help", components="help\\english"),
+               FileEntry(source="lib.dll", destination="lib", components="main"),
+               FileEntry(source="readme.txt", destination="")],
+        dirs=[DirEntry(name="{app}\\logs", components="main")],
+        registry_entries=[RegistryEntry(subkey="Software\\App", components="main")],
+        run_entries=[RunEntry(filename="{app}\\app.exe")],
+    )
+
+
+class TestRenderFragments:
+    def test_sections(self, installer, tmp_path, compiler):
+        result = installer.render_fragments(compiler, tmp_path)
+        assert sorted(result.written) == ["components.iss", "dirs.iss", "files.iss", "installer.iss",
+                                          "registry.iss", "run.iss"]
+        script = result.script_path.read_text()
+        assert '#include "files.iss"\n' in script
+        assert "[Files]" not in script
+        # inlining the fragments gives back the monolithic script
+        assert include(script, tmp_path) == lines(installer.render(compiler))
+
+    def test_components(self, installer, tmp_path, compiler):
+        result = render_fragments(installer, compiler, tmp_path, shard_by="component")
+        # [Components] stays in the main script, [Run] keeps its order in its own fragment
+        assert sorted(result.written) == ["component-common.iss", "component-help-english.iss", "component-main.iss",
+                                          "installer.iss", "run.iss"]
+        main = (tmp_path / "component-main.iss").read_text()
+        assert main.count("Components: main") == 4
+        assert "[Files]" in main and "[Dirs]" in main and "[Registry]" in main
+        assert "help.chm" not in main
+        # every row is still there, grouped by component
+        script = include(result.script_path.read_text(), tmp_path)
+        rows = [line for line in lines(installer.render(compiler)) if not line.startswith("[")]
+        assert sorted(line for line in script if not line.startswith("[")) == sorted(rows)
+
+    def test_unchanged_fragments_not_rewritten(self, installer, tmp_path, compiler):
+        installer.render_fragments(compiler, tmp_path)
+        files_stat = (tmp_path / "files.iss").stat()
+        installer.run_entries.append(RunEntry(filename="{app}\\setup.exe"))
+        result = installer.render_fragments(compiler, tmp_path)
+        assert result.written == ["run.iss"]
+        assert "files.iss" in result.unchanged and "installer.iss" in result.unchanged
+        assert (tmp_path / "files.iss").stat().st_mtime_ns == files_stat.st_mtime_ns
+        assert set(json.loads((tmp_path / ".fragments.json").read_text())) == set(result.written + result.unchanged)
+
+    def test_edited_fragment_without_manifest_change_rewritten(self, installer, tmp_path, compiler):
+        installer.render_fragments(compiler, tmp_path)
+        os.remove(str(tmp_path / "files.iss"))
+        assert installer.render_fragments(compiler, tmp_path).written == ["files.iss"]
+
+    def test_stale_fragments_removed(self, installer, tmp_path, compiler):
+        installer.render_fragments(compiler, tmp_path)
+        installer.dirs = []
+        result = installer.render_fragments(compiler, tmp_path)
+        assert result.removed == ["dirs.iss"]
+        assert not (tmp_path / "dirs.iss").exists()
+        assert "dirs.iss" not in result.script_path.read_text()
+
+    def test_colliding_component_names(self, tmp_path, compiler):
+        installer = Installer(multilingual=False, files=[FileEntry(source="a", destination="", components="a\\b"),
+                                                         FileEntry(source="b", destination="", components="a_b")])
+        result = installer.render_fragments(compiler, tmp_path, shard_by="component")
+        assert len([name for name in result.written if name.startswith("component-")]) == 2
+
+    def test_unknown_shard_by(self, installer, tmp_path, compiler):
+        with pytest.raises(ValueError):
+            installer.render_fragments(compiler, tmp_path, shard_by="size")
+
+
+class TestBuildFragments:
+    def test_build_compiles_main_script(self, installer, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        compiler.build(installer, tmp_path / "installer.exe", fragments_dir=tmp_path / "script")
+        assert (tmp_path / "installer.exe").read_bytes().startswith(b"MZ")
+        assert (tmp_path / "script" / "files.iss").exists()
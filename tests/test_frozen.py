@@ -0,0 +1,113 @@
+"""Tests for the frozen entry variants and their cached rows."""
+
+import attr
+import pytest
+import innosetup_builder
+from innosetup_builder import (Component, ComponentType, DirEntry, FileEntry, FileFlags, FrozenComponent,
+                               FrozenEntry, FrozenFileEntry, FrozenRegistryEntry, Installer, RegistryEntry, RunEntry,
+                               UninstallRunEntry, Variant, freeze, render_variants, size_rollup)
+
+
+def make_installer():
+    installer = Installer(
+        app_name="App", multilingual=False,
+        files=[FileEntry(source="C:\\src\\app.exe", destination="", flags=[FileFlags.IGNORE_VERSION]),
+               FileEntry(source="C:\\src\\core.dll", destination="bin", components="main")],
+        registry_entries=[RegistryEntry(root="HKCU", subkey="Software\\App", value_type="string",
+                                        value_name="Path", value_data="{app}")],
+        run_entries=[RunEntry(filename="{app}\\app.exe", flags="nowait")],
+        uninstall_run_entries=[UninstallRunEntry(filename="{app}\\cleanup.exe", runonce_id="cleanup")],
+        dirs=[DirEntry(name="{app}\\logs")],
+        component_types=[ComponentType(name="full", description="Full")],
+        components=[Component(name="main", description="Main", types="full")])
+    installer.registry.add_value("HKLM", "Software\\App", "Version", "1.0")
+    return installer
+
+
+class TestFrozenEntries:
+    def test_immutable_and_hashable(self):
+        entry = FrozenFileEntry(source="a.exe", destination="bin", flags=[FileFlags.IGNORE_VERSION])
+        assert entry.flags == "ignoreversion"
+        assert entry == freeze(FileEntry(source="a.exe", destination="bin", flags="ignoreversion"))
+        assert len({entry, FrozenFileEntry(source="a.exe", destination="bin", flags="ignoreversion")}) == 1
+        with pytest.raises(attr.exceptions.FrozenInstanceError):
+            entry.source = "b.exe"
+        assert attr.evolve(entry, source="b.exe").source == "b.exe"
+
+    def test_freeze(self):
+        entry = freeze(RegistryEntry(subkey="Software\\App"))
+        assert isinstance(entry, FrozenRegistryEntry) and isinstance(entry, RegistryEntry)
+        assert freeze(entry) is entry
+        assert isinstance(freeze(Component(name="main")), FrozenComponent)
+
+    def test_renders_like_mutable_entries(self, compiler):
+        installer = make_installer()
+        frozen = installer.frozen()
+        assert all(isinstance(entry, FrozenEntry) for entry in frozen.files + frozen.components)
+        assert frozen.render(compiler) == installer.render(compiler)
+        # frozen and mutable entries may be mixed
+        frozen.files.append(FileEntry(source="C:\\src\\extra.txt", destination="docs"))
+        installer.files.append(FileEntry(source="C:\\src\\extra.txt", destination="docs"))
+        assert frozen.render(compiler) == installer.render(compiler)
+        assert frozen.fingerprint() == installer.fingerprint()
+
+    def test_rows_rendered_once(self, compiler, monkeypatch):
+        frozen = make_installer().frozen()
+        frozen.render(compiler)
+        rendered = []
+        rows_template = innosetup_builder.get_rows_template
+
+        class Counting:
+            def __init__(self, section):
+                self.template = rows_template(section)
+
+            def render(self, **kwargs):
+                rendered.append(list(kwargs['entries']))
+                return self.template.render(**kwargs)
+
+        monkeypatch.setattr(innosetup_builder, "get_rows_template", Counting)
+        frozen.files[1] = attr.evolve(frozen.files[1], destination="lib")
+        text = frozen.render(compiler)
+        assert 'DestDir: "{app}\\lib"' in text
+        # the changed entry, and the registry tree's rows which are built on every render
+        assert [entries for entries in rendered if not isinstance(entries[0], RegistryEntry)] == [[frozen.files[1]]]
+
+    def test_uncached_rows_rendered_together(self, compiler, monkeypatch):
+        files = [FrozenFileEntry(source="C:\\src\\{}.dll".format(index), destination="bin") for index in range(50)]
+        files.append(FrozenFileEntry(source="C:\\src\\odd\nname.dll", destination="bin"))
+        installer = Installer(multilingual=False, files=files)
+        passes = []
+        rows_template = innosetup_builder.get_rows_template
+        monkeypatch.setattr(innosetup_builder, "get_rows_template",
+                            lambda section: passes.append(section) or rows_template(section))
+        text = installer.render(compiler)
+        assert passes == ['files']
+        # a line break cannot be split apart again, so the rows fell back to one render each
+        assert [entry.line for entry in files[:2]] == ['Source: "C:\\src\\0.dll"; DestDir: "{app}\\bin"',
+                                                       'Source: "C:\\src\\1.dll"; DestDir: "{app}\\bin"']
+        assert text == Installer(multilingual=False, files=[FileEntry(**attr.asdict(entry)) for entry in files]).render(
+            compiler)
+
+    def test_fragments_and_variants(self, compiler, tmp_path):
+        installer = make_installer()
+        frozen = installer.frozen()
+        installer.render_fragments(compiler, tmp_path / "mutable")
+        frozen.render_fragments(compiler, tmp_path / "frozen")
+        for name in ("files.iss", "registry.iss", "installer.iss"):
+            assert (tmp_path / "frozen" / name).read_text() == (tmp_path / "mutable" / name).read_text()
+        variants = [Variant("pro", files=[FileEntry(source="C:\\src\\pro.dll", destination="")])]
+        frozen_variants = [Variant("pro", files=[freeze(entry) for entry in variants[0].files])]
+        assert (render_variants(frozen, frozen_variants, compiler)
+                == render_variants(installer, variants, compiler))
+
+    def test_size_rollup_replaces_frozen_entries(self, tmp_path):
+        (tmp_path / "tool.exe").write_bytes(b"x" * 10)
+        installer = Installer(files=[FrozenFileEntry(source=str(tmp_path / "tool.exe"), destination="",
+                                                     flags="external", components="main")],
+                              components=[FrozenComponent(name="main")])
+        size_rollup(installer, fill_external_size=True)
+        assert installer.files[0].external_size == "10"
+        assert isinstance(installer.files[0], FrozenFileEntry)
+        installer.files[0] = attr.evolve(installer.files[0], external_size="")
+        size_rollup(installer, fill_extra_disk_space=True)
+        assert installer.components[0].extra_disk_space_required == "10"
@@ -0,0 +1,113 @@
+"""Tests for the build metrics history."""
+
+import threading
+
+import pytest
+from innosetup_builder import (BuildHistory, BuildRecord, BuildRegressionWarning, FileEntry, Installer,
+                               InnosetupCompiler, compression_settings)
+
+from tests.benchmark import make_stand_in_iscc
+
+SETTINGS = "compression=lzma2/ultra"
+
+
+def compiled(seconds, source_bytes=1000, output_bytes=500, finished=0.0, **kwargs):
+    return BuildRecord(installer="App", compile_seconds=seconds, source_bytes=source_bytes, output_bytes=output_bytes,
+                       compression=SETTINGS, finished=finished, **kwargs)
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = BuildHistory(tmp_path / "builds.sqlite", min_builds=5)
+    for index in range(10):
+        history.record(compiled(10.0 + index, finished=float(index)))
+    return history
+
+
+class TestCompressionSettings:
+    def test_template_and_extra_iss(self):
+        assert compression_settings(Installer()) == SETTINGS
+        installer = Installer(extra_iss="[Setup]\nCompression=LZMA2/Max\nSolidCompression=yes\n")
+        assert compression_settings(installer) == "compression=lzma2/max; solidcompression=yes"
+
+
+class TestBuildHistory:
+    def test_records_newest_first(self, history):
+        records = history.records("App", limit=3)
+        assert [record.compile_seconds for record in records] == [19.0, 18.0, 17.0]
+        assert records[0].compression == SETTINGS
+        assert history.records("Other") == []
+
+    def test_percentiles(self, history):
+        assert history.percentiles("App") == {'p50': 14.0, 'p95': 19.0}
+        assert history.percentiles("App", metric='output_bytes', percents=(50,)) == {'p50': 500}
+        assert history.percentiles("Other") == {'p50': None, 'p95': None}
+        with pytest.raises(ValueError):
+            history.percentiles("App", metric='compression')
+
+    def test_cached_builds_not_counted(self, history):
+        history.record(compiled(0.0, cached=True, finished=20.0))
+        assert history.percentiles("App")['p50'] == 14.0
+        assert history.records("App", cached=True)[0].cached is True
+
+    def test_window(self, tmp_path):
+        history = BuildHistory(tmp_path / "builds.sqlite", window=2)
+        for index, seconds in enumerate((100.0, 1.0, 2.0)):
+            history.record(compiled(seconds, finished=float(index)))
+        assert history.percentiles("App", percents=(100,)) == {'p100': 2.0}
+
+    def test_slow_build_alert_scales_with_payload(self, history):
+        # twice the payload takes about twice as long
+        assert history.check(compiled(29.0, source_bytes=2000, output_bytes=1000)) == []
+        alerts = history.check(compiled(29.0))
+        assert [alert.metric for alert in alerts] == ['compile_seconds']
+        assert alerts[0].expected == pytest.approx(14.5)
+        assert "App: compile_seconds was 29" in str(alerts[0])
+
+    def test_larger_output_alert(self, history):
+        alerts = history.check(compiled(14.0, output_bytes=700))
+        assert [alert.metric for alert in alerts] == ['output_bytes']
+
+    def test_needs_enough_builds_with_the_same_settings(self, history, tmp_path):
+        record = compiled(100.0)
+        record.compression = "compression=zip"
+        assert history.check(record) == []
+        assert BuildHistory(tmp_path / "empty.sqlite").check(compiled(100.0)) == []
+
+    def test_concurrent_writers(self, tmp_path):
+        history = BuildHistory(tmp_path / "builds.sqlite")
+
+        def write():
+            for _ in range(25):
+                BuildHistory(tmp_path / "builds.sqlite").record(compiled(1.0))
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        assert len(history.records("App")) == 100
+
+
+class TestBuildRecording:
+    def test_build_records_metrics(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        (tmp_path / "app.exe").write_bytes(b"MZ" * 50)
+        installer = Installer(app_name="App", multilingual=False,
+                              files=[FileEntry(source=str(tmp_path / "app.exe"), destination="")])
+        history = BuildHistory(tmp_path / "builds.sqlite", min_builds=1)
+        compiler.build(installer, tmp_path / "installer.exe", history=history)
+        record = history.records("App")[0]
+        assert (record.file_count, record.source_bytes, record.output_bytes) == (1, 100, 34)
+        assert record.compile_seconds > 0 and record.render_seconds > 0
+        assert record.compression == SETTINGS
+        assert not (tmp_path / "installer.exe.profile.json").exists()
+
+    def test_regression_warning(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        history = BuildHistory(tmp_path / "builds.sqlite", min_builds=1)
+        history.record(BuildRecord(installer="App", compile_seconds=1e-6, output_bytes=34, compression=SETTINGS))
+        with pytest.warns(BuildRegressionWarning, match="compile_seconds"):
+            compiler.build(Installer(app_name="App", multilingual=False), tmp_path / "installer.exe", history=history)
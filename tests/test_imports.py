@@ -0,0 +1,35 @@
+"""Tests for import-time behaviour: heavy modules are loaded lazily."""
+
+import subprocess
+import sys
+
+import innosetup_builder
+from innosetup_builder import Installer, InnosetupCompiler
+
+
+def modules_after_import() -> set:
+    """Import innosetup_builder in a fresh interpreter and return sys.modules."""
+    output = subprocess.check_output(
+        [sys.executable, "-c", "import sys, innosetup_builder; print('\\n'.join(sys.modules))"],
+        text=True)
+    return set(output.split())
+
+
+class TestLazyImports:
+    def test_heavy_modules_not_imported(self):
+        modules = modules_after_import()
+        assert "innosetup_builder" in modules
+        for name in ("jinja2", "subprocess", "tempfile", "cProfile", "tracemalloc"):
+            assert name not in modules
+
+    def test_template_compiled_once(self):
+        assert innosetup_builder.get_template() is innosetup_builder.get_template()
+
+    def test_render_still_works(self):
+        installer = Installer(app_name="Test App", multilingual=False)
+        assert "AppName=Test App" in installer.render(InnosetupCompiler(base_path=None))
+
+    def test_str_enum_formats_as_value(self):
+        assert str(innosetup_builder.FileFlags.IGNORE_VERSION) == "ignoreversion"
+        assert "{}".format(innosetup_builder.FileFlags.SIGN) == "sign"
+
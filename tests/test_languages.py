@@ -0,0 +1,82 @@
+"""Tests for the language catalogue and language selection."""
+
+import os
+
+import pytest
+from innosetup_builder import Installer, InnosetupCompiler
+
+import innosetup_builder
+from tests.benchmark import make_stand_in_iscc
+
+
+@pytest.fixture
+def compiler(tmp_path):
+    base_path = tmp_path / "innosetup"
+    make_stand_in_iscc(base_path)
+    languages = base_path / "Languages"
+    languages.mkdir()
+    (languages / "German.isl").write_text("x" * 100)
+    (languages / "French.isl").write_text("x" * 200)
+    (languages / "Dutch.isl").write_text("x" * 300)
+    (languages / "readme.txt").write_text("not a language")
+    return InnosetupCompiler(base_path=str(base_path))
+
+
+class TestLanguageIndex:
+    def test_languages_sorted_with_sizes(self, compiler):
+        languages = list(compiler.available_languages())
+        assert [language['name'] for language in languages] == ["Dutch", "French", "German"]
+        assert languages[1]['size_bytes'] == 200
+        assert languages[1]['messages_file'] == "compiler:" + os.path.join("Languages", "French.isl")
+
+    def test_index_cached_until_directory_changes(self, compiler, monkeypatch):
+        list(compiler.available_languages())
+        scans = []
+        real_scandir = os.scandir
+
+        def counting_scandir(path):
+            scans.append(path)
+            return real_scandir(path)
+
+        monkeypatch.setattr(innosetup_builder.os, "scandir", counting_scandir)
+        list(compiler.available_languages())
+        assert scans == []
+        (compiler.languages_path / "Spanish.isl").write_text("x")
+        # make sure the directory mtime moves even on coarse-grained filesystems
+        stat = compiler.languages_path.stat()
+        os.utime(str(compiler.languages_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        names = [language['name'] for language in compiler.available_languages()]
+        assert "Spanish" in names
+        assert len(scans) == 1
+
+
+class TestLanguageSelection:
+    def test_all_languages_by_default(self, compiler):
+        result = Installer(app_name="Test App").render(compiler)
+        assert 'Name: "Dutch"' in result
+        assert 'Name: "French"' in result
+        assert 'Name: "German"' in result
+
+    def test_subset_of_languages(self, compiler):
+        result = Installer(app_name="Test App", languages=["german"]).render(compiler)
+        assert 'MessagesFile: "compiler:Default.isl"; Name: "Default"' in result
+        assert 'Name: "German"' in result
+        assert 'Name: "French"' not in result
+
+    def test_empty_subset_keeps_default_only(self, compiler):
+        result = Installer(app_name="Test App", languages=[]).render(compiler)
+        assert 'Name: "Default"' in result
+        assert 'Name: "German"' not in result
+
+    def test_unknown_language_rejected(self, compiler):
+        with pytest.raises(ValueError, match="Klingon"):
+            Installer(app_name="Test App", languages=["Klingon"]).render(compiler)
+
+
+class TestLanguageImpact:
+    def test_impact_reported_per_language(self, compiler, tmp_path):
+        installer = Installer(app_name="Test App", main_executable="app.exe")
+        report = compiler.language_impact(installer, tmp_path / "impact", languages=["French", "German"])
+        assert [row['name'] for row in report] == ["French", "German"]
+        assert report[0]['size_bytes'] == 200
+        assert set(report[0]) == {'name', 'size_bytes', 'installer_bytes', 'compile_seconds'}
@@ -0,0 +1,118 @@
+"""Tests for exporting build metrics to Prometheus textfiles and JSON."""
+
+import json
+import re
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+from innosetup_builder import FileSource, Installer, InnosetupCompiler, LocalArtifactStore, MetricsExporter, all_files
+
+from tests.benchmark import make_stand_in_iscc
+
+SAMPLE = re.compile(r'^[a-z_]+\{([a-z]+="(?:[^"\\]|\\.)*",?)+\} [0-9.e+-]+$')
+
+
+def samples(text):
+    lines = [line for line in text.splitlines() if not line.startswith("#")]
+    assert all(SAMPLE.match(line) for line in lines), lines
+    return {line.rpartition(" ")[0]: float(line.rpartition(" ")[2]) for line in lines}
+
+
+class TestMetricsExporter:
+    def test_counters_and_histograms(self, tmp_path):
+        exporter = MetricsExporter(tmp_path / "innosetup.prom", tmp_path / "metrics.json", buckets=(1, 10))
+        exporter.record_build("App", {'render': 0.5, 'compile': 5.0}, files=3, bytes_in=300, bytes_out=100,
+                              cache_hit=False)
+        exporter.record_build("App", {'render': 0.5, 'compile': 50.0}, files=3, bytes_in=300, bytes_out=100,
+                              cache_hit=True)
+        values = samples((tmp_path / "innosetup.prom").read_text())
+        assert values['innosetup_builds_total{installer="App"}'] == 2
+        assert values['innosetup_files_packed_total{installer="App"}'] == 6
+        assert values['innosetup_source_bytes_total{installer="App"}'] == 600
+        assert values['innosetup_output_bytes_total{installer="App"}'] == 200
+        assert values['innosetup_cache_hits_total{installer="App"}'] == 1
+        assert values['innosetup_cache_misses_total{installer="App"}'] == 1
+        compile_labels = 'installer="App",phase="compile"'
+        assert values['innosetup_build_phase_seconds_bucket{%s,le="1.0"}' % compile_labels] == 0
+        assert values['innosetup_build_phase_seconds_bucket{%s,le="10.0"}' % compile_labels] == 1
+        assert values['innosetup_build_phase_seconds_bucket{%s,le="+Inf"}' % compile_labels] == 2
+        assert values['innosetup_build_phase_seconds_sum{%s}' % compile_labels] == 55.0
+        assert values['innosetup_build_phase_seconds_bucket{installer="App",phase="render",le="1.0"}'] == 2
+        data = json.loads((tmp_path / "metrics.json").read_text())
+        assert data['installers']['App']['builds'] == 2
+        assert data['installers']['App']['phases']['compile']['count'] == 2
+
+    def test_totals_survive_new_exporters(self, tmp_path):
+        for _ in range(3):
+            MetricsExporter(json_path=tmp_path / "metrics.json").record_build("App", {'compile': 1.0})
+        assert json.loads((tmp_path / "metrics.json").read_text())['installers']['App']['builds'] == 3
+        assert (tmp_path / "metrics.json.state.json").exists()
+
+    def test_label_values_escaped(self, tmp_path):
+        exporter = MetricsExporter(tmp_path / "innosetup.prom")
+        exporter.record_build('My "App"\\2', {})
+        assert 'innosetup_builds_total{installer="My \\"App\\"\\\\2"} 1' in (tmp_path / "innosetup.prom").read_text()
+
+    def test_changed_buckets_start_over(self, tmp_path):
+        MetricsExporter(json_path=tmp_path / "metrics.json", buckets=(1,)).record_build("App", {'compile': 1.0})
+        state = MetricsExporter(json_path=tmp_path / "metrics.json", buckets=(2,)).record_build("App", {})
+        assert state['installers']['App']['builds'] == 1
+
+    def test_needs_an_output(self):
+        with pytest.raises(ValueError):
+            MetricsExporter()
+
+    def test_processes_add_up(self, tmp_path):
+        script = textwrap.dedent("""
+            import sys
+            from innosetup_builder import MetricsExporter
+            exporter = MetricsExporter(sys.argv[1])
+            for _ in range(10):
+                exporter.record_build("App", {'compile': 0.1}, files=1)
+        """)
+        processes = [subprocess.Popen([sys.executable, "-c", script, str(tmp_path / "innosetup.prom")])
+                     for _ in range(4)]
+        assert [process.wait(60) for process in processes] == [0] * 4
+        values = samples((tmp_path / "innosetup.prom").read_text())
+        assert values['innosetup_files_packed_total{installer="App"}'] == 40
+        assert [path.name for path in tmp_path.iterdir() if path.name.endswith(".tmp")] == []
+
+
+class TestBuildExport:
+    def test_build_exports_cache_hits_and_misses(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        exporter = MetricsExporter(tmp_path / "innosetup.prom")
+        store = LocalArtifactStore(tmp_path / "store")
+        installer = Installer(app_name="App", multilingual=False)
+        compiler.build(installer, tmp_path / "one.exe", store=store, metrics=exporter)
+        compiler.build(installer, tmp_path / "two.exe", store=store, metrics=exporter)
+        values = samples((tmp_path / "innosetup.prom").read_text())
+        assert values['innosetup_cache_hits_total{installer="App"}'] == 1
+        assert values['innosetup_cache_misses_total{installer="App"}'] == 1
+        assert values['innosetup_build_phase_seconds_count{installer="App",phase="compile"}'] == 1
+        assert values['innosetup_build_phase_seconds_count{installer="App",phase="render"}'] == 2
+        assert values['innosetup_build_phase_seconds_count{installer="App",phase="stat"}'] == 2
+        assert 'innosetup_build_phase_seconds_count{installer="App",phase="scan"}' not in values
+        assert values['innosetup_output_bytes_total{installer="App"}'] == 68
+
+    def test_scan_timed_while_streaming(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        (tmp_path / "dist").mkdir()
+        (tmp_path / "dist" / "app.exe").write_bytes(b"x" * 10)
+
+        def slow_scan():
+            time.sleep(0.05)
+            yield from all_files(tmp_path / "dist")
+
+        exporter = MetricsExporter(json_path=tmp_path / "metrics.json")
+        installer = Installer(app_name="App", multilingual=False, files=FileSource(slow_scan, passes="rescan"))
+        compiler.build(installer, tmp_path / "setup.exe", metrics=exporter)
+        totals = json.loads((tmp_path / "metrics.json").read_text())['installers']['App']
+        assert totals['phases']['scan']['sum'] >= 0.05
+        assert 'stat' not in totals['phases']
+        assert (totals['files'], totals['bytes_in']) == (1, 10)
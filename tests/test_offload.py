@@ -0,0 +1,79 @@
+"""Tests for OffloadPolicy."""
+
+import os
+
+import pytest
+from innosetup_builder import FileEntry, FileFlags, FrozenFileEntry, Installer, OffloadPolicy, all_files
+
+
+@pytest.fixture
+def payload(write_tree):
+    return write_tree({"voices/en.bin": os.urandom(40000), "voices/de.bin": os.urandom(30000),
+                       "app.exe": b"x" * 1000, "log.txt": b"line\n" * 20000})
+
+
+def sources(files):
+    return [os.path.basename(entry.source) for entry in files]
+
+
+class TestOffloadPolicy:
+    def test_large_incompressible_files_stored(self, payload):
+        files = sorted(all_files(payload), key=lambda entry: entry.source)
+        report = OffloadPolicy(threshold_bytes=10000).apply(files)
+        assert sorted(os.path.basename(source) for source in report.offloaded) == ["de.bin", "en.bin"]
+        assert report.offloaded_bytes == 70000
+        # compressible and small files stay, in their order, before the stored ones
+        assert sources(report.files) == ["app.exe", "log.txt", "de.bin", "en.bin"]
+        assert all(FileFlags.NO_COMPRESSION in entry.flags for entry in report.files[2:])
+        assert FileFlags.NO_COMPRESSION not in files[2].flags
+        assert report.external == {}
+        assert report.projected_seconds_saved > 0
+
+    def test_external(self, payload, compiler):
+        files = [FileEntry(source=str(payload / "voices" / "en.bin"), destination="voices", flags="ignoreversion"),
+                 FileEntry(source=str(payload / "app.exe"), destination="")]
+        report = OffloadPolicy(threshold_bytes=10000, action="external").apply(files)
+        entry = report.files[-1]
+        assert entry.source == "{src}\\voices\\en.bin"
+        assert entry.flags == "ignoreversion external"
+        assert entry.external_size == "40000"
+        assert report.external == {str(payload / "voices" / "en.bin"): "{src}\\voices\\en.bin"}
+        text = Installer(multilingual=False, files=report.files).render(compiler)
+        assert ('Source: "{src}\\voices\\en.bin"; DestDir: "{app}\\voices"; ExternalSize: 40000; '
+                'Flags: ignoreversion external') in text
+
+    def test_left_alone(self, payload):
+        big = str(payload / "voices" / "en.bin")
+        files = [FileEntry(source=big, destination="a", flags=[FileFlags.NO_COMPRESSION]),
+                 FileEntry(source=str(payload / "voices" / "*.bin"), destination="b"),
+                 FileEntry(source=str(payload / "missing.bin"), destination="c"),
+                 FileEntry(source=str(payload / "log.txt"), destination="d")]
+        report = OffloadPolicy(threshold_bytes=10000).apply(files)
+        assert report.files == files
+        assert report.offloaded == {} and report.projected_seconds_saved == 0
+
+    def test_shared_destination_keeps_its_place(self, payload):
+        files = [FileEntry(source=str(payload / "voices" / "en.bin"), destination="", dest_name="voice.bin"),
+                 FileEntry(source=str(payload / "voices" / "de.bin"), destination="", dest_name="Voice.bin",
+                           flags="onlyifdoesntexist"),
+                 FileEntry(source=str(payload / "app.exe"), destination="")]
+        report = OffloadPolicy(threshold_bytes=10000).apply(iter(files))
+        assert sources(report.files) == ["en.bin", "de.bin", "app.exe"]
+        assert report.files[1].flags == "onlyifdoesntexist nocompression"
+
+    def test_frozen_entries(self, payload):
+        files = [FrozenFileEntry(source=str(payload / "voices" / "en.bin"), destination="voices")]
+        report = OffloadPolicy(threshold_bytes=10000, action="external", external_dir="D:\\assets").apply(files)
+        assert isinstance(report.files[0], FrozenFileEntry)
+        assert report.files[0].source == "D:\\assets\\voices\\en.bin"
+
+    def test_report(self, payload):
+        report = OffloadPolicy(threshold_bytes=10000, bytes_per_second=35000).apply(all_files(payload))
+        assert report.projected_seconds_saved == pytest.approx(2.0)
+        data = report.to_dict()
+        assert data['offloaded_bytes'] == 70000
+        assert data['offloaded'][str(payload / "voices" / "en.bin")]['bytes'] == 40000
+
+    def test_action_checked(self):
+        with pytest.raises(ValueError):
+            OffloadPolicy(action="skip").apply([])
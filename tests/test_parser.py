@@ -0,0 +1,131 @@
+"""Tests for parsing existing .iss scripts into Installer objects."""
+
+import pathlib
+
+from innosetup_builder import (Component, ComponentType, DirEntry, FileEntry, FileFlags, Installer,
+                               InnosetupCompiler, RegistryEntry, RunEntry, UninstallRunEntry,
+                               load_iss, parse_iss, parse_iss_parameters)
+
+EXAMPLES = pathlib.Path(__file__).resolve().parent.parent
+
+
+class TestParameters:
+    def test_quoted_and_bare_values(self):
+        parameters = parse_iss_parameters('Source: "app.exe"; DestDir: "{app}"; Flags: ignoreversion')
+        assert parameters == {'source': "app.exe", 'destdir': "{app}", 'flags': "ignoreversion"}
+
+    def test_semicolon_inside_quotes(self):
+        parameters = parse_iss_parameters('Filename: "cmd.exe"; Parameters: "/c a; b"; Flags: runhidden')
+        assert parameters['parameters'] == "/c a; b"
+        assert parameters['flags'] == "runhidden"
+
+    def test_doubled_quotes_kept_escaped(self):
+        parameters = parse_iss_parameters('Filename: "x.exe"; Parameters: """quoted"" arg"')
+        assert parameters['parameters'] == '""quoted"" arg'
+
+    def test_names_case_insensitive(self):
+        assert parse_iss_parameters('SOURCE: a.txt') == {'source': "a.txt"}
+
+
+class TestParseIss:
+    def test_setup_directives(self):
+        installer = parse_iss([
+            "[Setup]",
+            "AppName=My App",
+            "AppVersion  =1.2.3",
+            "AppId={{1234}",
+            "PrivilegesRequired=lowest",
+        ])
+        assert installer.app_name == "My App"
+        assert installer.app_version == "1.2.3"
+        assert installer.app_id == "{{1234}"
+        assert installer.multilingual is False
+        assert "[Setup]\nPrivilegesRequired=lowest" in installer.extra_iss
+
+    def test_sections_become_entries(self):
+        installer = parse_iss([
+            "[Types]",
+            'Name: "full"; Description: "Full installation"',
+            "[Components]",
+            'Name: "main"; Description: "Main"; Types: full; Flags: fixed',
+            "; a comment",
+            "[Files]",
+            'Source: "app.exe"; DestDir: "{app}\\bin"; Flags: ignoreversion; Components: main',
+            "[Dirs]",
+            'Name: "{app}\\data"; Permissions: users-modify',
+            "[Registry]",
+            'Root: HKCU; Subkey: "Software\\App"; ValueType: dword; ValueName: "Count"; ValueData: "1"',
+            "[Run]",
+            'Filename: "{app}\\app.exe"; Flags: postinstall',
+            "[UninstallRun]",
+            'Filename: "{app}\\cleanup.exe"; RunOnceId: "Cleanup"',
+        ])
+        assert installer.component_types == [ComponentType(name="full", description="Full installation")]
+        assert installer.components == [Component(name="main", description="Main", types="full", flags="fixed")]
+        assert installer.files == [FileEntry(source="app.exe", destination="bin", flags="ignoreversion", components="main")]
+        assert installer.dirs == [DirEntry(name="{app}\\data", permissions="users-modify")]
+        assert installer.registry_entries == [RegistryEntry(root="HKCU", subkey="Software\\App", value_type="dword",
+                                                            value_name="Count", value_data="1")]
+        assert installer.run_entries == [RunEntry(filename="{app}\\app.exe", flags="postinstall")]
+        assert installer.uninstall_run_entries == [UninstallRunEntry(filename="{app}\\cleanup.exe", runonce_id="Cleanup")]
+        assert installer.extra_iss == ""
+
+    def test_unsupported_rows_kept_in_extra_iss(self):
+        installer = parse_iss([
+            "[Files]",
+            'Source: "a.dll"; DestDir: "{sys}"',
+            'Source: "b.txt"; DestDir: "{app}"; Tasks: docs',
+            'Source: "c.txt"; DestDir: "{app}"',
+            "[Code]",
+            "function InitializeSetup(): Boolean;",
+            "begin Result := True; end;",
+        ])
+        assert installer.files == [FileEntry(source="c.txt", destination="")]
+        assert '[Files]\nSource: "a.dll"; DestDir: "{sys}"\nSource: "b.txt"; DestDir: "{app}"; Tasks: docs' in installer.extra_iss
+        assert "[Code]\nfunction InitializeSetup(): Boolean;\nbegin Result := True; end;" in installer.extra_iss
+
+    def test_generated_sections_absorbed(self, compiler):
+        original = Installer(app_name="App", main_executable="app.exe", desktop_icon=True, run_at_startup=True,
+                             multilingual=False)
+        installer = parse_iss(original.render(compiler).splitlines())
+        assert installer.main_executable == "app.exe"
+        assert installer.desktop_icon is True
+        assert installer.run_at_startup is True
+        assert installer.registry_entries == []
+        assert installer.extra_iss == ""
+
+    def test_languages(self):
+        installer = parse_iss([
+            "[Languages]",
+            'MessagesFile: "compiler:Default.isl"; Name: "Default"',
+            'MessagesFile: "compiler:Languages\\German.isl"; Name: "German"',
+        ])
+        assert installer.multilingual is True
+        assert installer.languages == ["German"]
+
+    def test_round_trip(self, compiler):
+        original = Installer(
+            app_name="Round Trip",
+            app_version="2.0",
+            main_executable="app.exe",
+            license_file="license.txt",
+            output_base_filename="setup",
+            multilingual=False,
+            files=[FileEntry(source="C:\\src\\app.exe", destination="", flags=[FileFlags.IGNORE_VERSION]),
+                   FileEntry(source="C:\\src\\lib.dll", destination="lib", flags="sharedfile")],
+            registry_entries=[RegistryEntry(subkey="Software\\Round Trip", value_type="string",
+                                            value_name="Path", value_data="{app}")],
+            extra_iss="[Code]\nprocedure Nothing; begin end;",
+        )
+        text = original.render(compiler)
+        assert parse_iss(text.splitlines()).render(compiler) == text
+
+    def test_load_example_script(self):
+        installer = load_iss(EXAMPLES / "example_with_components.iss")
+        assert installer.app_name == "ComponentsApp"
+        assert len(installer.files) == 7
+        assert len(installer.components) == 7
+        assert len(installer.component_types) == 3
+        assert installer.main_executable == "app.exe"
+        rendered = installer.render(InnosetupCompiler(base_path=None))
+        assert rendered.rstrip() == (EXAMPLES / "example_with_components.iss").read_text().rstrip()
@@ -0,0 +1,105 @@
+"""Tests for the payload breakdown report and its treemap."""
+
+import json
+import os
+
+import pytest
+from innosetup_builder import FileEntry, all_files, main, payload_report
+from innosetup_builder import _squarify
+
+
+@pytest.fixture
+def payload(write_tree):
+    return write_tree({"app.exe": b"MZ" + b"\0" * 998, "bin/lib.dll": b"a" * 4000,
+                       "data/notes.txt": b"hello world " * 500, "data/images/logo.png": os.urandom(3000)},
+                      root="payload")
+
+
+class TestPayloadReport:
+    def test_directory_trie(self, payload):
+        report = payload_report(all_files(payload))
+        root = report.root
+        assert (root.files, root.raw_bytes) == (4, 1000 + 4000 + 6000 + 3000)
+        assert root.children['data'].raw_bytes == 9000
+        assert root.children['data'].children['images'].files == 1
+        assert set(root.children) == {'bin', 'data'}
+
+    def test_extensions_and_compression_estimate(self, payload):
+        report = payload_report(all_files(payload))
+        extensions = report.extensions
+        assert set(extensions) == {'.exe', '.dll', '.txt', '.png'}
+        # repetitive text compresses well, PNG is taken as already compressed
+        assert extensions['.txt'].compressed_bytes < extensions['.txt'].raw_bytes // 10
+        assert extensions['.png'].compressed_bytes == extensions['.png'].raw_bytes
+        assert report.root.compressed_bytes == sum(total.compressed_bytes for total in extensions.values())
+
+    def test_components(self, payload):
+        files = [FileEntry(source=str(payload / "app.exe"), destination="", components="main"),
+                 FileEntry(source=str(payload / "bin" / "lib.dll"), destination="bin", components="main or extras"),
+                 FileEntry(source=str(payload / "data" / "notes.txt"), destination="Data", dest_name="NOTES",
+                           components="docs and not main"),
+                 FileEntry(source=str(payload / "data" / "images" / "logo.png"), destination="data\\images"),
+                 FileEntry(source=str(payload / "missing.bin"), destination="")]
+        report = payload_report(iter(files))
+        assert {name: total.raw_bytes for name, total in report.components.items()} == {
+            'main': 5000, 'extras': 4000, 'docs': 6000, '': 3000}
+        assert report.extensions[''].raw_bytes == 6000
+        # destinations are case-insensitive
+        assert report.root.children['data'].raw_bytes == 9000
+        assert report.unsized == 1
+
+    def test_samples_bounded_per_extension(self, tmp_path, monkeypatch):
+        for index in range(20):
+            (tmp_path / "file{}.txt".format(index)).write_bytes(b"x" * 100)
+        opened = []
+        real_open = open
+
+        def counting_open(path, *args, **kwargs):
+            opened.append(path)
+            return real_open(path, *args, **kwargs)
+
+        monkeypatch.setattr("builtins.open", counting_open)
+        payload_report(all_files(tmp_path), samples=3)
+        assert len(opened) == 3
+
+    def test_stat_cache(self, payload):
+        cache = {}
+        payload_report(all_files(payload), stat_cache=cache)
+        assert len(cache) == 4
+        fake = os.stat(str(payload / "app.exe"))
+        cache = {str(payload / "elsewhere.bin"): fake}
+        report = payload_report([FileEntry(source=str(payload / "elsewhere.bin"), destination="")], stat_cache=cache)
+        assert report.root.raw_bytes == 1000
+
+    def test_json_and_html(self, payload, tmp_path):
+        report = payload_report(all_files(payload))
+        report.write(json_path=tmp_path / "report.json", html_path=tmp_path / "report.html")
+        data = json.loads((tmp_path / "report.json").read_text())
+        assert data['totals']['raw_bytes'] == 14000
+        assert [child['name'] for child in data['directories']['children']] == ["data", "bin"]
+        assert list(data['extensions'])[0] == ".txt"
+        page = (tmp_path / "report.html").read_text()
+        assert page.startswith("<!DOCTYPE html>")
+        assert 'title="data\\images' in page
+
+
+class TestSquarify:
+    def test_rectangles_fill_the_area(self):
+        sizes = [500.0, 250.0, 125.0, 75.0, 50.0]
+        rectangles = _squarify(sizes, 0, 0, 400, 300)
+        assert len(rectangles) == 5
+        for size, (x, y, width, height) in zip(sizes, rectangles):
+            assert width * height == pytest.approx(size / 1000.0 * 400 * 300)
+            assert 0 <= x and x + width <= 400 + 1e-6
+            assert 0 <= y and y + height <= 300 + 1e-6
+
+
+class TestPayloadCommand:
+    def test_cli(self, tmp_path, payload, capsys):
+        script = tmp_path / "setup.iss"
+        script.write_text('[Files]\nSource: "{}"; DestDir: "{{app}}\\bin"\n'.format(payload / "bin" / "lib.dll"))
+        assert main(["payload", str(script)]) == 0
+        assert json.loads(capsys.readouterr().out)['components'] == {
+            '': {'files': 1, 'raw_bytes': 4000, 'compressed_bytes': pytest.approx(0, abs=200)}}
+        assert main(["payload", str(script), "--html", str(tmp_path / "map.html")]) == 0
+        assert (tmp_path / "map.html").exists()
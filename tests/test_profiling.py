@@ -0,0 +1,89 @@
+"""Tests for the build profiling mode."""
+
+import json
+import pstats
+import tracemalloc
+
+import pytest
+from innosetup_builder import BuildProfiler, FileEntry, Installer, InnosetupCompiler
+
+from tests.benchmark import make_stand_in_iscc
+
+
+@pytest.fixture
+def compiler(tmp_path):
+    make_stand_in_iscc(tmp_path / "innosetup")
+    return InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+
+
+@pytest.fixture
+def installer():
+    return Installer(
+        app_name="Test App",
+        app_version="1.0.0",
+        main_executable="test.exe",
+        files=[FileEntry(source="test{}.exe".format(i), destination="") for i in range(50)]
+    )
+
+
+class TestBuildProfiling:
+    def test_build_without_profile_writes_no_reports(self, compiler, installer, tmp_path, monkeypatch):
+        monkeypatch.delenv("INNOSETUP_PROFILE", raising=False)
+        output = tmp_path / "installer.exe"
+        compiler.build(installer, output)
+        assert output.exists()
+        assert not (tmp_path / "installer.exe.profile.json").exists()
+        assert not (tmp_path / "installer.exe.pstats").exists()
+
+    def test_build_with_profile_writes_reports(self, compiler, installer, tmp_path):
+        output = tmp_path / "installer.exe"
+        compiler.build(installer, output, profile=True)
+        report = json.loads((tmp_path / "installer.exe.profile.json").read_text())
+        assert set(report['phases']) == {"render", "write", "compile"}
+        assert report['memory']['render']['peak_bytes'] > 0
+        assert report['memory']['render']['top_allocations']
+        assert report['functions']
+        # the pstats dump is loadable by the standard library
+        stats = pstats.Stats(str(tmp_path / "installer.exe.pstats"))
+        assert stats.total_calls > 0
+
+    def test_profile_enabled_from_environment(self, compiler, installer, tmp_path, monkeypatch):
+        monkeypatch.setenv("INNOSETUP_PROFILE", "1")
+        compiler.build(installer, tmp_path / "installer.exe")
+        assert (tmp_path / "installer.exe.profile.json").exists()
+
+    def test_explicit_false_overrides_environment(self, compiler, installer, tmp_path, monkeypatch):
+        monkeypatch.setenv("INNOSETUP_PROFILE", "1")
+        compiler.build(installer, tmp_path / "installer.exe", profile=False)
+        assert not (tmp_path / "installer.exe.profile.json").exists()
+
+
+class TestBuildProfiler:
+    def test_phase_records_timing_without_memory(self):
+        profiler = BuildProfiler()
+        with profiler.phase("work"):
+            sum(range(1000))
+        assert "work" in profiler.timings
+        assert "work" not in profiler.memory
+
+    def test_report_limits_functions(self):
+        profiler = BuildProfiler(top=3)
+        with profiler.phase("work", trace_memory=True):
+            [str(i) for i in range(1000)]
+        report = profiler.report()
+        assert len(report['functions']) <= 3
+        assert len(report['memory']['work']['top_allocations']) <= 3
+
+    def test_trace_memory_stops_only_its_own_tracing(self):
+        profiler = BuildProfiler()
+        with profiler.phase("work", trace_memory=True):
+            assert tracemalloc.is_tracing()
+        assert not tracemalloc.is_tracing()
+        tracemalloc.start()
+        try:
+            with profiler.phase("traced", trace_memory=True):
+                [str(i) for i in range(1000)]
+            assert tracemalloc.is_tracing()
+            assert profiler.memory["traced"]['peak_bytes'] > 0
+        finally:
+            tracemalloc.stop()
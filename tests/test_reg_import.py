@@ -0,0 +1,102 @@
+"""Tests for importing .reg exports as RegistryEntry rows."""
+
+import pytest
+from innosetup_builder import RegistryEntry, import_reg, parse_reg
+
+REGEDIT5 = r'''Windows Registry Editor Version 5.00
+
+[HKEY_LOCAL_MACHINE\Software\MyCompany\MyApp]
+@="Default value"
+"InstallPath"="C:\\Program Files\\MyApp"
+"Quoted"="say \"hi\" {now}"
+"Count"=dword:0000001f
+"Big"=hex(b):00,00,00,00,01,00,00,00
+"Blob"=hex:de,ad,\
+  be,ef
+"Expand"=hex(2):25,00,53,00,79,00,73,00,74,00,65,00,6d,00,52,00,6f,00,6f,00,74,\
+  00,25,00,00,00
+"Multi"=hex(7):61,00,00,00,62,00,00,00,00,00
+
+[HKEY_CURRENT_USER\Software\MyApp\Empty]
+
+; a comment
+[HKEY_CLASSES_ROOT\CLSID\{00000000-0000-0000-0000-000000000001}]
+@="Component"
+'''
+
+
+class TestParseReg:
+    def test_value_types(self):
+        entries = parse_reg(REGEDIT5.splitlines())
+        values = {entry.value_name: entry for entry in entries if entry.subkey == "Software\\MyCompany\\MyApp"}
+        assert values[""].value_type == "string"
+        assert values[""].value_data == "Default value"
+        assert values["InstallPath"].value_data == "C:\\Program Files\\MyApp"
+        assert values["Quoted"].value_data == 'say ""hi"" {{now}'
+        assert (values["Count"].value_type, values["Count"].value_data) == ("dword", "31")
+        assert (values["Big"].value_type, values["Big"].value_data) == ("qword", str(1 << 32))
+        assert (values["Blob"].value_type, values["Blob"].value_data) == ("binary", "de ad be ef")
+        assert (values["Expand"].value_type, values["Expand"].value_data) == ("expandsz", "%SystemRoot%")
+        assert (values["Multi"].value_type, values["Multi"].value_data) == ("multisz", "a{break}b")
+        assert all(entry.root == "HKLM" for entry in values.values())
+
+    def test_key_without_values_becomes_key_row(self):
+        entries = parse_reg(REGEDIT5.splitlines())
+        assert RegistryEntry(root="HKCU", subkey="Software\\MyApp\\Empty") in entries
+
+    def test_roots_and_braces_in_subkeys(self):
+        entries = parse_reg(REGEDIT5.splitlines())
+        clsid = [entry for entry in entries if entry.root == "HKCR"]
+        # subkeys expand constants too, so the GUID's brace is doubled
+        assert clsid[0].subkey == "CLSID\\{{00000000-0000-0000-0000-000000000001}"
+
+    def test_duplicate_keys_collapsed(self):
+        entries = parse_reg([
+            "REGEDIT4",
+            "[HKEY_CURRENT_USER\\Software\\App]",
+            '"A"="1"',
+            '"B"="2"',
+            "[HKEY_CURRENT_USER\\SOFTWARE\\APP]",
+            '"a"="3"',
+        ])
+        assert [(entry.value_name, entry.value_data) for entry in entries] == [("a", "3"), ("B", "2")]
+
+    def test_deletions(self):
+        entries = parse_reg([
+            "Windows Registry Editor Version 5.00",
+            "[-HKEY_CURRENT_USER\\Software\\Old]",
+            "[HKEY_CURRENT_USER\\Software\\App]",
+            '"Stale"=-',
+        ])
+        assert entries == [
+            RegistryEntry(root="HKCU", subkey="Software\\Old", flags="deletekey"),
+            RegistryEntry(root="HKCU", subkey="Software\\App", value_name="Stale", flags="deletevalue"),
+        ]
+
+    def test_flags_and_components_applied(self):
+        entries = parse_reg(["REGEDIT4", "[HKEY_CURRENT_USER\\Software\\App]", '"A"="1"'],
+                            flags="uninsdeletevalue", components="main")
+        assert entries[0].flags == "uninsdeletevalue"
+        assert entries[0].components == "main"
+
+    def test_regedit4_ansi_strings(self):
+        entries = parse_reg(["REGEDIT4", "[HKEY_CURRENT_USER\\Software\\App]", '"E"=hex(2):61,62,00'])
+        assert entries[0].value_data == "ab"
+
+    def test_unknown_root_rejected(self):
+        with pytest.raises(ValueError):
+            parse_reg(["REGEDIT4", "[HKEY_NOWHERE\\Software]"])
+
+
+class TestImportReg:
+    def test_utf16_export(self, tmp_path):
+        path = tmp_path / "export.reg"
+        path.write_text(REGEDIT5, encoding="utf-16")
+        entries = import_reg(path)
+        assert len(entries) == 10
+        assert entries[0].value_data == "Default value"
+
+    def test_utf8_export(self, tmp_path):
+        path = tmp_path / "export.reg"
+        path.write_text("REGEDIT4\n[HKEY_CURRENT_USER\\Software\\App]\n\"Name\"=\"caf\u00e9\"\n", encoding="utf-8")
+        assert import_reg(path)[0].value_data == "caf\u00e9"
@@ -0,0 +1,123 @@
+"""Tests for the registry tree on Installer."""
+
+import pytest
+from innosetup_builder import (Installer, RegistryConflictError, RegistryEntry, RegistryTree, RegistryValue,
+                               diff_installers)
+
+
+class TestRegistryTree:
+    def test_nested_mapping(self):
+        tree = RegistryTree()
+        tree.update({"HKLM": {"Software": {"MyCompany": {"MyApp": {
+            "@": "default",
+            "InstallPath": "{app}",
+            "Count": 3,
+            "Enabled": True,
+            "Big": 2 ** 40,
+            "Blob": b"\x01\xff",
+            "Paths": ["a", "b"],
+            "Empty": {},
+        }}}}})
+        rows = {(row.subkey, row.value_name): row for row in tree.entries()}
+        app = "Software\\MyCompany\\MyApp"
+        assert rows[(app, "")].value_data == "default"
+        assert (rows[(app, "InstallPath")].value_type, rows[(app, "InstallPath")].value_data) == ("string", "{app}")
+        assert (rows[(app, "Count")].value_type, rows[(app, "Count")].value_data) == ("dword", "3")
+        assert rows[(app, "Enabled")].value_data == "1"
+        assert rows[(app, "Big")].value_type == "qword"
+        assert (rows[(app, "Blob")].value_type, rows[(app, "Blob")].value_data) == ("binary", "01 ff")
+        assert rows[(app, "Paths")].value_data == "a{break}b"
+        assert rows[(app + "\\Empty", "")].value_type == "none"
+
+    def test_duplicates_merged_case_insensitively(self):
+        tree = RegistryTree()
+        tree.update({"Software": {"App": {"Path": "{app}"}}}, root="HKCU")
+        tree.update({"SOFTWARE": {"app": {"path": "{app}"}}}, root="HKEY_CURRENT_USER")
+        rows = tree.entries()
+        assert rows == [RegistryEntry(root="HKCU", subkey="Software\\App", value_type="string",
+                                      value_name="Path", value_data="{app}")]
+
+    def test_conflicting_values_rejected(self):
+        tree = RegistryTree()
+        tree.add_value("HKLM", "Software\\App", "Version", "1.0")
+        with pytest.raises(RegistryConflictError, match="(?i)version"):
+            tree.add_value("HKLM", "software\\app", "version", "2.0")
+
+    def test_conflicting_components_rejected(self):
+        tree = RegistryTree()
+        tree.add_key("HKLM", "Software\\App", components="main")
+        with pytest.raises(RegistryConflictError):
+            tree.add_key("HKLM", "Software\\App", components="extras")
+
+    def test_key_flags_merged(self):
+        tree = RegistryTree()
+        tree.add_key("HKLM", "Software\\App", flags="uninsdeletekeyifempty")
+        tree.add_key("HKLM", "Software\\App", flags="uninsdeletekeyifempty createvalueifdoesntexist")
+        tree.add_value("HKLM", "Software\\App", "A", RegistryValue(value_type="dword", value_data="1"))
+        rows = tree.entries()
+        assert rows[0] == RegistryEntry(root="HKLM", subkey="Software\\App",
+                                        flags="uninsdeletekeyifempty createvalueifdoesntexist")
+        assert rows[1].value_name == "A"
+
+    def test_sorted_and_grouped_output(self):
+        tree = RegistryTree()
+        tree.add_value("HKCU", "Software\\B", "x", "1")
+        tree.add_value("HKLM", "Software\\Zeta", "b", "1")
+        tree.add_value("HKLM", "Software\\Alpha\\Sub", "a", "1")
+        tree.add_value("HKLM", "Software\\Alpha", "z", "1")
+        tree.add_value("HKLM", "Software\\Alpha", "a", "1")
+        assert [(row.root, row.subkey, row.value_name) for row in tree.entries()] == [
+            ("HKLM", "Software\\Alpha", "a"),
+            ("HKLM", "Software\\Alpha", "z"),
+            ("HKLM", "Software\\Alpha\\Sub", "a"),
+            ("HKLM", "Software\\Zeta", "b"),
+            ("HKCU", "Software\\B", "x"),
+        ]
+
+    def test_add_entry(self):
+        tree = RegistryTree()
+        tree.add_entry(RegistryEntry(root="HKLM", subkey="Software\\App", flags="uninsdeletekey"))
+        tree.add_entry(RegistryEntry(root="HKLM", subkey="Software\\App", value_type="string",
+                                     value_name="Path", value_data="{app}"))
+        assert len(tree.entries()) == 2
+
+    def test_entries_are_copies(self):
+        tree = RegistryTree()
+        tree.add_value("HKLM", "Software\\App", "Path", "{app}")
+        tree.add_value("HKLM", "SOFTWARE\\APP", "Other", "1")
+        row = tree.entries()[1]
+        assert row.subkey == "Software\\App"
+        row.value_data = "{tmp}"
+        row.subkey = "Elsewhere"
+        assert tree.entries()[1] == RegistryEntry(root="HKLM", subkey="Software\\App", value_type="string",
+                                                  value_name="Path", value_data="{app}")
+        # the stored definition still decides what conflicts
+        tree.add_value("HKLM", "Software\\App", "Path", "{app}")
+        with pytest.raises(RegistryConflictError):
+            tree.add_value("HKLM", "Software\\App", "Path", "{tmp}")
+
+    def test_unsupported_value(self):
+        with pytest.raises(TypeError):
+            RegistryTree().add_value("HKLM", "Software\\App", "x", 1.5)
+
+
+class TestInstallerRegistryTree:
+    def test_tree_rendered_after_entries(self, compiler):
+        installer = Installer(app_name="Test App",
+                              registry_entries=[RegistryEntry(subkey="Software\\First", value_type="string",
+                                                              value_name="A", value_data="1")])
+        installer.registry.update({"HKCU": {"Software": {"App": {"Path": "{app}"}}}})
+        result = installer.render(compiler)
+        assert result.count("[Registry]") == 1
+        assert result.index('Subkey: "Software\\First"') < result.index('Subkey: "Software\\App"')
+
+    def test_no_registry_section_when_empty(self, compiler):
+        assert "[Registry]" not in Installer(app_name="Test App").render(compiler)
+
+    def test_diff_sees_tree_rows(self):
+        old = Installer(app_name="App")
+        new = Installer(app_name="App")
+        new.registry.add_value("HKLM", "Software\\App", "Path", "{app}")
+        diff = diff_installers(old, new)
+        assert len(diff.sections['registry'].added) == 1
+        assert 'registry' not in diff.setup
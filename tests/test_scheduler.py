@@ -0,0 +1,169 @@
+"""Tests for resource-aware scheduling of compiles."""
+
+import json
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+from innosetup_builder import (BuildCost, BuildScheduler, FileEntry, Installer, InnosetupCompiler, estimate_build_cost,
+                               file_lock)
+
+from tests.benchmark import make_stand_in_iscc
+
+MB = 1 << 20
+
+
+class TestEstimateBuildCost:
+    def test_template_compression(self):
+        cost = estimate_build_cost(Installer(), payload_bytes=1 << 30)
+        # lzma2/ultra: a 64 MB dictionary, with the match finder on a second thread
+        assert cost.memory_bytes == 64 * MB + int(64 * MB * 11.5)
+        assert cost.cpus == 2
+
+    def test_small_payload_does_not_fill_the_dictionary(self):
+        assert estimate_build_cost(Installer(), payload_bytes=MB).memory_bytes == 64 * MB + int(MB * 11.5)
+
+    def test_extra_iss_overrides(self):
+        installer = Installer(extra_iss="[Setup]\nCompression=lzma2/fast\nLZMANumBlockThreads=4\n"
+                                        "LZMADictionarySize=2048\n[Code]\nLZMANumBlockThreads=99\n")
+        cost = estimate_build_cost(installer, payload_bytes=1 << 30)
+        assert cost.memory_bytes == 64 * MB + int(4 * 2 * MB * 11.5)
+        assert cost.cpus == 4
+        # block threads only help when there are enough blocks
+        assert estimate_build_cost(installer, payload_bytes=8 * MB).cpus == 1
+
+    def test_other_methods(self):
+        assert estimate_build_cost(Installer(extra_iss="[Setup]\nCompression=zip\n")) == BuildCost(65 * MB, 1)
+
+    def test_payload_is_stat_ed(self, tmp_path):
+        (tmp_path / "data.bin").write_bytes(b"x" * MB)
+        installer = Installer(files=[FileEntry(source=str(tmp_path / "data.bin"), destination="")])
+        assert estimate_build_cost(installer) == estimate_build_cost(installer, payload_bytes=MB)
+        generated = Installer(files=(entry for entry in installer.files))
+        assert estimate_build_cost(generated) == estimate_build_cost(installer)
+
+
+def hold(scheduler, cost, priority, started, release, order):
+    with scheduler.slot(cost, priority=priority):
+        order.append(priority)
+        started.set()
+        release.wait(5)
+
+
+class TestBuildScheduler:
+    def wait_for_queue(self, scheduler, depth):
+        deadline = time.monotonic() + 5
+        while len(scheduler._local_state['waiting']) < depth:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    def test_priority_order(self):
+        scheduler = BuildScheduler(memory_bytes=10 * MB, cpus=1)
+        order = []
+        release = threading.Event()
+        with scheduler.slot(BuildCost(MB, 1)):
+            threads = []
+            for priority in (5, 1, 3):
+                thread = threading.Thread(target=hold, args=(scheduler, BuildCost(MB, 1), priority,
+                                                             threading.Event(), release, order))
+                thread.start()
+                threads.append(thread)
+                self.wait_for_queue(scheduler, len(threads))
+            release.set()
+        for thread in threads:
+            thread.join(5)
+        assert order == [1, 3, 5]
+        metrics = scheduler.metrics.to_dict()
+        assert metrics['admitted'] == 4
+        assert metrics['max_queue_depth'] == 3
+        assert metrics['deferred'] >= 3
+
+    def test_builds_which_fit_run_together(self):
+        scheduler = BuildScheduler(memory_bytes=10 * MB, cpus=4)
+        release = threading.Event()
+        started = [threading.Event(), threading.Event()]
+        threads = [threading.Thread(target=hold, args=(scheduler, BuildCost(4 * MB, 2), 0, event, release, []))
+                   for event in started]
+        for thread in threads:
+            thread.start()
+        assert all(event.wait(5) for event in started)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+    def test_memory_limits_admission(self):
+        scheduler = BuildScheduler(memory_bytes=10 * MB, cpus=8)
+        with scheduler.slot(BuildCost(6 * MB, 1)):
+            with pytest.raises(TimeoutError):
+                with scheduler.slot(BuildCost(6 * MB, 1), timeout=0.1):
+                    pass
+        assert scheduler._local_state['waiting'] == {}
+        assert scheduler.metrics.timed_out == 1
+
+    def test_oversized_build_runs_alone(self):
+        scheduler = BuildScheduler(memory_bytes=10 * MB, cpus=1)
+        with scheduler.slot(BuildCost(100 * MB, 16), timeout=1):
+            pass
+        assert scheduler.metrics.oversized == 1
+        assert scheduler._local_state['running'] == {}
+
+
+SCHEDULED = textwrap.dedent("""
+    import sys, time
+    from innosetup_builder import BuildCost, BuildScheduler
+    scheduler = BuildScheduler(memory_bytes=1 << 30, cpus=2, lock_path=sys.argv[1], poll_interval=0.02)
+    with scheduler.slot(BuildCost(1 << 20, 2)):
+        start = time.time()
+        time.sleep(0.3)
+        print(start, time.time())
+""")
+
+
+class TestCrossProcess:
+    def test_processes_share_the_queue(self, tmp_path):
+        processes = [subprocess.Popen([sys.executable, "-c", SCHEDULED, str(tmp_path / "builds.lock")],
+                                      stdout=subprocess.PIPE, universal_newlines=True) for _ in range(3)]
+        intervals = sorted(tuple(map(float, process.communicate(timeout=30)[0].split())) for process in processes)
+        for (_, end), (start, _) in zip(intervals, intervals[1:]):
+            assert start >= end
+
+    def test_dead_processes_dropped(self, tmp_path):
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        lock_path = tmp_path / "builds.lock"
+        lock_path.write_text(json.dumps({'sequence': 1, 'waiting': {},
+                                         'running': {'x': {'pid': dead.pid, 'priority': 0, 'memory': 1, 'cpus': 2}}}))
+        scheduler = BuildScheduler(memory_bytes=10 * MB, cpus=2, lock_path=lock_path, poll_interval=0.01)
+        with scheduler.slot(BuildCost(MB, 2), timeout=1):
+            assert list(json.loads(lock_path.read_text())['running']) != ['x']
+
+    def test_file_lock_excludes_other_holders(self, tmp_path):
+        events = []
+
+        def locker(name):
+            with file_lock(tmp_path / "lock"):
+                events.append(name + " in")
+                time.sleep(0.05)
+                events.append(name + " out")
+
+        threads = [threading.Thread(target=locker, args=(str(index),)) for index in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert all(events[index].split()[0] == events[index + 1].split()[0] for index in range(0, 6, 2))
+
+
+class TestScheduledBuild:
+    def test_build_is_admitted(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        scheduler = BuildScheduler(memory_bytes=1 << 30, cpus=2, lock_path=tmp_path / "builds.lock")
+        compiler.build(Installer(app_name="App", multilingual=False), tmp_path / "installer.exe", scheduler=scheduler,
+                       priority=1)
+        assert (tmp_path / "installer.exe").exists()
+        assert scheduler.metrics.admitted == 1
+        assert json.loads((tmp_path / "builds.lock").read_text())['running'] == {}
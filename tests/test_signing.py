@@ -0,0 +1,97 @@
+"""Tests for signing the payload before packaging."""
+
+import subprocess
+import sys
+
+import pytest
+from innosetup_builder import FileEntry, FileFlags, Installer, InnosetupCompiler, LocalArtifactStore, Signer
+
+from tests.benchmark import make_stand_in_iscc, make_stand_in_signer
+
+
+@pytest.fixture
+def payload(write_tree):
+    return write_tree({"app.exe": b"MZapp.exe", "core.dll": b"MZcore.dll", "readme.txt": b"MZreadme.txt",
+                       "copy.dll": b"MZcore.dll"}, root="source")
+
+
+@pytest.fixture
+def command(tmp_path):
+    return make_stand_in_signer(tmp_path / "tools")
+
+
+def signed_names(tmp_path):
+    log = tmp_path / "tools" / "signtool.log"
+    return sorted(log.read_text().split()) if log.exists() else []
+
+
+class TestSigner:
+    def test_signs_signable_files(self, tmp_path, payload, command):
+        signer = Signer(command, tmp_path / "staging")
+        files = [FileEntry(source=str(payload / name), destination="")
+                 for name in ("app.exe", "core.dll", "readme.txt")]
+        report = signer.sign(files)
+        assert sorted(report.signed) == [str(payload / "app.exe"), str(payload / "core.dll")]
+        assert report.files[2] is files[2]
+        signed = report.files[0].source
+        assert signed.startswith(str(tmp_path / "staging")) and signed.endswith("app.exe")
+        with open(signed, 'rb') as handle:
+            assert b"SIGNATURE" in handle.read()
+        # the sources themselves are left alone
+        assert (payload / "app.exe").read_bytes() == b"MZapp.exe"
+        assert list((tmp_path / "staging" / ".signing").iterdir()) == []
+
+    def test_skips_flagged_wildcard_and_external_entries(self, tmp_path, payload, command):
+        signer = Signer(command, tmp_path / "staging")
+        files = [FileEntry(source=str(payload / "app.exe"), destination="", flags=[FileFlags.SIGN_ONCE]),
+                 FileEntry(source=str(payload / "*.dll"), destination=""),
+                 FileEntry(source="{src}\\tool.exe", destination="", flags="external")]
+        report = signer.sign(files)
+        assert report.files == files
+        assert signed_names(tmp_path) == []
+
+    def test_unchanged_binaries_not_signed_again(self, tmp_path, payload, command):
+        cache = LocalArtifactStore(tmp_path / "cache")
+        files = [FileEntry(source=str(payload / "app.exe"), destination="")]
+        Signer(command, tmp_path / "staging", cache=cache).sign(files)
+        # a fresh staging directory, e.g. on another build agent, is filled from the cache
+        report = Signer(command, tmp_path / "elsewhere", cache=cache).sign(files)
+        assert report.cached == [str(payload / "app.exe")]
+        assert signed_names(tmp_path) == ["app.exe"]
+        (payload / "app.exe").write_bytes(b"MZnew")
+        assert Signer(command, tmp_path / "staging", cache=cache).sign(files).signed == [str(payload / "app.exe")]
+
+    def test_command_is_part_of_the_key(self, tmp_path, command):
+        assert Signer(command, tmp_path).key("0" * 64) != Signer(command + ["/tr", "x"], tmp_path).key("0" * 64)
+
+    def test_same_content_signed_once_per_name(self, tmp_path, payload, command):
+        files = [FileEntry(source=str(payload / "core.dll"), destination="a"),
+                 FileEntry(source=str(payload / "core.dll"), destination="b"),
+                 FileEntry(source=str(payload / "copy.dll"), destination="")]
+        report = Signer(command, tmp_path / "staging", max_workers=3).sign(files)
+        assert report.files[0].source == report.files[1].source
+        assert report.files[2].source.endswith("copy.dll")
+        assert signed_names(tmp_path) == ["copy.dll", "core.dll"]
+
+    def test_failing_command(self, tmp_path, payload):
+        signer = Signer([sys.executable, "-c", "raise SystemExit(3)", "$f"], tmp_path / "staging")
+        with pytest.raises(subprocess.CalledProcessError):
+            signer.sign([FileEntry(source=str(payload / "app.exe"), destination="")])
+        assert list((tmp_path / "staging" / ".signing").iterdir()) == []
+
+    def test_missing_source(self, tmp_path, command):
+        with pytest.raises(FileNotFoundError):
+            Signer(command, tmp_path / "staging").sign([FileEntry(source=str(tmp_path / "gone.exe"), destination="")])
+
+
+class TestBuildSigning:
+    def test_build_packages_signed_copies(self, tmp_path, payload, command, monkeypatch):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        monkeypatch.setenv("STAND_IN_ISCC_SAVE", "1")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        installer = Installer(app_name="App", multilingual=False,
+                              files=[FileEntry(source=str(payload / "app.exe"), destination="")])
+        compiler.build(installer, tmp_path / "installer.exe", signer=Signer(command, tmp_path / "staging"))
+        script = (tmp_path / "installer.exe.iss").read_text()
+        assert str(tmp_path / "staging") in script
+        assert installer.files[0].source == str(payload / "app.exe")
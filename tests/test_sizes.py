@@ -0,0 +1,126 @@
+"""Tests for the component, directory and type size rollup."""
+
+import json
+
+import pytest
+from innosetup_builder import (Component, ComponentType, FileEntry, FileFlags, Installer, all_files, main,
+                               size_rollup, stat_paths)
+
+import innosetup_builder
+
+
+@pytest.fixture
+def sources(write_tree):
+    sizes = {"app.exe": 1000, "lib.dll": 300, "help.chm": 50, "english.chm": 20, "data.bin": 5000}
+    return write_tree({name: b"x" * size for name, size in sizes.items()})
+
+
+@pytest.fixture
+def installer(sources):
+    return Installer(
+        app_name="App",
+        component_types=[ComponentType(name="full"), ComponentType(name="compact")],
+        components=[Component(name="main", types="full compact"), Component(name="help", types="full"),
+                    Component(name="help\\english", types="full"), Component(name="data", types="full",
+                                                                            extra_disk_space_required="123")],
+        files=[FileEntry(source=str(sources / "app.exe"), destination="", components="main"),
+               FileEntry(source=str(sources / "lib.dll"), destination="bin\\lib"),
+               FileEntry(source=str(sources / "help.chm"), destination="help", components="help"),
+               FileEntry(source=str(sources / "english.chm"), destination="Help\\en", components="help\\english"),
+               FileEntry(source=str(sources / "data.bin"), destination="data", components="data",
+                         flags=[FileFlags.EXTERNAL]),
+               FileEntry(source="{src}\\extra.bin", destination="data", flags="external"),
+               FileEntry(source=str(sources / "*.txt"), destination="docs")],
+    )
+
+
+class TestSizeRollup:
+    def test_totals(self, installer):
+        rollup = size_rollup(installer)
+        assert rollup.total_bytes == 6370
+        assert rollup.external_bytes == 5000
+        assert rollup.unsized == [5, 6]
+        assert rollup.file_sizes[:5] == [1000, 300, 50, 20, 5000]
+
+    def test_components_roll_up_into_parents(self, installer):
+        components = size_rollup(installer).components
+        assert components == {'main': 1000, 'help': 70, 'help\\english': 20, 'data': 5000}
+
+    def test_directories_include_subdirectories(self, installer):
+        directories = size_rollup(installer).directories
+        assert directories[''] == 6370
+        assert directories['bin'] == directories['bin\\lib'] == 300
+        # destinations are case-insensitive and keep their first spelling
+        assert directories['help'] == 70
+        assert directories['help\\en'] == 20
+
+    def test_types_count_each_file_once(self, installer):
+        types = size_rollup(installer).types
+        # files without components are installed with every type
+        assert types == {'full': 6370, 'compact': 1300}
+
+    def test_expressions(self, sources):
+        installer = Installer(components=[Component(name="a"), Component(name="b"), Component(name="c")],
+                              files=[FileEntry(source=str(sources / "app.exe"), destination="",
+                                               components="(a or B) and not c")])
+        assert size_rollup(installer).components == {'a': 1000, 'b': 1000}
+
+    def test_unchanged_without_fill(self, installer):
+        size_rollup(installer)
+        assert installer.files[4].external_size == ""
+        assert installer.components[3].extra_disk_space_required == "123"
+
+    def test_fill_external_size(self, installer, compiler):
+        size_rollup(installer, fill_external_size=True, fill_extra_disk_space=True)
+        assert installer.files[4].external_size == "5000"
+        assert installer.files[5].external_size == ""
+        # the external bytes are already accounted for, so the component keeps its own value
+        assert installer.components[3].extra_disk_space_required == "123"
+        assert "ExternalSize: 5000" in installer.render(compiler)
+
+    def test_fill_extra_disk_space(self, installer):
+        size_rollup(installer, fill_extra_disk_space=True)
+        assert [component.extra_disk_space_required for component in installer.components] == ["", "", "", "5000"]
+
+    def test_fill_extra_disk_space_keeps_other_components(self, installer):
+        installer.components[0].extra_disk_space_required = "4096"
+        size_rollup(installer, fill_extra_disk_space=True)
+        assert installer.components[0].extra_disk_space_required == "4096"
+        assert installer.components[3].extra_disk_space_required == "5000"
+
+    def test_directories_of_a_scan(self, tmp_path):
+        for name, size in (("root.txt", 3), ("a/b/deep.bin", 7), ("a/mid.bin", 2), ("c/side.bin", 5)):
+            (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / name).write_bytes(b"x" * size)
+        directories = size_rollup(Installer(files=list(all_files(tmp_path)))).directories
+        assert directories == {'': 17, 'a': 9, 'a\\b': 7, 'c': 5}
+
+    def test_report(self, installer):
+        rollup = size_rollup(installer)
+        data = json.loads(json.dumps(rollup.to_dict()))
+        assert list(data['components']) == ["data", "main", "help", "help\\english"]
+        summary = rollup.summary(top=1)
+        assert "payload: 6370 bytes (5000 external, 2 files unsized)" in summary
+        assert "{app}" in summary
+
+
+class TestStatCache:
+    def test_cached_paths_not_stated_again(self, installer, monkeypatch):
+        cache = {}
+        size_rollup(installer, stat_cache=cache)
+        assert len(cache) == 6
+        calls = []
+        real_stat = innosetup_builder.os.stat
+        monkeypatch.setattr(innosetup_builder.os, "stat", lambda path: calls.append(path) or real_stat(path))
+        assert size_rollup(installer, stat_cache=cache).total_bytes == 6370
+        assert calls == []
+        stat_paths([installer.files[0].source, "elsewhere"], cache=cache)
+        assert calls == ["elsewhere"]
+
+
+class TestSizesCommand:
+    def test_cli(self, tmp_path, sources, capsys):
+        script = tmp_path / "setup.iss"
+        script.write_text('[Files]\nSource: "{}"; DestDir: "{{app}}\\bin"\n'.format(sources / "app.exe"))
+        assert main(["sizes", str(script), "--json"]) == 0
+        assert json.loads(capsys.readouterr().out)['directories'] == {'': 1000, 'bin': 1000}
@@ -0,0 +1,115 @@
+"""Tests for pre-flight validation."""
+
+import pytest
+from innosetup_builder import (Component, ComponentType, DirEntry, FileEntry, FileFlags, Installer, InnosetupCompiler,
+                               RegistryEntry, ValidationError, main, stat_paths, validate_installer)
+
+from tests.benchmark import make_stand_in_iscc
+
+
+@pytest.fixture
+def sources(write_tree):
+    return write_tree({name: name for name in ("app.exe", "help.chm", "lib.dll")})
+
+
+def messages(issues, severity="error"):
+    return [issue.message for issue in issues if issue.severity == severity]
+
+
+class TestValidateInstaller:
+    def test_valid_installer(self, sources):
+        installer = Installer(
+            app_name="App",
+            component_types=[ComponentType(name="full"), ComponentType(name="custom", flags="iscustom")],
+            components=[Component(name="main", types="full custom"), Component(name="help", types="full")],
+            files=[FileEntry(source=str(sources / "app.exe"), destination="", components="main"),
+                   FileEntry(source=str(sources / "help.chm"), destination="help", components="help")],
+            dirs=[DirEntry(name="{app}\\data", components="main or help")],
+        )
+        assert validate_installer(installer) == []
+
+    def test_unknown_component_references(self, sources):
+        installer = Installer(
+            components=[Component(name="main"), Component(name="help\\english")],
+            files=[FileEntry(source=str(sources / "app.exe"), destination="", components="mian")],
+            dirs=[DirEntry(name="{app}\\docs", components="(main or help\\english) and not extras")],
+            registry_entries=[RegistryEntry(subkey="Software\\App", components="Main")],
+        )
+        assert messages(validate_installer(installer)) == ["unknown component 'mian'", "unknown component 'extras'"]
+
+    def test_unknown_type_reference(self):
+        installer = Installer(component_types=[ComponentType(name="full")],
+                              components=[Component(name="main", types="full compact")])
+        assert messages(validate_installer(installer)) == ["main uses unknown type 'compact'"]
+
+    def test_duplicate_destinations(self, sources):
+        installer = Installer(
+            components=[Component(name="a"), Component(name="b")],
+            files=[FileEntry(source=str(sources / "app.exe"), destination="bin"),
+                   FileEntry(source=str(sources / "lib.dll"), destination="BIN", dest_name="APP.EXE"),
+                   FileEntry(source=str(sources / "lib.dll"), destination="x", dest_name="y", components="a"),
+                   FileEntry(source=str(sources / "help.chm"), destination="x", dest_name="y", components="b")],
+        )
+        issues = validate_installer(installer)
+        assert [(issue.severity, issue.index) for issue in issues] == [("error", 1), ("warning", 3)]
+
+    def test_duplicate_destinations_spelled_differently(self, sources):
+        installer = Installer(files=[FileEntry(source=str(sources / "app.exe"), destination="."),
+                                     FileEntry(source=str(sources / "app.exe"), destination=""),
+                                     FileEntry(source=str(sources / "lib.dll"), destination="a/b"),
+                                     FileEntry(source=str(sources / "lib.dll"), destination="a\\b")])
+        issues = validate_installer(installer)
+        assert [(issue.severity, issue.index) for issue in issues] == [("error", 1), ("error", 3)]
+        assert issues[1].message.endswith("already used by files[2]")
+
+    def test_missing_sources(self, sources):
+        installer = Installer(files=[
+            FileEntry(source=str(sources / "missing.exe"), destination=""),
+            FileEntry(source=str(sources / "optional.dll"), destination="", flags=[FileFlags.SKIP_IF_SOURCE_DOESNT_EXIST]),
+            FileEntry(source="{src}\\external.dat", destination="", dest_name="external.dat", flags="external"),
+            FileEntry(source=str(sources / "*.txt"), destination="docs"),
+        ])
+        issues = validate_installer(installer)
+        assert [(issue.section, issue.index) for issue in issues] == [("files", 0)]
+        assert validate_installer(installer, check_sources=False) == []
+
+    def test_missing_license_file(self, tmp_path):
+        issues = validate_installer(Installer(license_file=str(tmp_path / "license.txt")))
+        assert issues[0].section == "setup"
+
+    def test_path_length(self, sources):
+        installer = Installer(app_name="App", files=[
+            FileEntry(source=str(sources / "app.exe"), destination="\\".join(["directory"] * 30))])
+        issues = validate_installer(installer)
+        assert [issue.severity for issue in issues] == ["warning"]
+        assert "installed path" in issues[0].message
+
+
+class TestStatPaths:
+    def test_parallel_chunks(self, sources):
+        paths = [str(sources / "app.exe"), str(sources / "nope")] * 3000
+        stats = stat_paths(paths, chunk_size=100)
+        assert len(stats) == 2
+        assert stats[str(sources / "app.exe")].st_size == len("app.exe")
+        assert stats[str(sources / "nope")] is None
+
+
+class TestBuildValidation:
+    def test_build_refuses_invalid_installer(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        compiler = InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+        installer = Installer(app_name="App", multilingual=False,
+                              files=[FileEntry(source=str(tmp_path / "missing.exe"), destination="")])
+        with pytest.raises(ValidationError) as raised:
+            compiler.build(installer, tmp_path / "installer.exe", validate=True)
+        assert raised.value.issues[0].index == 0
+        assert not (tmp_path / "installer.exe").exists()
+        # without validation ISCC is left to find out
+        compiler.build(installer, tmp_path / "installer.exe")
+        assert (tmp_path / "installer.exe").exists()
+
+    def test_cli(self, tmp_path, sources, capsys):
+        script = tmp_path / "setup.iss"
+        script.write_text('[Files]\nSource: "{}"; DestDir: "{{app}}"; Components: nope\n'.format(sources / "app.exe"))
+        assert main(["validate", str(script)]) == 1
+        assert "unknown component 'nope'" in capsys.readouterr().out
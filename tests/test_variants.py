@@ -0,0 +1,101 @@
+"""Tests for building several variants from one rendered script."""
+
+import pytest
+from innosetup_builder import (Component, FileEntry, Installer, InnosetupCompiler, RegistryEntry, ValidationError,
+                               Variant, render_variants, validate_variants)
+
+from tests.benchmark import make_stand_in_iscc
+
+
+@pytest.fixture
+def installer():
+    return Installer(
+        app_name="App",
+        multilingual=False,
+        output_base_filename="app",
+        components=[Component(name="main")],
+        files=[FileEntry(source="app.exe", destination="", components="main")],
+    )
+
+
+@pytest.fixture
+def variants():
+    return [
+        Variant(name="pro-x64", defines={'ARCH': "x64"},
+                setup={'OutputBaseFilename': "app-pro", 'ArchitecturesAllowed': "x64compatible"},
+                files=[FileEntry(source="pro.dll", destination="")],
+                registry_entries=[RegistryEntry(subkey="Software\\App", value_type="string", value_name="Edition",
+                                                value_data="Pro")]),
+        Variant(name="basic", setup={'outputbasefilename': "app-basic"}),
+    ]
+
+
+class TestVariant:
+    def test_define_and_options(self, variants):
+        assert variants[0].define == "VARIANT_PRO_X64"
+        assert variants[0].iscc_options() == ["/DVARIANT_PRO_X64", "/DARCH=x64"]
+        assert variants[1].iscc_options() == ["/DVARIANT_BASIC"]
+
+
+class TestRenderVariants:
+    def test_shared_rows_and_blocks(self, installer, variants, compiler):
+        script = render_variants(installer, variants, compiler)
+        assert script.count('Source: "app.exe"') == 1
+        assert '#ifdef VARIANT_PRO_X64\nSource: "pro.dll"; DestDir: "{app}"\n#endif\n' in script
+        # the registry section exists only for the variant which needs it
+        assert '[Registry]\n#ifdef VARIANT_PRO_X64\nRoot: HKLM; Subkey: "Software\\App"' in script
+
+    def test_setup_overrides(self, installer, variants, compiler):
+        script = render_variants(installer, variants, compiler)
+        assert ("#if defined(VARIANT_PRO_X64)\nOutputBaseFilename=app-pro\n"
+                "#elif defined(VARIANT_BASIC)\nOutputBaseFilename=app-basic\n"
+                "#else\nOutputBaseFilename=app\n#endif") in script
+        assert "#if defined(VARIANT_PRO_X64)\nArchitecturesAllowed=x64compatible\n#endif" in script
+        assert script.index("ArchitecturesAllowed") < script.index("[Components]")
+
+    def test_without_variants_same_as_render(self, installer, compiler):
+        assert render_variants(installer, [], compiler) == installer.render(compiler)
+
+    def test_duplicate_names_rejected(self, installer, compiler):
+        with pytest.raises(ValueError):
+            render_variants(installer, [Variant(name="a-b"), Variant(name="A_B")], compiler)
+
+
+class TestValidateVariants:
+    def test_variant_issues_are_prefixed(self, installer):
+        variants = [Variant(name="pro", files=[FileEntry(source="App.exe", destination="", components="main"),
+                                               FileEntry(source="x.dll", destination="", components="extras")],
+                            components=[Component(name="extras", types="missing")])]
+        issues = validate_variants(installer, variants, check_sources=False)
+        assert [(issue.section, issue.index) for issue in issues] == [("pro:components", 0), ("pro:files", 0)]
+        assert "shared files[0]" in issues[1].message
+
+    def test_variant_components_usable(self, installer):
+        variants = [Variant(name="pro", components=[Component(name="extras")],
+                            files=[FileEntry(source="x.dll", destination="", components="main or extras")])]
+        assert validate_variants(installer, variants, check_sources=False) == []
+
+
+class TestBuildVariants:
+    @pytest.fixture
+    def compiler(self, tmp_path):
+        make_stand_in_iscc(tmp_path / "innosetup")
+        return InnosetupCompiler(base_path=str(tmp_path / "innosetup"))
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_each_variant_preprocessed(self, compiler, installer, variants, tmp_path, monkeypatch, max_workers):
+        monkeypatch.setenv("STAND_IN_ISCC_SAVE", "1")
+        outputs = compiler.build_variants(installer, variants, tmp_path / "out", max_workers=max_workers)
+        assert outputs == {'pro-x64': tmp_path / "out" / "pro-x64.exe", 'basic': tmp_path / "out" / "basic.exe"}
+        pro = (tmp_path / "out" / "pro-x64.exe.iss").read_text()
+        basic = (tmp_path / "out" / "basic.exe.iss").read_text()
+        assert "OutputBaseFilename=app-pro" in pro and "pro.dll" in pro and "#" not in pro
+        assert "OutputBaseFilename=app-basic" in basic and "pro.dll" not in basic
+        assert outputs['pro-x64'].read_bytes() != outputs['basic'].read_bytes()
+
+    def test_validation_runs_before_any_compile(self, compiler, installer, tmp_path):
+        variants = [Variant(name="pro", files=[FileEntry(source=str(tmp_path / "missing.dll"), destination="")])]
+        installer.files = []
+        with pytest.raises(ValidationError):
+            compiler.build_variants(installer, variants, tmp_path / "out", validate=True)
+        assert not (tmp_path / "out").exists()